@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
 import numpy as np
-from skimage.transform import rescale, resize
+from scipy import ndimage as ndi
+from skimage import morphology
+from skimage.filters import threshold_otsu
+from skimage.transform import rescale, resize, downscale_local_mean
 
 # AxonDeepSeg imports
 import AxonDeepSeg.ads_utils as ads
 from AxonDeepSeg.ads_utils import convert_path
 from AxonDeepSeg.network_construction import uconv_net
 from AxonDeepSeg.visualization.get_masks import get_masks
-from AxonDeepSeg.patch_management_tools import im2patches_overlap, patches2im_overlap
+from AxonDeepSeg.patch_management_tools import im2patches_overlap, patches2im_overlap, get_tiles, get_roi_context
 from AxonDeepSeg.config_tools import update_config, default_configuration
 from config import axonmyelin_suffix
 
@@ -20,7 +23,8 @@ import tensorflow as tf
 
 def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder, config_dict, ckpt_name='model',
                   inference_batch_size=1, overlap_value=25, resampled_resolutions=[0.1],
-                  prediction_proba_activate=False, gpu_per=1.0, verbosity_level=0):
+                  prediction_proba_activate=False, tissue_detection=False, tile_size=None, callback=None,
+                  n_readers=0, cache=None, gpu_per=1.0, verbosity_level=0):
     """
     Preprocesses the images, transform them into patches, applies the network, stitches the predictions and return them.
     :param path_acquisitions: List of path to the acquisitions.
@@ -32,6 +36,16 @@ def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder
     :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
     :param resampled_resolutions: List of resolutions (flaots) to resample to before performing inference.
     :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
+    :param tissue_detection: Boolean, whether to only apply the network on the patches intersecting the tissue. The
+    other patches are labelled as background.
+    :param tile_size: Int, if not None, the acquisitions are processed one tile after the other, each tile having a
+    side of tile_size pixels at the resampled resolution. This bounds the memory used for very large acquisitions.
+    :param callback: Function, if not None, it is called with each event of segment_progressively as soon as it is
+    available, e.g. to display the segmentation of each batch. Not available with tissue_detection or tile_size.
+    :param n_readers: Int, if positive, number of processes reading and resampling the acquisitions while the network
+    segments them. The patches are handed over through shared memory. Only available for the plain segmentation.
+    :param cache: ResampledAcquisitionCache, if not None the resampled acquisitions are read from and added to this
+    cache. Not available with tile_size.
     :param gpu_per: Float, percentage of GPU to use if we use it.
     :param verbosity_level: Int, how much information to display.
     :return: List of segmentations, and list of probability maps if requested.
@@ -52,20 +66,171 @@ def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder
     patch_size = config_dict["trainingset_patchsize"]
     n_classes = config_dict["n_classes"]
 
-    # STEP 1: Load and rescale the acquisitions, and transform them into patches.
-
-    rs_acquisitions, rs_coeffs, original_acquisitions_shapes = load_acquisitions(
-        path_acquisitions, acquisitions_resolutions, resampled_resolutions, verbose_mode=verbosity_level)
-
     # If we are unable to load the model, we return an error message
     if not path_model_folder.exists():
         print('Error: unable to find the requested model.')
         return [None] * len(path_acquisitions)
 
+    # Parallel reading: the acquisitions are loaded by reader processes while the network segments them
+    if n_readers > 0 and not (prediction_proba_activate or tissue_detection or tile_size is not None or callback):
+        from AxonDeepSeg.parallel_segmentation import segment_in_parallel
+        return segment_in_parallel(path_acquisitions, acquisitions_resolutions, path_model_folder, config_dict,
+                                   ckpt_name=ckpt_name, inference_batch_size=inference_batch_size,
+                                   overlap_value=overlap_value, resampled_resolutions=resampled_resolutions,
+                                   n_readers=n_readers, cache=cache, gpu_per=gpu_per,
+                                   verbosity_level=verbosity_level)
+
+    # Progressive processing: the results are given to the callback batch after batch
+    if callback is not None:
+        if tissue_detection or tile_size is not None:
+            raise ValueError("The callback can't be used with tissue detection or tiled processing.")
+
+        predictions = [None] * len(path_acquisitions)
+        predictions_proba = [None] * len(path_acquisitions)
+
+        for event in segment_progressively(path_acquisitions, acquisitions_resolutions, path_model_folder,
+                                           config_dict, ckpt_name=ckpt_name,
+                                           inference_batch_size=inference_batch_size, overlap_value=overlap_value,
+                                           resampled_resolutions=resampled_resolutions,
+                                           prediction_proba_activate=prediction_proba_activate, cache=cache,
+                                           gpu_per=gpu_per, verbosity_level=verbosity_level):
+            callback(*event)
+
+            # Event marking the end of an acquisition
+            if event[1] is None:
+                predictions[event[0]] = event[2]
+                if prediction_proba_activate:
+                    predictions_proba[event[0]] = event[3]
+
+        if prediction_proba_activate:
+            return predictions, predictions_proba
+        else:
+            return predictions
+
+    # Tiled processing: each acquisition is read, resampled and segmented one tile at a time.
+    if tile_size is not None:
+        # The tiles are resampled separately, there is no resampled acquisition to cache
+        if cache is not None:
+            raise ValueError("The cache of the resampled acquisitions can't be used with tiled processing.")
+
+        acquisitions_resolutions, resampled_resolutions = list(map(
+            ensure_list_type, [acquisitions_resolutions, resampled_resolutions]))
+
+        model, sess, pred, x = load_model(path_model_folder, config_dict, ckpt_name=ckpt_name, gpu_per=gpu_per,
+                                          verbosity_level=verbosity_level)
+
+        results = [segment_acquisition_by_tiles(path_acquisition, acquisitions_resolutions[i],
+                                                resampled_resolutions[i], model, sess, pred, x, config_dict,
+                                                tile_size, overlap_value=overlap_value,
+                                                inference_batch_size=inference_batch_size,
+                                                prediction_proba_activate=prediction_proba_activate,
+                                                tissue_detection=tissue_detection,
+                                                verbosity_level=verbosity_level)
+                   for i, path_acquisition in enumerate(path_acquisitions)]
+
+        # End of the inference step.
+        tf.reset_default_graph()
+
+        if prediction_proba_activate:
+            return [e[0] for e in results], [e[1] for e in results]
+        else:
+            return results
+
+    # STEP 1: Load and rescale the acquisitions, and transform them into patches.
+
+    rs_acquisitions, rs_coeffs, original_acquisitions_shapes = load_acquisitions(
+        path_acquisitions, acquisitions_resolutions, resampled_resolutions, cache=cache, verbose_mode=verbosity_level)
+
     L_data, L_n_patches, L_positions = prepare_patches(rs_acquisitions, patch_size, overlap_value)
 
+    # Coarse pass: only the patches that intersect the tissue are sent to the network
+    if tissue_detection:
+        L_tissue_masks = [detect_tissue(rs_acquisition) for rs_acquisition in rs_acquisitions]
+        L_inferred = select_tissue_patches(L_positions, L_tissue_masks, patch_size)
+        L_data = [patch for i, patch in enumerate(L_data) if L_inferred[i]]
+
+        print("Tissue detection: {0} of {1} patches ({2:.1%}) will be segmented.".format(
+            len(L_data), len(L_inferred), len(L_data) / max(len(L_inferred), 1)))
+
     # STEP 2: Construct Tensorflow's computing graph and restoration of the session
 
+    model, sess, pred, x = load_model(path_model_folder, config_dict, ckpt_name=ckpt_name, gpu_per=gpu_per,
+                                      verbosity_level=verbosity_level)
+
+    # STEP 3: Inference
+
+    if prediction_proba_activate:
+        predictions_list, predictions_proba_list = predict_patches(
+            model, sess, pred, x, L_data, patch_size, n_classes, inference_batch_size=inference_batch_size,
+            prediction_proba_activate=prediction_proba_activate, verbosity_level=verbosity_level)
+    else:
+        predictions_list = predict_patches(
+            model, sess, pred, x, L_data, patch_size, n_classes, inference_batch_size=inference_batch_size,
+            prediction_proba_activate=prediction_proba_activate, verbosity_level=verbosity_level)
+
+    # End of the inference step.
+    tf.reset_default_graph()
+
+    # The patches that were skipped by the tissue detection are filled with background
+    if tissue_detection:
+        inferred_predictions = iter(predictions_list)
+        background_prediction = np.zeros((patch_size, patch_size), dtype=np.uint8)
+        predictions_list = [next(inferred_predictions) if inferred else background_prediction
+                            for inferred in L_inferred]
+
+        if prediction_proba_activate:
+            inferred_predictions_proba = iter(predictions_proba_list)
+            background_prediction_proba = np.zeros((patch_size, patch_size, n_classes))
+            background_prediction_proba[:, :, 0] = 1
+            predictions_proba_list = [next(inferred_predictions_proba) if inferred else background_prediction_proba
+                                      for inferred in L_inferred]
+
+    # Now we have to transform the list of predictions in list of lists,
+    # one for each full image : we put in each sublist the patches corresponding to a full image.
+
+    ########### STEP 4: Reconstruction of the segmented patches into segmentations of acquisitions and
+    # resampling to the original size
+
+    if prediction_proba_activate:
+
+        predictions, predictions_proba = process_segmented_patches(predictions_list, L_n_patches, L_positions,
+                                                                   original_acquisitions_shapes,
+                                                                   overlap_value, n_classes,
+                                                                   predictions_proba_list=predictions_proba_list,
+                                                                   prediction_proba_activate=prediction_proba_activate,
+                                                                   verbose_mode=0)
+
+        return predictions, predictions_proba
+
+    else:
+        predictions = process_segmented_patches(predictions_list, L_n_patches, L_positions,
+                                                original_acquisitions_shapes,
+                                                overlap_value, n_classes,
+                                                predictions_proba_list=None,
+                                                prediction_proba_activate=prediction_proba_activate,
+                                                verbose_mode=0)
+
+        return predictions
+
+        #######################################################################################################################
+
+
+def load_model(path_model_folder, config_dict, ckpt_name='model', gpu_per=1.0, verbosity_level=0):
+    """
+    Constructs the Tensorflow graph of the network and restores the weights of a checkpoint in a new session.
+    :param path_model_folder: Path to the model folder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param ckpt_name: String, checkpoint to use.
+    :param gpu_per: Float, percentage of GPU to use if we use it.
+    :param verbosity_level: Int, how much information to display.
+    :return: The Keras model, the Tensorflow session, the prediction operator and the input placeholder.
+    """
+
+    # If string, convert to Path objects
+    path_model_folder = convert_path(path_model_folder)
+
+    patch_size = config_dict["trainingset_patchsize"]
+
     # Construction of the graph
     if verbosity_level >= 2:
         print("Graph construction ...")
@@ -75,7 +240,6 @@ def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder
     model = uconv_net(config_dict, bn_updated_decay=None, verbose=True)  # inference
     pred = model.output
 
-
     saver = tf.train.Saver()  # Load previous model
 
     # We limit the amount of GPU for inference
@@ -90,22 +254,41 @@ def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder
     model_previous_path = path_model_folder.joinpath(ckpt_name).with_suffix('.ckpt')
     saver.restore(sess, str(model_previous_path))
 
-    # STEP 3: Inference
+    return model, sess, pred, x
+
+
+def predict_patches(model, tf_session, tf_prediction_op, tf_input, L_data, patch_size, n_classes,
+                    inference_batch_size=1, prediction_proba_activate=False, callback=None, verbosity_level=0):
+    """
+    Applies the network on a list of patches, one batch after the other.
+    :param model: The Keras model, as returned by load_model.
+    :param tf_session: Current Tensorflow session.
+    :param tf_prediction_op: Tensorflow prediction operator.
+    :param tf_input: Tensorflow input placeholder.
+    :param L_data: List of patches to segment.
+    :param patch_size: Int, size of a patch.
+    :param n_classes: Int, number of classes.
+    :param inference_batch_size: Int, number of patches in each batch.
+    :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
+    :param callback: Function, if not None, it is called with the number of batches segmented and the total number
+    of batches after each batch. It can raise an exception to stop the inference.
+    :param verbosity_level: Int, how much information to display.
+    :return: List of segmented patches, and list of probability maps of the patches if requested.
+    """
 
     if verbosity_level >= 2:
         print("Beginning inference ...")
 
-    n_patches = len(L_data)
-    it, rem = divmod(n_patches, inference_batch_size)
+    n_batches = int(np.ceil(len(L_data) / float(inference_batch_size)))
 
     predictions_list = []
     predictions_proba_list = []
 
-    # Inference of complete batches
-    for i in range(it):
+    # The last batch is smaller if the number of patches isn't a multiple of the batch size
+    for i in range(n_batches):
 
         if verbosity_level >= 3:
-            print(('processing patch %s of %s' % (i + 1, it)))
+            print(('processing patch %s of %s' % (i + 1, n_batches)))
 
         batch_x = np.array(L_data[i * inference_batch_size:(i + 1) * inference_batch_size], dtype=np.uint8)
 
@@ -113,7 +296,7 @@ def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder
 
             # First we perform inference on the input.
             current_batch_prediction, current_batch_prediction_proba = perform_batch_inference(
-                model, sess, pred, x, batch_x, inference_batch_size, patch_size,
+                model, tf_session, tf_prediction_op, tf_input, batch_x, len(batch_x), patch_size,
                 n_classes, prediction_proba_activate=prediction_proba_activate)
 
             # Update of the predictions lists.
@@ -121,79 +304,320 @@ def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder
             predictions_proba_list.extend(current_batch_prediction_proba)
 
         else:
-            current_batch_prediction = perform_batch_inference(model, sess, pred, x, batch_x, inference_batch_size,
-                                                               patch_size, n_classes,
+            current_batch_prediction = perform_batch_inference(model, tf_session, tf_prediction_op, tf_input,
+                                                               batch_x, len(batch_x), patch_size, n_classes,
                                                                prediction_proba_activate=prediction_proba_activate)
             # Update of the predictions lists.
             predictions_list.extend(current_batch_prediction)
 
-    # Last batch if needed
+        if callback is not None:
+            callback(i + 1, n_batches)
 
-    if rem != 0:
+    if prediction_proba_activate:
+        return predictions_list, predictions_proba_list
+    else:
+        return predictions_list
 
-        if verbosity_level >= 4:
-            print('processing last patch')
 
-        batch_x = np.asarray(L_data[it * inference_batch_size:])
+def segment_acquisition_by_tiles(path_acquisition, acquisition_resolution, resampled_resolution, model, tf_session,
+                                 tf_prediction_op, tf_input, config_dict, tile_size, overlap_value=25,
+                                 inference_batch_size=1, prediction_proba_activate=False, tissue_detection=False,
+                                 verbosity_level=0):
+    """
+    Segments an acquisition one tile after the other, so that only one resampled tile and its patches are in memory
+    at the same time. Each tile is extended by a margin of context, and only its center is kept in the segmentation.
+    :param path_acquisition: Path to the acquisition.
+    :param acquisition_resolution: Float, the resolution the acquisition was acquired with.
+    :param resampled_resolution: Float, the resolution to resample to before performing inference.
+    :param model: The Keras model, as returned by load_model.
+    :param tf_session: Current Tensorflow session.
+    :param tf_prediction_op: Tensorflow prediction operator.
+    :param tf_input: Tensorflow input placeholder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param tile_size: Int, size of the side of the tiles, in pixels at the resampled resolution.
+    :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+    :param inference_batch_size: Int, batch size to use when doing inference.
+    :param prediction_proba_activate: Boolean, whether to compute the probability map or not.
+    :param tissue_detection: Boolean, whether to skip the tiles that don't intersect the tissue.
+    :param verbosity_level: Int, how much information to display.
+    :return: The segmentation of the acquisition, and its probability map if requested.
+    """
 
-        if prediction_proba_activate:
+    patch_size = config_dict["trainingset_patchsize"]
+    n_classes = config_dict["n_classes"]
 
-            # First we perform inference on the input.
-            current_batch_prediction, current_batch_prediction_proba = perform_batch_inference(model,
-                                                                                               sess, pred, batch_x, rem,
-                                                                                               patch_size,
-                                                                                               n_classes,
-                                                                                               prediction_proba_activate=prediction_proba_activate)
+    acquisition = ads.imread(convert_path(path_acquisition))
+    rs_coeff = acquisition_resolution / resampled_resolution
 
-            # Update of the predictions lists.
-            predictions_list.extend(current_batch_prediction)
-            predictions_proba_list.extend(current_batch_prediction_proba)
+    # Sizes at the original resolution. The context margin must contain the overlap used for the patches, and each
+    # tile must still be at least as large as a patch once resampled.
+    tile_size_original = max(1, int(tile_size / rs_coeff))
+    margin = int(np.ceil(overlap_value / rs_coeff))
+    min_size = int(np.ceil(patch_size / rs_coeff)) + 1
 
-        else:
-            current_batch_prediction = perform_batch_inference(model, sess, pred, batch_x, rem,
-                                                               patch_size, n_classes,
-                                                               prediction_proba_activate=prediction_proba_activate)
-            # Update of the predictions lists.
-            predictions_list.extend(current_batch_prediction)
+    prediction = np.zeros(acquisition.shape, dtype=np.uint8)
+    if prediction_proba_activate:
+        prediction_proba = np.zeros(acquisition.shape + (n_classes,), dtype=np.float32)
+        prediction_proba[:, :, 0] = 1
 
-    # End of the inference step.
-    tf.reset_default_graph()
+    if tissue_detection:
+        block_size = max(1, int(round(16 / rs_coeff)))
+        tissue_mask = detect_tissue(acquisition, downsampling_factor=block_size)
 
-    # Now we have to transform the list of predictions in list of lists,
-    # one for each full image : we put in each sublist the patches corresponding to a full image.
+    L_tiles = get_tiles(acquisition.shape, tile_size_original, margin=margin, min_size=min_size)
+    n_inferred_tiles = 0
 
-    ########### STEP 4: Reconstruction of the segmented patches into segmentations of acquisitions and
-    # resampling to the original size
+    for i, (tile, context) in enumerate(L_tiles):
+        h0, w0, h1, w1 = tile
+        ch0, cw0, ch1, cw1 = context
 
-    if prediction_proba_activate:
+        if tissue_detection and not tissue_mask[ch0 // block_size:-(-ch1 // block_size),
+                                                cw0 // block_size:-(-cw1 // block_size)].any():
+            continue
+        n_inferred_tiles += 1
 
-        predictions, predictions_proba = process_segmented_patches(predictions_list, L_n_patches, L_positions,
-                                                                   original_acquisitions_shapes,
-                                                                   overlap_value, n_classes,
-                                                                   predictions_proba_list=predictions_proba_list,
-                                                                   prediction_proba_activate=prediction_proba_activate,
-                                                                   verbose_mode=0)
+        if verbosity_level >= 2:
+            print("Segmenting tile {0} of {1} ...".format(i + 1, len(L_tiles)))
 
-        return predictions, predictions_proba
+        acquisition_tile = acquisition[ch0:ch1, cw0:cw1]
+        rs_tile = rescale(acquisition_tile, rs_coeff, preserve_range=True).astype(np.uint8)
 
+        L_data, L_n_patches, L_positions = prepare_patches([rs_tile], patch_size, overlap_value)
+
+        if prediction_proba_activate:
+            predictions_list, predictions_proba_list = predict_patches(
+                model, tf_session, tf_prediction_op, tf_input, L_data, patch_size, n_classes,
+                inference_batch_size=inference_batch_size, prediction_proba_activate=True)
+            tile_prediction, tile_prediction_proba = process_segmented_patches(
+                predictions_list, L_n_patches, L_positions, [acquisition_tile.shape], overlap_value, n_classes,
+                predictions_proba_list=predictions_proba_list, prediction_proba_activate=True)
+            prediction_proba[h0:h1, w0:w1] = tile_prediction_proba[0][h0 - ch0:h1 - ch0, w0 - cw0:w1 - cw0]
+        else:
+            predictions_list = predict_patches(
+                model, tf_session, tf_prediction_op, tf_input, L_data, patch_size, n_classes,
+                inference_batch_size=inference_batch_size)
+            tile_prediction = process_segmented_patches(
+                predictions_list, L_n_patches, L_positions, [acquisition_tile.shape], overlap_value, n_classes)
+
+        prediction[h0:h1, w0:w1] = tile_prediction[0][h0 - ch0:h1 - ch0, w0 - cw0:w1 - cw0]
+
+    if tissue_detection:
+        print("Tissue detection: {0} of {1} tiles ({2:.1%}) were segmented.".format(
+            n_inferred_tiles, len(L_tiles), n_inferred_tiles / max(len(L_tiles), 1)))
+
+    if prediction_proba_activate:
+        return prediction, prediction_proba
     else:
-        predictions = process_segmented_patches(predictions_list, L_n_patches, L_positions,
-                                                original_acquisitions_shapes,
-                                                overlap_value, n_classes,
-                                                predictions_proba_list=None,
-                                                prediction_proba_activate=prediction_proba_activate,
-                                                verbose_mode=0)
+        return prediction
 
-        return predictions
 
-        #######################################################################################################################
+def segment_roi(acquisition, roi, acquisition_resolution, path_model_folder, config_dict, ckpt_name='model',
+                inference_batch_size=1, overlap_value=25, resampled_resolution=0.1, gpu_per=1.0, callback=None,
+                verbosity_level=0):
+    """
+    Segments a region of interest of an acquisition. The region is extended by a margin of context equal to the
+    overlap, and only the region itself is returned.
+    :param acquisition: The acquisition, either as an array (e.g. the image displayed in a viewer, or a memory map,
+    so that only the region and its context are read) or as a path to the image.
+    :param roi: (h0, w0, h1, w1) coordinates of the region of interest in the acquisition.
+    :param acquisition_resolution: Float, the resolution the acquisition was acquired with.
+    :param path_model_folder: Path to the model folder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param ckpt_name: String, checkpoint to use.
+    :param inference_batch_size: Int, batch size to use when doing inference.
+    :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+    :param resampled_resolution: Float, the resolution to resample to before performing inference.
+    :param gpu_per: Float, percentage of GPU to use if we use it.
+    :param callback: Function, if not None, it is called after each batch of patches, see predict_patches.
+    :param verbosity_level: Int, how much information to display.
+    :return: The segmentation of the region of interest.
+    """
+
+    if not isinstance(acquisition, np.ndarray):
+        acquisition = ads.imread(convert_path(acquisition))
+
+    config_dict = update_config(default_configuration(), config_dict)
+    patch_size = config_dict["trainingset_patchsize"]
+    n_classes = config_dict["n_classes"]
+    rs_coeff = acquisition_resolution / resampled_resolution
+
+    # The context must contain the overlap once resampled, and be at least as large as a patch
+    h0, w0, h1, w1 = roi
+    margin = int(np.ceil(overlap_value / rs_coeff))
+    min_size = int(np.ceil(patch_size / rs_coeff)) + 1
+    ch0, cw0, ch1, cw1 = get_roi_context(roi, acquisition.shape, margin=margin, min_size=min_size)
+
+    acquisition_context = np.asarray(acquisition[ch0:ch1, cw0:cw1])
+    rs_context = rescale(acquisition_context, rs_coeff, preserve_range=True).astype(np.uint8)
+    L_data, L_n_patches, L_positions = prepare_patches([rs_context], patch_size, overlap_value)
+
+    model, sess, pred, x = load_model(path_model_folder, config_dict, ckpt_name=ckpt_name, gpu_per=gpu_per,
+                                      verbosity_level=verbosity_level)
+    try:
+        predictions_list = predict_patches(model, sess, pred, x, L_data, patch_size, n_classes,
+                                           inference_batch_size=inference_batch_size, callback=callback,
+                                           verbosity_level=verbosity_level)
+    finally:
+        # End of the inference step.
+        tf.reset_default_graph()
+
+    context_prediction = process_segmented_patches(predictions_list, L_n_patches, L_positions,
+                                                   [acquisition_context.shape], overlap_value, n_classes)[0]
+
+    return context_prediction[h0 - ch0:h1 - ch0, w0 - cw0:w1 - cw0]
+
+
+def segment_progressively(path_acquisitions, acquisitions_resolutions, path_model_folder, config_dict,
+                          ckpt_name='model', inference_batch_size=1, overlap_value=25, resampled_resolutions=[0.1],
+                          prediction_proba_activate=False, cache=None, gpu_per=1.0, verbosity_level=0):
+    """
+    Segments acquisitions like apply_convnet, but yields the results as soon as each batch of patches is segmented,
+    so that partial segmentations can be displayed or processed while the inference continues.
+    Two kinds of events are yielded, as tuples:
+    - (acquisition_index, tile_bbox, label_tile), for each patch of the batch. tile_bbox is the (h0, w0, h1, w1)
+      region of the original acquisition predicted by the patch, and label_tile is its segmentation, resampled to
+      the original resolution.
+    - (acquisition_index, None, segmentation), once all the patches of an acquisition are segmented. segmentation is
+      the full stitched segmentation, identical to the one returned by apply_convnet.
+    When prediction_proba_activate is True, the probability map of the tile or of the acquisition is added at the end
+    of each event.
+    :param path_acquisitions: List of path to the acquisitions.
+    :param acquisitions_resolutions: List of the acquisitions resolutions (floats).
+    :param path_model_folder: Path to the model folder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param ckpt_name: String, checkpoint to use.
+    :param inference_batch_size: Int, batch size to use when doing inference.
+    :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+    :param resampled_resolutions: List of resolutions (flaots) to resample to before performing inference.
+    :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
+    :param cache: ResampledAcquisitionCache, if not None the resampled acquisitions are read from and added to this
+    cache.
+    :param gpu_per: Float, percentage of GPU to use if we use it.
+    :param verbosity_level: Int, how much information to display.
+    :return: Generator of the events described above.
+    """
+
+    # If string, convert to Path objects
+    path_acquisitions = convert_path(path_acquisitions)
+    path_model_folder = convert_path(path_model_folder)
+
+    from logging import ERROR
+    tf.logging.set_verbosity(ERROR)
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    patch_size = config_dict["trainingset_patchsize"]
+    n_classes = config_dict["n_classes"]
+
+    if not path_model_folder.exists():
+        print('Error: unable to find the requested model.')
+        return
+
+    rs_acquisitions, rs_coeffs, original_acquisitions_shapes = load_acquisitions(
+        path_acquisitions, acquisitions_resolutions, resampled_resolutions, cache=cache, verbose_mode=verbosity_level)
+    L_data, L_n_patches, L_positions = prepare_patches(rs_acquisitions, patch_size, overlap_value)
+    L_rs_shapes = [rs_acquisition.shape for rs_acquisition in rs_acquisitions]
+    del rs_acquisitions
+
+    # Acquisition index and patch index in that acquisition, for each patch of L_data
+    L_patch_ids = [(i, j) for i, n_patches in enumerate(L_n_patches) for j in range(n_patches)]
+    L_n_patches_cum = np.cumsum([0] + L_n_patches)
+
+    model, sess, pred, x = load_model(path_model_folder, config_dict, ckpt_name=ckpt_name, gpu_per=gpu_per,
+                                      verbosity_level=verbosity_level)
+
+    predictions_list = [None] * len(L_data)
+    predictions_proba_list = [None] * len(L_data)
+    n_batches = int(np.ceil(len(L_data) / float(inference_batch_size)))
+
+    try:
+        for b in range(n_batches):
+            i0, i1 = b * inference_batch_size, min((b + 1) * inference_batch_size, len(L_data))
+
+            if prediction_proba_activate:
+                batch_predictions, batch_predictions_proba = predict_patches(
+                    model, sess, pred, x, L_data[i0:i1], patch_size, n_classes,
+                    inference_batch_size=inference_batch_size, prediction_proba_activate=True)
+                predictions_proba_list[i0:i1] = batch_predictions_proba
+            else:
+                batch_predictions = predict_patches(model, sess, pred, x, L_data[i0:i1], patch_size, n_classes,
+                                                    inference_batch_size=inference_batch_size)
+            predictions_list[i0:i1] = batch_predictions
+
+            for k in range(i0, i1):
+                i, j = L_patch_ids[k]
+                tile_bbox, rs_bbox = get_patch_prediction_window(L_positions[i][j], L_positions[i], L_rs_shapes[i],
+                                                                 original_acquisitions_shapes[i], patch_size,
+                                                                 overlap_value)
+                (r0, c0, r1, c1), (h, w) = rs_bbox, (tile_bbox[2] - tile_bbox[0], tile_bbox[3] - tile_bbox[1])
+                label_tile = resize(predictions_list[k][r0:r1, c0:c1], (h, w), order=0,
+                                    preserve_range=True).astype(np.uint8)
+
+                if prediction_proba_activate:
+                    proba_tile = resize(predictions_proba_list[k][r0:r1, c0:c1], (h, w, n_classes),
+                                        preserve_range=True)
+                    yield i, tile_bbox, label_tile, proba_tile
+                else:
+                    yield i, tile_bbox, label_tile
+
+            # The acquisitions whose last patch was in this batch are complete
+            for i in range(L_patch_ids[i0][0], L_patch_ids[i1 - 1][0] + 1):
+                if L_n_patches_cum[i + 1] > i1:
+                    continue
+                p0, p1 = L_n_patches_cum[i], L_n_patches_cum[i + 1]
+
+                result = process_segmented_patches(predictions_list[p0:p1], [L_n_patches[i]], [L_positions[i]],
+                                                   [original_acquisitions_shapes[i]], overlap_value, n_classes,
+                                                   predictions_proba_list=predictions_proba_list[p0:p1],
+                                                   prediction_proba_activate=prediction_proba_activate)
+
+                # The patches of a finished acquisition are not needed anymore
+                predictions_list[p0:p1] = [None] * (p1 - p0)
+                predictions_proba_list[p0:p1] = [None] * (p1 - p0)
+
+                if prediction_proba_activate:
+                    yield i, None, result[0][0], result[1][0]
+                else:
+                    yield i, None, result[0]
+    finally:
+        tf.reset_default_graph()
+
+
+def get_patch_prediction_window(position, L_positions, rs_shape, original_shape, patch_size, overlap_value=25):
+    """
+    Computes the region of an acquisition predicted by a patch, i.e. the center of the patch, extended to the border
+    of the acquisition for the patches on the border, as done when stitching the patches.
+    :param position: Position of the patch in the resampled acquisition.
+    :param L_positions: List of the positions of all the patches of the acquisition.
+    :param rs_shape: Shape of the resampled acquisition.
+    :param original_shape: Shape of the original acquisition.
+    :param patch_size: Int, size of a patch.
+    :param overlap_value: Int, number of pixels to overlap.
+    :return: The (h0, w0, h1, w1) region in the original acquisition, and the corresponding region in the patch.
+    """
+
+    h_l, w_l = np.max(np.stack(L_positions), axis=0)
+    window = []
+
+    for axis, last_position in enumerate((h_l, w_l)):
+        start = 0 if position[axis] == 0 else overlap_value
+        end = patch_size if position[axis] == last_position else patch_size - overlap_value
+        window.append((start, end))
+
+    # Conversion to the original resolution
+    rs_coeffs = [float(original_shape[axis]) / rs_shape[axis] for axis in range(2)]
+    tile_bbox = [int(round((position[axis] + window[axis][k]) * rs_coeffs[axis])) for k in range(2) for axis in range(2)]
+    tile_bbox = [min(tile_bbox[k], original_shape[k % 2]) for k in range(4)]
+
+    return tuple(tile_bbox), (window[0][0], window[1][0], window[0][1], window[1][1])
 
 
 def axon_segmentation(path_acquisitions_folders, acquisitions_filenames, path_model_folder, config_dict,
                       ckpt_name='model',
                       segmentations_filenames=[str(axonmyelin_suffix)], inference_batch_size=1,
                       overlap_value=25, resampled_resolutions=0.1, acquired_resolution=None,
-                      prediction_proba_activate=False, write_mode=True, gpu_per=1.0, verbosity_level=0):
+                      prediction_proba_activate=False, write_mode=True, tissue_detection=False, tile_size=None,
+                      n_readers=0, cache=None, callback=None, gpu_per=1.0, verbosity_level=0):
     """
     Wrapper performing the segmentation of all the requested acquisitions and generates (if requested) the segmentation
     images.
@@ -206,9 +630,17 @@ def axon_segmentation(path_acquisitions_folders, acquisitions_filenames, path_mo
     :param inference_batch_size: Size of the batches fed to the network.
     :param overlap_value: Int, number of pixels to use for overlapping the predictions.
     :param resampled_resolutions: List of the resolutions (in µm) to resample to.
-    :param acquired_resolution: List of the resolutions (in µm) for native images.
+    :param acquired_resolution: Resolution (in µm) of the native images, or list with one resolution per image.
     :param prediction_proba_activate: Boolean, whether to compute probability maps or not.
     :param write_mode: Boolean, whether to create segmentation images or not.
+    :param tissue_detection: Boolean, whether to only segment the patches intersecting the tissue.
+    :param tile_size: Int, if not None, size (in pixels at the resampled resolution) of the tiles used to segment the
+    acquisitions one part after the other.
+    :param n_readers: Int, number of processes reading the acquisitions in parallel with the inference (0 to read
+    them in the main process).
+    :param cache: ResampledAcquisitionCache, if not None the resampled acquisitions are read from and added to this
+    cache.
+    :param callback: Function, if not None, it is called with each event of segment_progressively, see apply_convnet.
     :param gpu_per: Percentage of the GPU to use, if we use it.
     :param verbosity_level: Int, level of verbosity. The higher, the more information is displayed.
     :return: List of predictions, and optionally of probability maps.
@@ -246,6 +678,12 @@ def axon_segmentation(path_acquisitions_folders, acquisitions_filenames, path_mo
                             "containing the pixel size value."
             raise Exception(exception_msg)
 
+    # If resolutions are specified for each acquisition, use them
+    elif isinstance(acquired_resolution, list):
+        if len(acquired_resolution) != len(path_acquisitions_folders):
+            raise ValueError("The number of acquired resolutions must match the number of acquisitions.")
+        acquisitions_resolutions = acquired_resolution
+
     # If resolution is specified as input argument, use it
     else:
         acquisitions_resolutions = [acquired_resolution] * len(path_acquisitions_folders)
@@ -261,13 +699,17 @@ def axon_segmentation(path_acquisitions_folders, acquisitions_filenames, path_mo
                                                      overlap_value=overlap_value,
                                                      resampled_resolutions=resampled_resolutions,
                                                      prediction_proba_activate=prediction_proba_activate,
-                                                     gpu_per=gpu_per, verbosity_level=verbosity_level)
+                                                     tissue_detection=tissue_detection, tile_size=tile_size,
+                                                     callback=callback, cache=cache, gpu_per=gpu_per,
+                                                     verbosity_level=verbosity_level)
         # Predictions are shape of image, value = class of pixel
     else:
         prediction = apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder, config_dict,
                                    ckpt_name=ckpt_name, inference_batch_size=inference_batch_size,
                                    overlap_value=overlap_value, resampled_resolutions=resampled_resolutions,
-                                   prediction_proba_activate=prediction_proba_activate, gpu_per=gpu_per,
+                                   prediction_proba_activate=prediction_proba_activate,
+                                   tissue_detection=tissue_detection, tile_size=tile_size, callback=callback,
+                                   n_readers=n_readers, cache=cache, gpu_per=gpu_per,
                                    verbosity_level=verbosity_level)
         # Predictions are shape of image, value = class of pixel
 
@@ -306,12 +748,15 @@ def ensure_list_type(elem):
     return elem
 
 
-def load_acquisitions(path_acquisitions, acquisitions_resolutions, resampled_resolutions, verbose_mode=0):
+def load_acquisitions(path_acquisitions, acquisitions_resolutions, resampled_resolutions, cache=None,
+                      verbose_mode=0):
     """
     Load and resamples acquisitions located in the indicated folders' paths.
     :param path_acquisitions: List of paths to the acquisitions images.
     :param acquisitions_resolutions: List of float containing the resolutions the acquisitions were acquired with.
     :param resampled_resolutions: List of resolutions (floats) to resample to.
+    :param cache: ResampledAcquisitionCache, if not None the resampled acquisitions are read from and added to this
+    cache.
     :param verbose_mode: Int, how much information to display.
     :return:
     """
@@ -322,29 +767,36 @@ def load_acquisitions(path_acquisitions, acquisitions_resolutions, resampled_res
         ensure_list_type, [path_acquisitions, acquisitions_resolutions, resampled_resolutions]))
 
     if verbose_mode >= 2:
-        print("Loading acquisitions ...")
+        print("Loading acquisitions and rescaling them to the target resolution ...")
 
-    # Reading acquisitions images and loading them in the RAM, with their respective acquisition resolution.
-    # Then resampling the acquisitions images to the target resolution that the network uses.
+    # Reading acquisitions images one after the other, with their respective acquisition resolution, and resampling
+    # them to the target resolution that the network uses.
 
-    original_acquisitions, resampled_acquisitions, original_acquisitions_shapes = [], [], []
+    resampled_acquisitions, original_acquisitions_shapes = [], []
 
-    for path_img in path_acquisitions:
+    resampling_coeffs = [current_acquisition_resolution / resampled_resolutions[i]
+                         for i, current_acquisition_resolution in enumerate(acquisitions_resolutions)]
 
-        original_acquisitions.append(ads.imread(path_img))
-        original_acquisitions_shapes.append(original_acquisitions[-1].shape)
+    for i, path_img in enumerate(path_acquisitions):
 
-    # Resampling acquisitions to the target resolution
+        # Acquisitions resampled by a previous run are read from the cache
+        if cache is not None:
+            key = cache.get_key(path_img, resampling_coeffs[i])
+            resampled_acquisition, original_shape = cache.get(path_img, resampling_coeffs[i], key=key)
+            if resampled_acquisition is not None:
+                resampled_acquisitions.append(resampled_acquisition)
+                original_acquisitions_shapes.append(original_shape)
+                continue
 
-    if verbose_mode >= 2:
-        print("Rescaling acquisitions to the target resolution ...")
+        original_acquisition = ads.imread(path_img)
+        resampled_acquisition = rescale(original_acquisition, resampling_coeffs[i],
+                                        preserve_range=True).astype(np.uint8)
 
-    resampling_coeffs = [current_acquisition_resolution / resampled_resolutions[i]
-                         for i, current_acquisition_resolution in enumerate(acquisitions_resolutions)]
+        if cache is not None:
+            cache.put(path_img, resampling_coeffs[i], resampled_acquisition, original_acquisition.shape, key=key)
 
-    for i, current_original_acquisition in enumerate(original_acquisitions):
-        resampled_acquisitions.append(rescale(current_original_acquisition, resampling_coeffs[i],
-                                              preserve_range=True).astype(int))
+        resampled_acquisitions.append(resampled_acquisition)
+        original_acquisitions_shapes.append(original_acquisition.shape)
 
     return resampled_acquisitions, resampling_coeffs, original_acquisitions_shapes
 
@@ -384,6 +836,53 @@ def prepare_patches(resampled_acquisitions, patch_size, overlap_value=25):
     return L_data, L_n_patches, L_positions
 
 
+def detect_tissue(acquisition, downsampling_factor=16):
+    """
+    Builds a coarse mask of the tissue of a bright field acquisition, on which the tissue is darker than the background.
+    The acquisition is averaged over blocks of pixels, thresholded with Otsu's method and the holes of the tissue are
+    filled. The mask is then dilated by one block so that the borders of the tissue are kept.
+    :param acquisition: Resampled acquisition image.
+    :param downsampling_factor: Int, size (in pixels) of the side of the blocks.
+    :return: Boolean thumbnail of the tissue, each pixel corresponding to one block of the acquisition.
+    """
+
+    thumbnail = downscale_local_mean(acquisition.astype(np.float32), (downsampling_factor, downsampling_factor))
+
+    # A uniform image can't be thresholded, so all of it is kept
+    if thumbnail.min() == thumbnail.max():
+        return np.ones(thumbnail.shape, dtype=bool)
+
+    tissue_mask = thumbnail < threshold_otsu(thumbnail)
+    tissue_mask = ndi.binary_fill_holes(tissue_mask)
+    tissue_mask = morphology.remove_small_objects(tissue_mask, min_size=4)
+    tissue_mask = ndi.binary_dilation(tissue_mask, iterations=1)
+
+    return tissue_mask
+
+
+def select_tissue_patches(L_positions, L_tissue_masks, patch_size, downsampling_factor=16):
+    """
+    Finds the patches that intersect the tissue.
+    :param L_positions: List of positions of the patches of each acquisition, as returned by prepare_patches.
+    :param L_tissue_masks: List of the tissue masks of each acquisition, as returned by detect_tissue.
+    :param patch_size: Input size of the network.
+    :param downsampling_factor: Int, size of the blocks used to compute the tissue masks.
+    :return: List of booleans, one per patch of all acquisitions (in the order of prepare_patches), True if the patch
+    intersects the tissue.
+    """
+
+    L_inferred = []
+
+    for positions, tissue_mask in zip(L_positions, L_tissue_masks):
+        for pos in positions:
+            h0, w0 = pos[0] // downsampling_factor, pos[1] // downsampling_factor
+            h1 = -(-(pos[0] + patch_size) // downsampling_factor)
+            w1 = -(-(pos[1] + patch_size) // downsampling_factor)
+            L_inferred.append(bool(tissue_mask[h0:h1, w0:w1].any()))
+
+    return L_inferred
+
+
 def process_segmented_patches(predictions_list, L_n_patches, L_positions, L_original_acquisitions_shapes,
                               overlap_value, n_classes,
                               predictions_proba_list=None, prediction_proba_activate=False, verbose_mode=0):
@@ -476,7 +975,7 @@ def perform_batch_inference(model, tf_session, tf_prediction_op, tf_input, batch
 
     p = model.predict(batch_x)
 
-    Mask = np.argmax(p, axis=3)  # Now Mask is a 256*256 mask with Mask[i,j] = pixel_class
+    Mask = np.argmax(p, axis=3).astype(np.uint8)  # Now Mask is a 256*256 mask with Mask[i,j] = pixel_class
 
     batch_predictions_list = [np.squeeze(e) for e in np.split(Mask, size_batch, axis=0)]
 
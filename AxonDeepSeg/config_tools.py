@@ -42,6 +42,7 @@ def default_configuration():
      'batch_norm_activate': True,
      'batch_size': 8,
      'convolution_per_layer': [3, 3, 3, 3],
+     'convolution_type': 'standard', # 'standard' or 'separable' (depthwise-separable convolutions)
      'da-3-elastic-activate': True,
      'da-elastic-alpha_max': 9,
      'da-elastic-order': 3,
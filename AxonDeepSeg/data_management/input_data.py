@@ -99,6 +99,36 @@ class DataGen(keras.utils.Sequence):
         return int(np.ceil(len(self.ids) / float(self.batch_size)))
 
 
+class DistillationGen(keras.utils.Sequence):
+    """Adds the probabilities predicted by a teacher network to the masks of a DataGen, for knowledge distillation"""
+
+    def __init__(self, data_generator, teacher):
+        """
+          Initalization for the DistillationGen class
+          :param data_generator: DataGen, the generator of the images and masks.
+          :param teacher: Keras model, the trained teacher network.
+        """
+
+        self.data_generator = data_generator
+        self.teacher = teacher
+
+    def __getitem__(self, index):
+        """
+          Generates a batch of images, and of masks concatenated with the teacher's probabilities along the channels
+          :param index: Int, index of the batch.
+        """
+        images, masks = self.data_generator[index]
+        teacher_proba = self.teacher.predict(images)
+
+        return (images, np.concatenate([masks, teacher_proba], axis=-1))
+
+    def on_epoch_end(self):
+        self.data_generator.on_epoch_end()
+
+    def __len__(self):
+        return len(self.data_generator)
+
+
 def labellize_mask_2d(patch, thresh_indices=[0, 0.2, 0.8]):
     """
     Process a patch with 8 bit pixels ([0-255]) so that the pixels between two threshold values are set to the closest threshold, effectively
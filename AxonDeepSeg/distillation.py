@@ -0,0 +1,180 @@
+# Knowledge distillation
+# ----------------------
+# Trains a smaller student network to reproduce the outputs of a trained teacher network, and compares the speed and
+# the segmentations of both networks.
+
+import argparse
+import copy
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+from prettytable import PrettyTable
+
+import AxonDeepSeg.ads_utils as ads
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.apply_model import load_model, predict_patches
+from AxonDeepSeg.config_tools import generate_struct, update_config, default_configuration
+from AxonDeepSeg.data_management.input_data import descritize_mask
+from AxonDeepSeg.testing.segmentation_scoring import pw_dice
+from AxonDeepSeg.train_network import train_model
+
+
+def generate_student_config(teacher_config, dict_struct):
+    """
+    Generates the configuration of a student network: the architecture is built from the structure, the other
+    parameters (patch size, classes, training parameters) are the ones of the teacher.
+    :param teacher_config: Dict, configuration of the teacher network.
+    :param dict_struct: Dict, structure of the student as given to config_tools.generate_struct, e.g.
+    {'structure': [[3, 3], [3, 3], [3, 3]], 'first_num_features': 8, 'features_augmentation': 'x2'}.
+    :return: Dict, configuration of the student network.
+    """
+
+    student_config = update_config(default_configuration(), copy.deepcopy(teacher_config))
+    student_config.update(generate_struct(dict_struct))
+
+    return student_config
+
+
+def train_student(path_trainingset, path_teacher, path_student, dict_struct, distillation_weight=0.5,
+                  distillation_temperature=2.0):
+    """
+    Trains a student network by knowledge distillation from a teacher network.
+    :param path_trainingset: Path to access the trainingset.
+    :param path_teacher: Path to the teacher model folder, containing config_network.json and model.hdf5.
+    :param path_student: Path indicating where to save the student model.
+    :param dict_struct: Dict, structure of the student, see generate_student_config.
+    :param distillation_weight: Float, weight of the teacher's probabilities in the loss.
+    :param distillation_temperature: Float, temperature used to soften the probabilities.
+    :return: Dict, configuration of the student network.
+    """
+
+    # If string, convert to Path objects
+    path_teacher = convert_path(path_teacher)
+    path_student = convert_path(path_student)
+
+    with open(str(path_teacher / 'config_network.json'), 'r') as fd:
+        teacher_config = json.loads(fd.read())
+
+    student_config = generate_student_config(teacher_config, dict_struct)
+
+    path_student.mkdir(parents=True, exist_ok=True)
+    with open(str(path_student / 'config_network.json'), 'w') as fd:
+        json.dump(student_config, fd, indent=2)
+
+    train_model(path_trainingset, path_student, student_config, path_teacher=path_teacher,
+                distillation_weight=distillation_weight, distillation_temperature=distillation_temperature)
+
+    return student_config
+
+
+def benchmark_model(path_model, L_patches, batch_size=8):
+    """
+    Segments patches with a model and measures its throughput.
+    :param path_model: Path to the model folder.
+    :param L_patches: List of patches of the size of the model's input.
+    :param batch_size: Int, number of patches per batch.
+    :return: List of the segmented patches, and throughput in patches per second.
+    """
+
+    # If string, convert to Path objects
+    path_model = convert_path(path_model)
+
+    with open(str(path_model / 'config_network.json'), 'r') as fd:
+        config = json.loads(fd.read())
+    patch_size = config["trainingset_patchsize"]
+    n_classes = config["n_classes"]
+
+    model, sess, pred, x = load_model(path_model, config)
+
+    # The first batch is not timed, as it includes the initialization of the session
+    predict_patches(model, sess, pred, x, L_patches[:batch_size], patch_size, n_classes,
+                    inference_batch_size=batch_size)
+
+    start_time = time.time()
+    predictions = predict_patches(model, sess, pred, x, L_patches, patch_size, n_classes,
+                                  inference_batch_size=batch_size)
+    throughput = len(L_patches) / (time.time() - start_time)
+
+    tf.reset_default_graph()
+
+    return predictions, throughput
+
+
+def compare_to_teacher(path_teacher, path_student, path_validation, batch_size=8, verbose=True):
+    """
+    Compares the throughput and the segmentations of a student network and its teacher on a validation folder.
+    :param path_teacher: Path to the teacher model folder.
+    :param path_student: Path to the student model folder.
+    :param path_validation: Path to a folder of patches (image_*.png), with their masks (mask_*.png) if available,
+    as in the Validation folder of a trainingset.
+    :param batch_size: Int, number of patches per batch.
+    :param verbose: Boolean, whether to display the report.
+    :return: Dict with the throughput of both networks, the speedup of the student, the pixel-wise Dice of the
+    student against the teacher for axon and myelin, and the Dice of both networks against the masks if available.
+    """
+
+    # If string, convert to Path objects
+    path_validation = convert_path(path_validation)
+
+    path_images = sorted(path_validation.glob('image_*.png'))
+    if not path_images:
+        raise ValueError("No validation patch (image_*.png) in {0}.".format(path_validation))
+    L_patches = [ads.imread(str(path_image)) for path_image in path_images]
+
+    teacher_predictions, teacher_throughput = benchmark_model(path_teacher, L_patches, batch_size)
+    student_predictions, student_throughput = benchmark_model(path_student, L_patches, batch_size)
+    teacher_predictions, student_predictions = np.stack(teacher_predictions), np.stack(student_predictions)
+
+    report = {
+        'teacher_throughput': teacher_throughput,
+        'student_throughput': student_throughput,
+        'speedup': student_throughput / teacher_throughput,
+        'axon_dice_to_teacher': pw_dice(student_predictions == 2, teacher_predictions == 2),
+        'myelin_dice_to_teacher': pw_dice(student_predictions == 1, teacher_predictions == 1),
+    }
+
+    # Comparison to the ground truth, when the masks of the patches are available
+    path_masks = [path_image.parent / path_image.name.replace('image_', 'mask_') for path_image in path_images]
+    if all(path_mask.exists() for path_mask in path_masks):
+        with open(str(convert_path(path_teacher) / 'config_network.json'), 'r') as fd:
+            thresholds = json.loads(fd.read()).get("thresholds", [0, 0.2, 0.8])
+        groundtruth = np.stack([np.argmax(descritize_mask(ads.imread(str(path_mask)), thresholds), axis=-1)
+                                for path_mask in path_masks])
+
+        for name, predictions in [('teacher', teacher_predictions), ('student', student_predictions)]:
+            report[name + '_axon_dice'] = pw_dice(predictions == 2, groundtruth == 2)
+            report[name + '_myelin_dice'] = pw_dice(predictions == 1, groundtruth == 1)
+
+    if verbose:
+        table = PrettyTable()
+        table.field_names = ["metric", "value"]
+        for key, value in report.items():
+            table.add_row([key, round(value, 4)])
+        print(table)
+
+    return report
+
+
+def main(argv=None):
+    """
+    Compares a student network to its teacher.
+    :return: Nothing.
+    """
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-t", "--path_teacher", required=True, help="Folder of the teacher model.")
+    ap.add_argument("-s", "--path_student", required=True, help="Folder of the student model.")
+    ap.add_argument("-v", "--path_validation", required=True,
+                    help="Folder of validation patches (image_*.png and mask_*.png).")
+    ap.add_argument("-b", "--batch_size", required=False, type=int, default=8, help="Inference batch size.")
+
+    args = vars(ap.parse_args(argv))
+
+    compare_to_teacher(args["path_teacher"], args["path_student"], args["path_validation"],
+                       batch_size=args["batch_size"])
+
+
+if __name__ == "__main__":
+    main()
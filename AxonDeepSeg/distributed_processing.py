@@ -0,0 +1,270 @@
+# Distributed processing of cohorts
+# ---------------------------------
+# Runs the segmentation, the splitting of the masks and the axon morphometrics of many images as independent
+# per-image tasks on a concurrent.futures executor: a thread or processes of the local machine, or the workers of a
+# Dask cluster. Each task does all the steps of its image on the same worker, so the images and the masks never
+# leave that worker: only the morphometrics table of the image is sent back. Failed tasks are retried, and the
+# tables of all the images are consolidated in a single table.
+
+import argparse
+import concurrent.futures
+import contextlib
+import multiprocessing as mp
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+import AxonDeepSeg.ads_utils as ads
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.morphometrics.compute_morphometrics import get_axon_morphometrics_table, get_pixelsize
+from AxonDeepSeg.segment import (
+                                    segment_image,
+                                    generate_default_parameters,
+                                    generate_resolution,
+                                    get_images_to_segment,
+                                    default_overlap,
+                                    default_batch_size
+                                )
+from AxonDeepSeg.visualization.get_masks import get_masks
+from config import axonmyelin_suffix, axon_suffix, myelin_suffix
+
+SCHEDULERS = ['threads', 'processes', 'dask']
+
+
+@contextlib.contextmanager
+def open_executor(scheduler='processes', n_workers=None, address=None):
+    """
+    Opens an executor on which the tasks are submitted, and shuts it down when leaving the context.
+    :param scheduler: String, 'threads' to run the tasks in a thread of the current process, 'processes' to run them
+    in processes of the local machine, or 'dask' to run them on a Dask cluster.
+    :param n_workers: Int, number of workers of the local executors or of the local Dask cluster (defaults to the
+    number of CPUs). The 'threads' scheduler always has a single worker.
+    :param address: String, address of the scheduler of an existing Dask cluster. A local cluster is started if None.
+    :return: The executor, with the interface of concurrent.futures.Executor.
+    """
+
+    if scheduler == 'threads':
+        # The segmentation builds the network in the default graph of TensorFlow and resets it, which is shared by all
+        # the threads of the process, so the tasks can't run in several threads at once
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        close = executor.shutdown
+
+    elif scheduler == 'processes':
+        # TensorFlow doesn't support being forked, so the workers are started from a fresh interpreter
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn'))
+        close = executor.shutdown
+
+    elif scheduler == 'dask':
+        try:
+            from dask.distributed import Client, LocalCluster
+        except ImportError:
+            raise ImportError("The dask scheduler requires dask.distributed: pip install 'dask[distributed]'.")
+
+        if address is not None:
+            client = Client(address)
+        else:
+            client = Client(LocalCluster(n_workers=n_workers, threads_per_worker=1, processes=True))
+        executor = client.get_executor()
+        close = client.close
+
+    else:
+        raise ValueError("Invalid scheduler: {0}. Must be one of {1}.".format(scheduler, SCHEDULERS))
+
+    try:
+        yield executor
+    finally:
+        close()
+
+
+def run_tasks(executor, function, L_args, max_retries=2, verbosity_level=0):
+    """
+    Runs a function once for each tuple of arguments on an executor, and submits again the tasks that fail.
+    :param executor: concurrent.futures.Executor (or any object with the same submit method).
+    :param function: The function to run. It must be picklable for the executors using other processes.
+    :param L_args: List of the tuples of arguments of each task.
+    :param max_retries: Int, number of times a failed task is submitted again before being given up.
+    :param verbosity_level: Level of verbosity. The higher, the more information is given about the tasks.
+    :return: List of the results of the tasks (None for the failed tasks), and dict associating the index of each
+    failed task to its last exception.
+    """
+
+    results = [None] * len(L_args)
+    errors = {}
+    futures = {executor.submit(function, *args): (i, 0) for i, args in enumerate(L_args)}
+
+    while futures:
+        done, _ = concurrent.futures.wait(list(futures), return_when=concurrent.futures.FIRST_COMPLETED)
+
+        for future in done:
+            i, attempt = futures.pop(future)
+            exception = future.exception()
+
+            if exception is None:
+                results[i] = future.result()
+            elif attempt < max_retries:
+                if verbosity_level >= 1:
+                    print("Task {0} failed ({1}), retrying.".format(i, exception))
+                futures[executor.submit(function, *L_args[i])] = (i, attempt + 1)
+            else:
+                errors[i] = exception
+
+    return results, errors
+
+
+def process_image(path_image, path_model, config, resolution_model, acquired_resolution=None,
+                  overlap_value=default_overlap, inference_batch_size=default_batch_size, segment=True):
+    """
+    Segments an image, splits its segmentation into the axon and myelin masks and computes the morphometrics of its
+    axons. This is the task run by the workers for each image.
+    :param path_image: Path of the image.
+    :param path_model: Path of the model folder.
+    :param config: Dict, configuration of the network.
+    :param resolution_model: Float, the resolution the model was trained on.
+    :param acquired_resolution: Float, pixel size of the image in micrometers. If None, it is read from the
+    pixel_size_in_micrometer.txt file of the image folder.
+    :param overlap_value: Int, number of pixels of overlap between the patches.
+    :param inference_batch_size: Int, number of patches fed to the network at once.
+    :param segment: Boolean, if False the image is not segmented again and the existing axonmyelin segmentation is
+    used.
+    :return: DataFrame of the morphometrics of each axon, with the path of the image in the 'image' column.
+    """
+
+    # If string, convert to Path objects
+    path_image = convert_path(path_image)
+
+    if not path_image.exists():
+        raise ValueError("The path {0} does not exist.".format(path_image))
+
+    if acquired_resolution is None:
+        acquired_resolution = get_pixelsize(path_image.parent / 'pixel_size_in_micrometer.txt')
+
+    path_image_stem = path_image.parent / path_image.stem
+
+    if segment:
+        # The segmentation writes the axonmyelin mask and splits it into the axon and myelin masks
+        segment_image(path_image, path_model, overlap_value, config, resolution_model,
+                      acquired_resolution=acquired_resolution, inference_batch_size=inference_batch_size)
+        im_axon = ads.imread(str(path_image_stem) + str(axon_suffix)) > 0
+        im_myelin = ads.imread(str(path_image_stem) + str(myelin_suffix)) > 0
+    else:
+        path_axonmyelin = Path(str(path_image_stem) + str(axonmyelin_suffix))
+        if not path_axonmyelin.exists():
+            raise ValueError("The segmentation {0} does not exist.".format(path_axonmyelin))
+        im_axon, im_myelin = get_masks(path_axonmyelin)
+
+    table = pd.DataFrame(get_axon_morphometrics_table(im_axon, im_myelin=im_myelin, pixel_size=acquired_resolution))
+    table.insert(0, 'image', str(path_image))
+
+    return table
+
+
+def process_cohort(path_images, path_model, config, resolution_model, acquired_resolutions=None,
+                   overlap_value=default_overlap, inference_batch_size=default_batch_size, segment=True,
+                   scheduler='processes', n_workers=None, address=None, executor=None, max_retries=2,
+                   verbosity_level=0):
+    """
+    Processes a cohort of images with one task per image, and consolidates the morphometrics of all the images.
+    :param path_images: List of the paths of the images.
+    :param path_model: Path of the model folder.
+    :param config: Dict, configuration of the network.
+    :param resolution_model: Float, the resolution the model was trained on.
+    :param acquired_resolutions: List of the pixel sizes of the images, a single pixel size for all of them, or None
+    to read the pixel_size_in_micrometer.txt file of the folder of each image.
+    :param overlap_value: Int, number of pixels of overlap between the patches.
+    :param inference_batch_size: Int, number of patches fed to the network at once.
+    :param segment: Boolean, if False the existing segmentations are used.
+    :param scheduler: String, type of executor opened when none is given, see open_executor.
+    :param n_workers: Int, number of workers of the executor opened when none is given.
+    :param address: String, address of an existing Dask cluster, see open_executor.
+    :param executor: concurrent.futures.Executor on which the tasks are submitted. If None, an executor is opened
+    for the cohort and shut down at the end.
+    :param max_retries: Int, number of times the task of an image is run again after a failure.
+    :param verbosity_level: Level of verbosity. The higher, the more information is given about the tasks.
+    :return: DataFrame of the morphometrics of the axons of all the images, with an 'image' column, and dict
+    associating the path of each image that could not be processed to its error message.
+    """
+
+    # If string, convert to Path objects
+    path_images = convert_path(path_images)
+    path_model = convert_path(path_model)
+
+    if not isinstance(acquired_resolutions, list):
+        acquired_resolutions = [acquired_resolutions] * len(path_images)
+
+    L_args = [(path_image, path_model, config, resolution_model, acquired_resolution, overlap_value,
+               inference_batch_size, segment)
+              for path_image, acquired_resolution in zip(path_images, acquired_resolutions)]
+
+    if executor is None:
+        with open_executor(scheduler, n_workers, address) as executor:
+            results, errors = run_tasks(executor, process_image, L_args, max_retries, verbosity_level)
+    else:
+        results, errors = run_tasks(executor, process_image, L_args, max_retries, verbosity_level)
+
+    tables = [table for table in results if table is not None]
+    table = pd.concat(tables, ignore_index=True, sort=False) if tables else pd.DataFrame(columns=['image'])
+    failures = {str(path_images[i]): str(exception) for i, exception in errors.items()}
+
+    return table, failures
+
+
+def main(argv=None):
+    """
+    Processes a cohort of images and saves the consolidated morphometrics table.
+    :return: Nothing.
+    """
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-t", "--type", required=True, choices=['SEM', 'TEM', 'OM'], help='Type of acquisition.')
+    ap.add_argument("-i", "--imgpath", required=True, nargs='+',
+                    help='Paths of the images, or of folders containing the images.')
+    ap.add_argument("-m", "--model", required=False, default=None, help='Folder of the model to use.')
+    ap.add_argument("-s", "--sizepixel", required=False, type=float, default=None,
+                    help='Pixel size of the images in micrometers. If not given, it is read from the \n' +
+                         'pixel_size_in_micrometer.txt file of the folder of each image.')
+    ap.add_argument("-o", "--output", required=False, default="cohort_morphometrics.csv",
+                    help='Path of the consolidated morphometrics table (csv or xlsx).')
+    ap.add_argument("--scheduler", required=False, choices=SCHEDULERS, default='processes',
+                    help='Executor running the tasks of the images.')
+    ap.add_argument("--workers", required=False, type=int, default=None, help='Number of workers.')
+    ap.add_argument("--address", required=False, default=None, help='Address of an existing Dask scheduler.')
+    ap.add_argument("--retries", required=False, type=int, default=2,
+                    help='Number of times the task of an image is run again after a failure.')
+    ap.add_argument("--no-segmentation", dest="segment", action='store_false',
+                    help='Compute the morphometrics from the existing segmentations.')
+    ap.add_argument("-v", "--verbose", required=False, type=int, choices=list(range(0, 4)), default=0,
+                    help='Verbosity level.')
+
+    args = vars(ap.parse_args(argv))
+
+    path_images = []
+    for path_target in [Path(p) for p in args["imgpath"]]:
+        if path_target.is_dir():
+            path_images += get_images_to_segment(path_target)
+        else:
+            path_images.append(path_target)
+
+    path_model, config = generate_default_parameters(args["type"], args["model"])
+    resolution_model = generate_resolution(args["type"], config["trainingset_patchsize"])
+
+    table, failures = process_cohort(path_images, path_model, config, resolution_model,
+                                     acquired_resolutions=args["sizepixel"], segment=args["segment"],
+                                     scheduler=args["scheduler"], n_workers=args["workers"],
+                                     address=args["address"], max_retries=args["retries"],
+                                     verbosity_level=args["verbose"])
+
+    if args["output"].lower().endswith('.xlsx'):
+        table.to_excel(args["output"])
+    else:
+        table.to_csv(args["output"])
+    print("Morphometrics of {0} images saved in {1}.".format(len(path_images) - len(failures), args["output"]))
+
+    for path_image, error in failures.items():
+        print("ERROR: {0} could not be processed: {1}".format(path_image, error))
+
+    sys.exit(3 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,253 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+# Comparison of models
+# --------------------
+# Segments the same images with several models and gathers their metrics in a per-model/per-image table. The images
+# are loaded, resampled and cut into patches once for each resolution and patch size, by chunks of a few images, and
+# the patches of a chunk are shared by all the models that use them.
+
+import argparse
 import json
-from AxonDeepSeg.apply_model import axon_segmentation
-import AxonDeepSeg.ads_utils
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+import AxonDeepSeg.ads_utils as ads
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.apply_model import load_acquisitions, prepare_patches, load_model, predict_patches, \
+    process_segmented_patches
+from AxonDeepSeg.morphometrics.compute_morphometrics import get_pixelsize
+from AxonDeepSeg.segment import generate_resolution, get_images_to_segment
+from AxonDeepSeg.testing.segmentation_scoring import pw_dice
+from AxonDeepSeg.testing.statistics_generation import labellize
+
+# Number of images whose patches are in memory at the same time
+default_chunk_size = 20
+# Tag of the names of the segmentations written next to the images, <image>_seg-<model>.png
+segmentation_tag = '_seg-'
+
+
+def group_models(path_models, resolution_models):
+    """
+    Groups the models that can share their input patches, i.e. the models with the same resolution and patch size.
+    :param path_models: List of paths of the model folders.
+    :param resolution_models: List of the resolutions the models were trained on, or a single resolution for all
+    of them.
+    :return: Dict associating each (resolution, patch size) to the list of the (path, config) of its models.
+    """
+
+    if not isinstance(resolution_models, list):
+        resolution_models = [resolution_models] * len(path_models)
+
+    groups = {}
+    for path_model, resolution_model in zip(path_models, resolution_models):
+        with open(str(path_model / 'config_network.json'), 'r') as fd:
+            config = json.loads(fd.read())
+        groups.setdefault((resolution_model, config["trainingset_patchsize"]), []).append((path_model, config))
 
-# FILE TO UPDATE
+    return groups
 
-def result_mapping(folder_models, path_datatest):
+
+def compute_segmentation_metrics(prediction, groundtruth=None, n_classes=3):
+    """
+    Computes the metrics of a segmentation, against its ground truth if available.
+    :param prediction: Array, the segmentation (class of each pixel).
+    :param groundtruth: Array, the ground truth (class of each pixel), or None.
+    :param n_classes: Int, number of classes.
+    :return: Dict of the metrics: area fractions of the axons and myelin, and accuracy and pixel-wise Dice of each
+    class if there is a ground truth.
+    """
+
+    metrics = {'axon_fraction': np.mean(prediction == n_classes - 1)}
+    if n_classes == 3:
+        metrics['myelin_fraction'] = np.mean(prediction == 1)
+
+    if groundtruth is not None:
+        metrics['accuracy'] = np.mean(prediction == groundtruth)
+        metrics['pw_dice_axon'] = pw_dice(prediction == n_classes - 1, groundtruth == n_classes - 1)
+        if n_classes == 3:
+            metrics['pw_dice_myelin'] = pw_dice(prediction == 1, groundtruth == 1)
+
+    return metrics
+
+
+def compare_models(path_models, path_images, acquired_resolutions, resolution_models, path_groundtruths=None,
+                   overlap_value=25, inference_batch_size=8, write_mode=False, chunk_size=default_chunk_size,
+                   gpu_per=1.0, verbosity_level=0):
     """
-    Create the U-net.
-    Input :
-        folder_models : path to the folder containing all the model folders to test.
-        path_datatest : path to the folder containing the image to segment.
+    Segments images with several models and computes the metrics of each model on each image.
+    :param path_models: List of paths of the model folders.
+    :param path_images: List of paths of the images.
+    :param acquired_resolutions: List of the pixel sizes of the images, or a single pixel size for all of them.
+    :param resolution_models: List of the resolutions the models were trained on, or a single resolution for all
+    of them.
+    :param path_groundtruths: List of the paths of the ground truth masks of the images (None for the images without
+    ground truth), or None if there is no ground truth.
+    :param overlap_value: Int, number of pixels of overlap between the patches.
+    :param inference_batch_size: Int, number of patches fed to the network at once.
+    :param write_mode: Boolean, whether to save the segmentation of each model next to each image, as
+    <image>_seg-<model>.png.
+    :param chunk_size: Int, number of images loaded and cut into patches at the same time. The models are loaded once
+    per chunk.
+    :param gpu_per: Float, percentage of GPU to use if we use it.
+    :param verbosity_level: Int, how much information to display.
+    :return: DataFrame indexed by model and image, with one column per metric and the inference time of the model on
+    the image.
+    """
+
+    # If string, convert to Path objects
+    path_models = convert_path(path_models)
+    path_images = convert_path(path_images)
 
-    Output :
-        None. Save the segmented images in the data_test folder.
+    if not isinstance(acquired_resolutions, list):
+        acquired_resolutions = [acquired_resolutions] * len(path_images)
+    if path_groundtruths is None:
+        path_groundtruths = [None] * len(path_images)
+
+    path_groundtruths = convert_path(path_groundtruths)
+
+    rows = []
+
+    for (resolution_model, patch_size), models in group_models(path_models, resolution_models).items():
+        model_times = {path_model.name: 0. for path_model, _ in models}
+
+        # The images are loaded and cut into patches by chunks, and the patches of a chunk are shared by all the
+        # models of the group
+        for i_chunk in range(0, len(path_images), chunk_size):
+            chunk_images = path_images[i_chunk:i_chunk + chunk_size]
+            chunk_resolutions = acquired_resolutions[i_chunk:i_chunk + chunk_size]
+            chunk_groundtruths = [labellize(ads.imread(str(path_gt))) if path_gt is not None else None
+                                  for path_gt in path_groundtruths[i_chunk:i_chunk + chunk_size]]
+
+            rs_acquisitions, rs_coeffs, original_shapes = load_acquisitions(
+                chunk_images, chunk_resolutions, [resolution_model] * len(chunk_images), verbose_mode=verbosity_level)
+            L_data, L_n_patches, L_positions = prepare_patches(rs_acquisitions, patch_size, overlap_value)
+            del rs_acquisitions
+
+            # First patch of each image
+            L_first_patches = np.concatenate([[0], np.cumsum(L_n_patches)])
+
+            for path_model, config in models:
+                n_classes = config["n_classes"]
+
+                model, sess, pred, x = load_model(path_model, config, gpu_per=gpu_per,
+                                                  verbosity_level=verbosity_level)
+
+                # The patches of each image are segmented separately, to measure the inference time of each image
+                predictions_list = []
+                inference_times = []
+                for first_patch, last_patch in zip(L_first_patches[:-1], L_first_patches[1:]):
+                    start_time = time.time()
+                    predictions_list += predict_patches(model, sess, pred, x, L_data[first_patch:last_patch],
+                                                        patch_size, n_classes,
+                                                        inference_batch_size=inference_batch_size,
+                                                        verbosity_level=verbosity_level)
+                    inference_times.append(time.time() - start_time)
+                tf.reset_default_graph()
+                model_times[path_model.name] += sum(inference_times)
+
+                predictions = process_segmented_patches(predictions_list, L_n_patches, L_positions, original_shapes,
+                                                        overlap_value, n_classes)
+
+                for path_image, prediction, groundtruth, inference_time in zip(chunk_images, predictions,
+                                                                                chunk_groundtruths, inference_times):
+                    row = {'model': path_model.name, 'image': str(path_image), 'inference_time': inference_time}
+                    row.update(compute_segmentation_metrics(prediction, groundtruth, n_classes))
+                    rows.append(row)
+
+                    if write_mode:
+                        paint_vals = np.array([int(255 * float(j) / (n_classes - 1)) for j in range(n_classes)],
+                                              dtype=np.uint8)
+                        ads.imwrite(path_image.parent / (path_image.stem + segmentation_tag + path_model.name +
+                                                         '.png'), paint_vals[prediction], 'png')
+
+        if verbosity_level >= 1:
+            for path_model, _ in models:
+                print("Model {0}: {1} images segmented in {2:.2f}s.".format(path_model.name, len(path_images),
+                                                                            model_times[path_model.name]))
+
+    return pd.DataFrame(rows).set_index(['model', 'image'])
+
+
+def metrics_matrix(comparison, metric):
+    """
+    Arranges one metric of a comparison as a model x image matrix.
+    :param comparison: DataFrame, as returned by compare_models.
+    :param metric: String, name of the metric.
+    :return: DataFrame with one row per model and one column per image.
     """
-    model_folders = [f for f in folder_models.iterdir()]
-    for root in model_folders:
-        if 'DS_Store' not in root:
-            subpath_model = folder_models / root
-            filename = '/config_network.json'
-            with open(subpath_model / filename, 'r') as fd:
-                config_network = json.loads(fd.read())
 
-            axon_segmentation(path_datatest, subpath_model, config_network, segmentations_filenames='segmentation_' + root + '.png')
+    return comparison[metric].unstack('image')
 
-    return 'segmented'
 
-def map_model_to_images(folder_model, path_datatests, batch_size=1, gps=0.1, crop_value=25, gpu_per=1.0):
+def main(argv=None):
     """
-    Apply one trained model to all the specified images
+    Compares several models on the same images and saves the per-model/per-image metrics.
+    :return: Nothing.
     """
 
-    # Load config
-    with open(folder_model / 'config_network.json', 'r') as fd:
-        config_network = json.loads(fd.read())
-    
-    path_images = [e for e in path_datatests.iterdir() if (path_datatests / e).is_dir()]
-    n_images = len(path_images)
-    path_images_list = list(segment_list(path_images,20))
-    
-    if type(gps) != list:
-        gps = n_images*[gps]
-    gps_list = list(segment_list(gps,20))
-    
-    for i,path_images_iter in enumerate(path_images_list):
-        gps_iter = gps_list[i]
-        axon_segmentation(path_images_iter, folder_model, config_network, segmentations_filenames='segmentation.png', inference_batch_size=batch_size, write_mode=True, prediction_proba_activate=False, resampled_resolutions=gps_iter, overlap_value= crop_value, gpu_per=gpu_per)
-            
-            
-def segment_list(l, n):
-    # For item i in a range that is a length of l,
-    for i in range(0, len(l), n):
-        # Create an index range for l of n items:
-        yield l[i:i+n]
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-t", "--type", required=True, choices=['SEM', 'TEM', 'OM'], help='Type of acquisition.')
+    ap.add_argument("-m", "--models", required=True, nargs='+', help='Folders of the models to compare.')
+    ap.add_argument("-i", "--imgpath", required=True, nargs='+',
+                    help='Paths of the images, or of folders containing the images.')
+    ap.add_argument("-s", "--sizepixel", required=False, type=float, default=None,
+                    help='Pixel size of the images in micrometers. If not given, it is read from the \n' +
+                         'pixel_size_in_micrometer.txt file of the folder of each image.')
+    ap.add_argument("-g", "--groundtruth", required=False, default='mask.png',
+                    help='Name of the ground truth mask in the folder of each image. The images without \n' +
+                         'ground truth are only described by their area fractions.')
+    ap.add_argument("-o", "--output", required=False, default='models_comparison.csv',
+                    help='Path of the csv file where the metrics are saved.')
+    ap.add_argument("-b", "--batch-size", required=False, type=int, default=8, help='Inference batch size.')
+    ap.add_argument("--overlap", required=False, type=int, default=25,
+                    help='Overlap value (in pixels) of the patches.')
+    ap.add_argument("-w", "--write", required=False, action='store_true',
+                    help='Save the segmentation of each model next to each image.')
+    ap.add_argument("-c", "--chunk-size", required=False, type=int, default=default_chunk_size,
+                    help='Number of images loaded and cut into patches at the same time.')
+    ap.add_argument("-v", "--verbose", required=False, type=int, choices=list(range(0, 4)), default=0,
+                    help='Verbosity level.')
+
+    args = vars(ap.parse_args(argv))
+
+    path_images = []
+    for path_target in [Path(p) for p in args["imgpath"]]:
+        if path_target.is_dir():
+            # The ground truths and the segmentations written by previous comparisons are not segmented
+            path_images += [p for p in get_images_to_segment(path_target)
+                            if p.name != args["groundtruth"] and segmentation_tag not in p.name]
+        else:
+            path_images.append(path_target)
+
+    if args["sizepixel"] is not None:
+        acquired_resolutions = args["sizepixel"]
+    else:
+        acquired_resolutions = [get_pixelsize(p.parent / 'pixel_size_in_micrometer.txt') for p in path_images]
 
+    path_groundtruths = [p.parent / args["groundtruth"] if (p.parent / args["groundtruth"]).exists() else None
+                         for p in path_images]
 
+    path_models = [Path(p) for p in args["models"]]
+    resolution_models = []
+    for path_model in path_models:
+        with open(str(path_model / 'config_network.json'), 'r') as fd:
+            resolution_models.append(generate_resolution(args["type"],
+                                                         json.loads(fd.read())["trainingset_patchsize"]))
 
+    comparison = compare_models(path_models, path_images, acquired_resolutions, resolution_models,
+                                path_groundtruths=path_groundtruths, overlap_value=args["overlap"],
+                                inference_batch_size=args["batch_size"], write_mode=args["write"],
+                                chunk_size=args["chunk_size"], verbosity_level=args["verbose"])
+    comparison.to_csv(args["output"])
 
+    metric = 'pw_dice_axon' if 'pw_dice_axon' in comparison.columns else 'axon_fraction'
+    print(metrics_matrix(comparison, metric))
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Benchmark of the myelin assignment methods
+# ------------------------------------------
+# Compares the methods used to assign the myelin pixels to the axons (see compute_morphometrics.assign_myelin_to_axons)
+# on segmented images: time needed to compute the morphometrics with each method, and agreement of the methods with
+# the watershed.
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+import AxonDeepSeg.ads_utils as ads
+from AxonDeepSeg.morphometrics.compute_morphometrics import (
+                                                                MorphometricsSession,
+                                                                get_pixelsize,
+                                                                myelin_assignment_methods
+                                                            )
+from config import axon_suffix, myelin_suffix
+
+
+def benchmark_myelin_assignment(im_axon, im_myelin, pixel_size, n_repeats=3):
+    """
+    Computes the morphometrics of the axons of a segmentation with each myelin assignment method.
+    :param im_axon: Array: axon binary mask
+    :param im_myelin: Array: myelin binary mask
+    :param pixel_size: float: pixel size in micrometers
+    :param n_repeats: int: number of times the morphometrics are computed with each method. The best time is kept.
+    :return: dict associating each method to a dict of its 'time' (in seconds), its 'pixel_agreement' with the
+    watershed (fraction of the myelin pixels assigned to the same axon), the number of axons whose myelin is
+    'found', and the 'gratio_difference' with the watershed (median of the absolute differences of the g-ratios of the
+    axons whose myelin is found by both methods).
+    """
+
+    results = {}
+    for method in myelin_assignment_methods:
+        times = []
+        for _ in range(n_repeats):
+            start_time = time.time()
+            session = MorphometricsSession(im_axon, im_myelin, pixel_size=pixel_size, myelin_assignment=method)
+            table = session.get_table()
+            times.append(time.time() - start_time)
+        results[method] = {'time': min(times), 'table': table, 'label': session.axonmyelin_label}
+
+    reference = results['watershed']
+    myelin = im_myelin > 0
+    for method, result in results.items():
+        gratio_difference = np.abs(result['table']['gratio'] - reference['table']['gratio'])
+        result['pixel_agreement'] = np.mean(result['label'][myelin] == reference['label'][myelin]) if np.any(myelin) \
+            else 1.
+        result['found'] = int(np.count_nonzero(~np.isnan(result['table']['gratio'])))
+        result['gratio_difference'] = np.nanmedian(gratio_difference) if np.any(~np.isnan(gratio_difference)) \
+            else np.nan
+        del result['table'], result['label']
+
+    return results
+
+
+def main(argv=None):
+    """
+    Runs the benchmark on segmented images.
+    :return: Nothing.
+    """
+
+    ap = argparse.ArgumentParser(description='Benchmark of the methods assigning the myelin pixels to the axons.')
+    ap.add_argument('-i', '--imgpath', required=True, nargs='+',
+                    help='Paths of the images, whose axon and myelin masks are in the same folder.')
+    ap.add_argument('-s', '--sizepixel', required=False, type=float, default=None,
+                    help='Pixel size of the images in micrometers. If not given, it is read from the \n' +
+                         'pixel_size_in_micrometer.txt file of the folder of each image.')
+    ap.add_argument('-n', '--repeats', required=False, type=int, default=3,
+                    help='Number of times the morphometrics are computed with each method.')
+    args = ap.parse_args(argv)
+
+    for path_image in [Path(p) for p in args.imgpath]:
+        pixel_size = args.sizepixel
+        if pixel_size is None:
+            pixel_size = get_pixelsize(path_image.parent / 'pixel_size_in_micrometer.txt')
+        im_axon = ads.imread(str(path_image.with_suffix("")) + str(axon_suffix)) > 0
+        im_myelin = ads.imread(str(path_image.with_suffix("")) + str(myelin_suffix)) > 0
+
+        print("{0}:".format(path_image))
+        results = benchmark_myelin_assignment(im_axon, im_myelin, pixel_size, n_repeats=args.repeats)
+        for method, result in results.items():
+            print("  {0}: {1:.3f} s, myelin found for {2} axons, {3:.1%} of the myelin pixels assigned like the "
+                  "watershed, median g-ratio difference {4:.4f}".format(method, result['time'], result['found'],
+                                                                        result['pixel_agreement'],
+                                                                        result['gratio_difference']))
+
+
+if __name__ == '__main__':
+    main()
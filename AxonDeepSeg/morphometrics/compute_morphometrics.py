@@ -15,6 +15,7 @@ from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from matplotlib.figure import Figure
 
 from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.morphometrics.morphometric_maps import save_morphometric_maps
 
 
 def get_pixelsize(path_pixelsize_file):
@@ -43,114 +44,399 @@ def get_pixelsize(path_pixelsize_file):
         return pixelsize
 
 
+# Columns of the morphometrics tables, in the order they are exported. The myelin columns are only present if a
+# myelin mask is given.
+morphometrics_columns = ['x0', 'y0', 'gratio', 'axon_area', 'myelin_area', 'axon_diam', 'myelin_thickness',
+                         'axonmyelin_area', 'solidity', 'eccentricity', 'orientation']
+myelin_columns = ['gratio', 'myelin_area', 'myelin_thickness', 'axonmyelin_area']
+# Methods used to assign the myelin pixels to the axons, see assign_myelin_to_axons
+myelin_assignment_methods = ['watershed', 'nearest']
+
+
+class MorphometricsSession(object):
+    """
+    Morphometrics of the axons of a segmentation. The axon mask is labelled once, the per-axon morphometrics are
+    computed once, and the aggregate metrics and the maps are derived from these cached results.
+    """
+
+    def __init__(self, im_axon, im_myelin=None, pixel_size=None, path_folder=None, myelin_assignment='watershed'):
+        """
+        :param im_axon: Array: axon binary mask, output of axondeepseg
+        :param im_myelin: Array: myelin binary mask, output of axondeepseg
+        :param pixel_size: float: pixel size in micrometers, used if path_folder is None
+        :param path_folder: str: absolute path of folder containing pixel size file
+        :param myelin_assignment: str: method used to assign the myelin pixels to the axons, see
+            assign_myelin_to_axons
+        """
+        if myelin_assignment not in myelin_assignment_methods:
+            raise ValueError("Invalid myelin assignment method: {0}. Must be one of {1}.".format(
+                myelin_assignment, myelin_assignment_methods))
+
+        if path_folder is not None:
+            # If string, convert to Path objects
+            path_folder = convert_path(path_folder)
+
+            pixel_size = get_pixelsize(path_folder / 'pixel_size_in_micrometer.txt')
+
+        if pixel_size is None:
+            raise ValueError("A pixel size, or the folder of the pixel_size_in_micrometer.txt file, must be given.")
+
+        self.im_axon = im_axon
+        self.im_myelin = im_myelin
+        self.pixel_size = pixel_size
+        self.myelin_assignment = myelin_assignment
+
+        self._axon_label = None
+        self._axon_props = None
+        self._axonmyelin_label = None
+        self._tables = {}
+
+    @property
+    def axon_label(self):
+        """
+        Label image of the axons, computed on first use.
+        """
+        if self._axon_label is None:
+            self._axon_label = measure.label(self.im_axon)
+        return self._axon_label
+
+    @property
+    def axon_props(self):
+        """
+        Properties of all the axon objects (see _measure_labels), computed on first use.
+        """
+        if self._axon_props is None:
+            self._axon_props = _measure_labels(self.axon_label)
+        return self._axon_props
+
+    @property
+    def axonmyelin_label(self):
+        """
+        Label image of the axon+myelin objects, computed with the myelin metrics. The axon+myelin object of the i-th
+        axon is labelled i + 1. None if the session has no myelin mask.
+        """
+        if self.im_myelin is None:
+            return None
+        self.get_table()
+        return self._axonmyelin_label
+
+    @property
+    def n_axons(self):
+        return self.axon_props['area'].size
+
+    def get_table(self, include_myelin=True):
+        """
+        Computes the morphometrics of each axon, column by column. The tables are cached.
+        :param include_myelin: bool: whether to compute the myelin-related metrics (myelin thickness, g-ratio, etc.),
+            if the session has a myelin mask
+        :return: structured array with one row per axon and one field per metric (see morphometrics_columns). The
+            myelin metrics of the axons whose myelin object is not found are NaN.
+        """
+        include_myelin = include_myelin and (self.im_myelin is not None)
+
+        if include_myelin not in self._tables:
+            self._tables[include_myelin] = self._compute_table(include_myelin)
+        return self._tables[include_myelin]
+
+    def _compute_table(self, include_myelin):
+        columns = [c for c in morphometrics_columns if include_myelin or (c not in myelin_columns)]
+        table = np.full(self.n_axons, np.nan, dtype=[(c, 'f8') for c in columns])
+
+        # The axon metrics don't depend on the myelin, they are copied from the other table if it was computed
+        if (not include_myelin) in self._tables:
+            axon_table = self._tables[not include_myelin]
+            for column in columns:
+                if column not in myelin_columns:
+                    table[column] = axon_table[column]
+        else:
+            table['y0'], table['x0'] = self.axon_props['centroid']
+            table['solidity'] = [prop_axon.solidity for prop_axon in measure.regionprops(self.axon_label)]
+            table['eccentricity'] = self.axon_props['eccentricity']
+            # Axon equivalent diameter in micrometers
+            table['axon_diam'] = self.axon_props['equivalent_diameter'] * self.pixel_size
+            # Axon area in µm^2
+            table['axon_area'] = self.axon_props['area'] * (self.pixel_size ** 2)
+            # Axon orientation angle
+            table['orientation'] = self.axon_props['orientation']
+
+        # Deal with myelin mask
+        if include_myelin:
+            n_axons = self.n_axons
+
+            # Get axon centroid as int (not float) to be used as index
+            ind_centroid = (table['y0'].astype(int), table['x0'].astype(int))
+
+            im_axonmyelin_label = assign_myelin_to_axons(self.im_axon, self.im_myelin, self.axon_label, ind_centroid,
+                                                         method=self.myelin_assignment)
+            self._axonmyelin_label = im_axonmyelin_label
+            # Measure properties of all the axonmyelin objects at once. They are indexed by label, so the axonmyelin
+            # object of each axon is found in constant time.
+            axonmyelin_props = _measure_labels(im_axonmyelin_label)
+
+            if self.myelin_assignment == 'nearest':
+                # The axonmyelin objects have the labels of their axons
+                label_axonmyelin = np.arange(1, n_axons + 1)
+            else:
+                # Find label of axonmyelin corresponding to each axon centroid
+                label_axonmyelin = im_axonmyelin_label[ind_centroid]
+            found = label_axonmyelin > 0
+            idx = label_axonmyelin[found] - 1
+
+            axon_diam_px = self.axon_props['equivalent_diameter'][found]
+            axonmyelin_diam_px = axonmyelin_props['equivalent_diameter'][idx]
+            axon_area_px = self.axon_props['area'][found]
+            axonmyelin_area_px = axonmyelin_props['area'][idx]
+
+            warn_if_measures_are_unexpected_for_all(axon_diam_px, axonmyelin_diam_px, "equivalent_diameter")
+            warn_if_measures_are_unexpected_for_all(axon_area_px, axonmyelin_area_px, "area")
+
+            # Equivalent thickness of the myelin ring, see evaluate_myelin_thickness_in_px
+            table['myelin_thickness'][found] = self.pixel_size * (axonmyelin_diam_px - axon_diam_px) / 2
+            table['myelin_area'][found] = (self.pixel_size ** 2) * (axonmyelin_area_px - axon_area_px)
+            table['axonmyelin_area'][found] = (self.pixel_size ** 2) * axonmyelin_area_px
+
+            if not np.all(found):
+                n_shown = 10
+                centroids = ", ".join(
+                    "[y:{0}, x:{1}]".format(y0, x0)
+                    for y0, x0 in zip(table['y0'][~found][:n_shown], table['x0'][~found][:n_shown])
+                )
+                print(
+                    "WARNING: Myelin object not found for {0} of the {1} axons, ".format(np.count_nonzero(~found), n_axons) +
+                    "their myelin metrics are NaN. Axon centroids: {0}{1}".format(
+                        centroids, ", ..." if np.count_nonzero(~found) > n_shown else "")
+                    )
+
+            table['gratio'] = np.sqrt(table['axon_area'] / table['axonmyelin_area'])
+
+        return table
+
+    def get_stats_array(self, include_myelin=True):
+        """
+        :param include_myelin: bool: whether to give the myelin-related metrics, if the session has a myelin mask
+        :return: Array(dict): dictionaries containing morphometric results for each axon, see get_axon_morphometrics
+        """
+        table = self.get_table(include_myelin)
+
+        axon_keys = ['y0', 'x0', 'axon_diam', 'axon_area', 'solidity', 'eccentricity', 'orientation']
+        myelin_keys = ['myelin_thickness', 'myelin_area', 'axonmyelin_area', 'gratio']
+
+        stats_array = np.empty(table.size, dtype=object)
+        for i, row in enumerate(table):
+            stats = {key: row[key].item() for key in axon_keys}
+            # The myelin metrics are only given for the axons whose myelin object was found
+            if 'axonmyelin_area' in table.dtype.names and not np.isnan(row['axonmyelin_area']):
+                stats.update({key: row[key].item() for key in myelin_keys})
+            stats_array[i] = stats
+
+        return stats_array
+
+    def get_aggregate_metrics(self):
+        """
+        :return: aggregate_metrics: dictionary containing values of aggregate metrics, see get_aggregate_morphometrics
+        """
+
+        # Compute AVF (axon volume fraction) = area occupied by axons in sample
+        avf = np.count_nonzero(self.im_axon) / float((self.im_axon.size))
+        # Compute MVF (myelin volume fraction) = area occupied by myelin sheaths in sample
+        mvf = np.count_nonzero(self.im_myelin) / float((self.im_myelin.size))
+
+        # Estimate aggregate g-ratio = sqrt(1/(1+MVF/AVF))
+        gratio = math.sqrt(1 / (1 + (float(mvf) / float(avf))))
+
+        # Get individual axons metrics and compute mean axon diameter
+        axon_diam_list = self.get_table(include_myelin=False)['axon_diam']
+        mean_axon_diam = np.mean(axon_diam_list)
+
+        # Estimate mean myelin diameter (axon+myelin diameter) by using
+        # aggregate g-ratio = mean_axon_diam/mean_myelin_diam
+
+        mean_myelin_diam = mean_axon_diam / gratio
+
+        # Estimate mean myelin thickness = mean_myelin_radius - mean_axon_radius
+        mean_myelin_thickness = (float(mean_myelin_diam) / 2) - (float(mean_axon_diam) / 2)
+
+        # Compute axon density (number of axons per mm2)
+        img_area_mm2 = float(self.im_axon.size) * self.pixel_size * self.pixel_size / (float(1000000))
+        axon_density_mm2 = float(len(axon_diam_list)) / float(img_area_mm2)
+
+        # Create disctionary to store aggregate metrics
+        aggregate_metrics = {'avf': avf, 'mvf': mvf, 'gratio_aggr': gratio, 'mean_axon_diam': mean_axon_diam,
+                             'mean_myelin_diam': mean_myelin_diam, 'mean_myelin_thickness': mean_myelin_thickness,
+                             'axon_density_mm2': axon_density_mm2}
+        return aggregate_metrics
+
+    def draw_axon_diameter(self, img):
+        """
+        :param img: sample grayscale image (png)
+        :return: matplotlib.figure.Figure, see draw_axon_diameter
+        """
+        return draw_axon_diameter(img, None, self.im_axon, self.im_myelin, im_axon_label=self.axon_label,
+                                  stats_array=self.get_table(include_myelin=False))
+
+    def save_maps(self, path_folder, img, **kwargs):
+        """
+        Writes the colour-coded maps of the morphometrics, see morphometric_maps.save_morphometric_maps.
+        :param path_folder: folder where the maps are written
+        :param img: Array: grayscale image
+        :return: dict associating each metric to the list of the paths of its map images
+        """
+        return save_morphometric_maps(path_folder, img, self.axon_label, self.get_table(), **kwargs)
+
+
+def get_axon_morphometrics_table(im_axon, path_folder=None, im_myelin=None, pixel_size=None):
+    """
+    Find each axon and compute axon-wise morphometric data, e.g., equivalent diameter, eccentricity, etc.
+    If a mask of myelin is provided, also compute myelin-related metrics (myelin thickness, g-ratio, etc.).
+    The metrics of all the axons are computed column by column, from a single labelling of the masks.
+    :param im_axon: Array: axon binary mask, output of axondeepseg
+    :param path_folder: str: absolute path of folder containing pixel size file
+    :param im_myelin: Array: myelin binary mask, output of axondeepseg
+    :param pixel_size: float: pixel size in micrometers, used if path_folder is None
+    :return: structured array with one row per axon and one field per metric (see morphometrics_columns). The myelin
+    metrics of the axons whose myelin object is not found are NaN.
+    """
+    return MorphometricsSession(im_axon, im_myelin=im_myelin, pixel_size=pixel_size,
+                                path_folder=path_folder).get_table()
+
+
 def get_axon_morphometrics(im_axon, path_folder=None, im_myelin=None, pixel_size=None):
     """
     Find each axon and compute axon-wise morphometric data, e.g., equivalent diameter, eccentricity, etc.
     If a mask of myelin is provided, also compute myelin-related metrics (myelin thickness, g-ratio, etc.).
+    This is a wrapper of get_axon_morphometrics_table, which should be preferred for large images.
     :param im_axon: Array: axon binary mask, output of axondeepseg
     :param path_folder: str: absolute path of folder containing pixel size file
     :param im_myelin: Array: myelin binary mask, output of axondeepseg
     :return: Array(dict): dictionaries containing morphometric results for each axon
     """
-    if path_folder is not None:
-        # If string, convert to Path objects
-        path_folder = convert_path(path_folder)
-
-        pixelsize = get_pixelsize(path_folder / 'pixel_size_in_micrometer.txt')
-
-    if (pixel_size  is not None) and (path_folder is None ):
-        pixelsize = pixel_size
-
-    stats_array = np.empty(0)
-    # Label each axon object
-    im_axon_label = measure.label(im_axon)
-    # Measure properties for each axon object
-    axon_objects = measure.regionprops(im_axon_label)
-
-    # Deal with myelin mask
-    if im_myelin is not None:
-
-        im_axonmyelin = im_axon + im_myelin
-
-        # Compute distance between each pixel and the background.
-        distance = ndi.distance_transform_edt(im_axon)
-        # Note: this distance is calculated from the im_axon,
-        # note from the im_axonmyelin image, because we know that each axon
-        # object is already isolated, therefore the distance metric will be
-        # more useful for the watershed algorithm below.
-
-        # Get axon centroid as int (not float) to be used as index
-        ind_centroid = ([int(props.centroid[0]) for props in axon_objects],
-                        [int(props.centroid[1]) for props in axon_objects])
-
-        # Create an image with axon centroids, which value corresponds to the value of the axon object
-        im_centroid = np.zeros_like(im_axon, dtype='uint16')
-        for i in range(len(ind_centroid[0])):
-            # Note: The value "i" corresponds to the label number of im_axon_label
-            im_centroid[ind_centroid[0][i], ind_centroid[1][i]] = i + 1
-
-        # Watershed segmentation of axonmyelin using distance map
-        im_axonmyelin_label = morphology.watershed(-distance, im_centroid, mask=im_axonmyelin)
-        # Measure properties of each axonmyelin object
-        axonmyelin_objects = measure.regionprops(im_axonmyelin_label)
-
-    # Create list of the exiting labels
-    if im_myelin is not None:
-        axonmyelin_labels_list = [axm.label for axm in axonmyelin_objects]
-
-    # Loop across axon property and fill up dictionary with morphometrics of interest
-    for prop_axon in axon_objects:
-        # Centroid
-        y0, x0 = prop_axon.centroid
-        # Solidity
-        solidity = prop_axon.solidity
-        # Eccentricity
-        eccentricity = prop_axon.eccentricity
-        # Axon equivalent diameter in micrometers
-        axon_diam = prop_axon.equivalent_diameter * pixelsize
-        # Axon area in µm^2
-        axon_area = prop_axon.area * (pixelsize ** 2)
-        # Axon orientation angle
-        orientation = prop_axon.orientation
-        # Add metrics to list of dictionaries
-        stats = {'y0': y0,
-                 'x0': x0,
-                 'axon_diam': axon_diam,
-                 'axon_area': axon_area,
-                 'solidity': solidity,
-                 'eccentricity': eccentricity,
-                 'orientation': orientation}
-
-        # Deal with myelin
-        if im_myelin is not None:
-            # Find label of axonmyelin corresponding to axon centroid
-            label_axonmyelin = im_axonmyelin_label[int(y0), int(x0)]
-
-            if label_axonmyelin:
-                idx = axonmyelin_labels_list.index(label_axonmyelin)
-                prop_axonmyelin = axonmyelin_objects[idx]
-
-                _res1 = evaluate_myelin_thickness_in_px(prop_axon, prop_axonmyelin)
-                myelin_thickness = pixelsize * _res1
-
-                _res2 = evaluate_myelin_area_in_px(prop_axon, prop_axonmyelin)
-                myelin_area = (pixelsize ** 2) * _res2
-
-                axonmyelin_area = (pixelsize ** 2) * prop_axonmyelin.area
-
-                stats['myelin_thickness'] = myelin_thickness
-                stats['myelin_area'] = myelin_area
-                stats['axonmyelin_area'] = axonmyelin_area
-                stats['gratio'] = np.sqrt(axon_area / axonmyelin_area)
-            else:
-                print(
-                    "WARNING: Myelin object not found for axon" +
-                    "centroid [y:{0}, x:{1}]".format(y0, x0)
-                    )
+    return MorphometricsSession(im_axon, im_myelin=im_myelin, pixel_size=pixel_size,
+                                path_folder=path_folder).get_stats_array()
+
+
+def assign_myelin_by_watershed(im_axon, im_myelin, ind_centroid):
+    """
+    Assigns the myelin pixels to the axons with a watershed of the axon+myelin mask, seeded at the axon centroids.
+    :param im_axon: Array: axon binary mask
+    :param im_myelin: Array: myelin binary mask
+    :param ind_centroid: tuple of the row and column arrays of the (integer) centroids of the axons
+    :return: label image of the axon+myelin objects. The object flooded from the centroid of the i-th axon is labelled
+    i + 1.
+    """
+
+    im_axonmyelin = im_axon + im_myelin
 
-        stats_array = np.append(stats_array, [stats], axis=0)
+    # Compute distance between each pixel and the background.
+    distance = ndi.distance_transform_edt(im_axon)
+    # Note: this distance is calculated from the im_axon,
+    # note from the im_axonmyelin image, because we know that each axon
+    # object is already isolated, therefore the distance metric will be
+    # more useful for the watershed algorithm below.
 
-    return stats_array
+    # Create an image with axon centroids, which value corresponds to the value of the axon object
+    # Note: The value "i + 1" corresponds to the label number of im_axon_label
+    im_centroid = np.zeros_like(im_axon, dtype='uint16')
+    im_centroid[ind_centroid] = np.arange(1, len(ind_centroid[0]) + 1)
+
+    # Watershed segmentation of axonmyelin using distance map
+    return morphology.watershed(-distance, im_centroid, mask=im_axonmyelin)
+
+
+def assign_myelin_to_nearest_axon(im_axon_label, im_myelin):
+    """
+    Assigns each myelin pixel to the nearest axon, by propagating the axon labels with the Euclidean distance transform
+    (like skimage.segmentation.expand_labels, restricted to the myelin mask). A myelin pixel is only assigned to an
+    axon of its connected component of the axon+myelin mask. Unlike the watershed, this doesn't depend on the
+    centroids, so the myelin of a non-convex axon whose centroid is outside of the axon is still found.
+    :param im_axon_label: Array: label image of the axons
+    :param im_myelin: Array: myelin binary mask
+    :return: label image of the axon+myelin objects, with the labels of their axons.
+    """
+
+    im_axonmyelin = np.logical_or(im_axon_label > 0, im_myelin)
+    if not np.any(im_axon_label):
+        return np.zeros_like(im_axon_label)
+
+    # Coordinates of the nearest axon pixel of each pixel
+    nearest = tuple(ndi.distance_transform_edt(im_axon_label == 0, return_distances=False, return_indices=True))
+    im_axonmyelin_label = im_axon_label[nearest]
+
+    # The background and the myelin that isn't connected to the axon are not assigned
+    im_component = measure.label(im_axonmyelin)
+    im_axonmyelin_label[im_component != im_component[nearest]] = 0
+
+    return im_axonmyelin_label
+
+
+def assign_myelin_to_axons(im_axon, im_myelin, im_axon_label, ind_centroid, method='watershed'):
+    """
+    Assigns the myelin pixels to the axons.
+    :param im_axon: Array: axon binary mask
+    :param im_myelin: Array: myelin binary mask
+    :param im_axon_label: Array: label image of the axons
+    :param ind_centroid: tuple of the row and column arrays of the (integer) centroids of the axons
+    :param method: str: 'watershed' to flood the axon+myelin mask from the axon centroids (see
+        assign_myelin_by_watershed), or 'nearest' to assign each myelin pixel to the nearest axon (see
+        assign_myelin_to_nearest_axon), which is faster.
+    :return: label image of the axon+myelin objects, where the object of the i-th axon is labelled i + 1.
+    """
+
+    if method == 'watershed':
+        return assign_myelin_by_watershed(im_axon, im_myelin, ind_centroid)
+    elif method == 'nearest':
+        return assign_myelin_to_nearest_axon(im_axon_label, im_myelin)
+    else:
+        raise ValueError("Invalid myelin assignment method: {0}. Must be one of {1}.".format(
+            method, myelin_assignment_methods))
+
+
+def _measure_labels(im_label):
+    """
+    Measures the area, centroid, equivalent diameter, eccentricity and orientation of all the objects of a label image
+    at once. The values are the same as those of skimage.measure.regionprops.
+    :param im_label: Array: label image, whose labels start at 1
+    :return: dict of arrays whose i-th value is the property of label i + 1 (the centroid is a tuple of the row and
+    column arrays). The labels missing from the image have an area of 0.
+    """
+
+    rows, cols = np.nonzero(im_label)
+    labels = im_label[rows, cols]
+    n_labels = labels.max() if labels.size else 0
+
+    area = np.bincount(labels, minlength=n_labels + 1)[1:].astype(float)
+    # Empty objects can't exist in a label image, this only avoids the division warnings for missing labels
+    safe_area = np.maximum(area, 1)
+    row_centroid = np.bincount(labels, weights=rows, minlength=n_labels + 1)[1:] / safe_area
+    col_centroid = np.bincount(labels, weights=cols, minlength=n_labels + 1)[1:] / safe_area
+
+    # Second order central moments, normalized by the area. They form the inertia tensor [[a, b], [b, c]].
+    d_rows = rows - row_centroid[labels - 1]
+    d_cols = cols - col_centroid[labels - 1]
+    a = np.bincount(labels, weights=d_cols * d_cols, minlength=n_labels + 1)[1:] / safe_area
+    b = -np.bincount(labels, weights=d_rows * d_cols, minlength=n_labels + 1)[1:] / safe_area
+    c = np.bincount(labels, weights=d_rows * d_rows, minlength=n_labels + 1)[1:] / safe_area
+
+    # Eigenvalues of the inertia tensor
+    half_trace = (a + c) / 2
+    root = np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+    l1 = np.clip(half_trace + root, 0, None)
+    l2 = np.clip(half_trace - root, 0, None)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eccentricity = np.where(l1 == 0, 0, np.sqrt(1 - l2 / l1))
+    orientation = np.where(
+        a - c == 0,
+        np.where(b < 0, -np.pi / 4, np.pi / 4),
+        -0.5 * np.arctan2(-2 * b, a - c)
+    )
+
+    return {
+        'area': area,
+        'centroid': (row_centroid, col_centroid),
+        'equivalent_diameter': np.sqrt(4 * area / np.pi),
+        'eccentricity': eccentricity,
+        'orientation': orientation
+    }
 
 def evaluate_myelin_thickness_in_px(axon_object, axonmyelin_object):
     """
@@ -212,6 +498,22 @@ def warn_if_measures_are_unexpected(axon_object, axonmyelin_object, attribute):
             )
         print(warning_msg.safe_substitute(data))
 
+def warn_if_measures_are_unexpected_for_all(val_axon, val_axonmyelin, attribute):
+    """
+    Vectorized version of `warn_if_measures_are_unexpected`: checks the measures of all the axons and their myelinated
+    axons at once, and prints a single warning summarizing the unexpected ones.
+    :param val_axon: Array: measures of the axons
+    :param val_axonmyelin: Array: measures of the corresponding myelinated axons
+    :param attribute: str: name of the measure
+    """
+    checked = (val_axon > 0) & (val_axonmyelin > 0) & (val_axonmyelin > val_axon)
+    n_unexpected = np.count_nonzero(~checked)
+    if n_unexpected > 0:
+        print(
+            "Warning, {0} of the {1} axons and their ".format(n_unexpected, checked.size) +
+            "corresponding myelinated axons have unexpected measure values for {0} attributes.".format(attribute)
+            )
+
 def _check_measures_are_relatively_valid(axon_object, axonmyelin_object, attribute):
     """
     Checks if the attribute is positive and if the myelinated axon has a greater value
@@ -260,34 +562,50 @@ def load_axon_morphometrics(path_folder):
         return stats_array
 
 
-def draw_axon_diameter(img, path_prediction, pred_axon, pred_myelin):
+def map_axon_values(im_axon_label, values, background=0):
+    """
+    Paints each axon of a label image with a value, e.g. its diameter, using a label->value lookup table.
+    :param im_axon_label: Array: label image of the axons, as returned by measure.label
+    :param values: Array: value of each axon, the i-th value being the value of label i + 1
+    :param background: value of the pixels outside of the axons
+    :return: Array (float32) of the shape of the label image
+    """
+    lut = np.empty(len(values) + 1, dtype=np.float32)
+    lut[0] = background
+    lut[1:] = values
+    return lut[im_axon_label]
+
+
+def draw_axon_diameter(img, path_prediction, pred_axon, pred_myelin, im_axon_label=None, stats_array=None):
     """
     :param img: sample grayscale image (png)
     :param path_prediction: full path to the segmented file (*_seg-axonmyelin.png)
         from axondeepseg segmentation output
     :param pred_axon: axon mask from axondeepseg segmentation output
     :param pred_myelin: myelin mask from axondeepseg segmentation output
+    :param im_axon_label: (optional) label image of pred_axon, if it was already computed
+    :param stats_array: (optional) morphometrics of the axons of pred_axon, if they were already computed, as returned
+        by get_axon_morphometrics_table or get_axon_morphometrics
     :return: matplotlib.figure.Figure
     """
-    
-    # If string, convert to Path objects
-    path_prediction = convert_path(path_prediction)
 
-    path_folder = path_prediction.parent
+    if stats_array is None:
+        # If string, convert to Path objects
+        path_prediction = convert_path(path_prediction)
 
-    stats_array = get_axon_morphometrics(pred_axon, path_folder)
-    axon_diam_list = [d["axon_diam"] for d in stats_array]
-    axon_diam_array = np.asarray(axon_diam_list)
+        session = MorphometricsSession(pred_axon, path_folder=path_prediction.parent)
+        if im_axon_label is None:
+            im_axon_label = session.axon_label
+        stats_array = session.get_table(include_myelin=False)
 
-    labels = measure.label(pred_axon)
-    axon_diam_display = np.zeros((np.shape(labels)[0], np.shape(labels)[1]))
+    if stats_array.dtype.names is not None:
+        axon_diam_array = stats_array['axon_diam']
+    else:
+        axon_diam_array = np.asarray([d["axon_diam"] for d in stats_array])
 
-    for pix_x in np.arange(np.shape(labels)[0]):
-        for pix_y in np.arange(np.shape(labels)[1]):
-            if labels[pix_x, pix_y] != 0:
-                axon_diam_display[pix_x, pix_y] = axon_diam_array[
-                    labels[pix_x, pix_y] - 1
-                ]
+    if im_axon_label is None:
+        im_axon_label = measure.label(pred_axon)
+    axon_diam_display = map_axon_values(im_axon_label, axon_diam_array)
 
     # Axon overlay on original image + myelin display (same color for every
     # myelin sheath)
@@ -326,41 +644,7 @@ def get_aggregate_morphometrics(pred_axon, pred_myelin, path_folder):
     :param path_folder: absolute path of folder containing pixel size file
     :return: aggregate_metrics: dictionary containing values of aggregate metrics
     """
-
-    # If string, convert to Path objects
-    path_folder = convert_path(path_folder)
-
-    # Compute AVF (axon volume fraction) = area occupied by axons in sample
-    avf = np.count_nonzero(pred_axon) / float((pred_axon.size))
-    # Compute MVF (myelin volume fraction) = area occupied by myelin sheaths in sample
-    mvf = np.count_nonzero(pred_myelin) / float((pred_myelin.size))
-
-    # Estimate aggregate g-ratio = sqrt(1/(1+MVF/AVF))
-    gratio = math.sqrt(1 / (1 + (float(mvf) / float(avf))))
-
-    # Get individual axons metrics and compute mean axon diameter
-    stats_array = get_axon_morphometrics(pred_axon, path_folder)
-    axon_diam_list = [d["axon_diam"] for d in stats_array]
-    mean_axon_diam = np.mean(axon_diam_list)
-
-    # Estimate mean myelin diameter (axon+myelin diameter) by using
-    # aggregate g-ratio = mean_axon_diam/mean_myelin_diam
-
-    mean_myelin_diam = mean_axon_diam / gratio
-
-    # Estimate mean myelin thickness = mean_myelin_radius - mean_axon_radius
-    mean_myelin_thickness = (float(mean_myelin_diam) / 2) - (float(mean_axon_diam) / 2)
-
-    # Compute axon density (number of axons per mm2)
-    px_size_um = get_pixelsize(path_folder / 'pixel_size_in_micrometer.txt')
-    img_area_mm2 = float(pred_axon.size) * px_size_um * px_size_um / (float(1000000))
-    axon_density_mm2 = float(len(axon_diam_list)) / float(img_area_mm2)
-
-    # Create disctionary to store aggregate metrics
-    aggregate_metrics = {'avf': avf, 'mvf': mvf, 'gratio_aggr': gratio, 'mean_axon_diam': mean_axon_diam,
-                         'mean_myelin_diam': mean_myelin_diam, 'mean_myelin_thickness': mean_myelin_thickness,
-                         'axon_density_mm2': axon_density_mm2}
-    return aggregate_metrics
+    return MorphometricsSession(pred_axon, im_myelin=pred_myelin, path_folder=path_folder).get_aggregate_metrics()
 
 
 def write_aggregate_morphometrics(path_folder, aggregate_metrics):
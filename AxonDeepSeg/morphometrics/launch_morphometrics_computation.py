@@ -3,6 +3,8 @@
 from pathlib import Path
 import argparse
 from argparse import RawTextHelpFormatter
+import concurrent.futures
+import json
 from matplotlib import image
 import sys
 
@@ -11,12 +13,13 @@ import numpy as np
 import pandas as pd
 
 # AxonDeepSeg imports
+import AxonDeepSeg
 from AxonDeepSeg.morphometrics.compute_morphometrics import (
-                                                                get_axon_morphometrics, 
+                                                                MorphometricsSession,
+                                                                get_pixelsize,
+                                                                morphometrics_columns,
                                                                 save_axon_morphometrics,  
-                                                                draw_axon_diameter,
                                                                 save_map_of_axon_diameters,
-                                                                get_aggregate_morphometrics,
                                                                 write_aggregate_morphometrics 
                                                             )
 import AxonDeepSeg.ads_utils as ads
@@ -56,21 +59,181 @@ def launch_morphometrics_computation(path_img, path_prediction):
         # Get folder path
         path_folder = path_img.parent
 
+        # The axons are labelled and measured once, for all the outputs below
+        session = MorphometricsSession(pred_axon, pred_myelin, path_folder=path_folder)
+
         # Compute and save axon morphometrics
-        stats_array = get_axon_morphometrics(pred_axon, path_folder)
+        stats_array = session.get_stats_array(include_myelin=False)
         save_axon_morphometrics(path_folder, stats_array)
 
         # Generate and save displays of axon morphometrics
-        fig = draw_axon_diameter(img, path_prediction, pred_axon, pred_myelin)
+        fig = session.draw_axon_diameter(img)
         save_map_of_axon_diameters(path_folder, fig)
 
         # Compute and save aggregate morphometrics
-        aggregate_metrics = get_aggregate_morphometrics(
-            pred_axon, pred_myelin, path_folder
-        )
+        aggregate_metrics = session.get_aggregate_metrics()
         write_aggregate_morphometrics(path_folder, aggregate_metrics)
 
 
+# Tuple of valid file extensions
+validExtensions = (
+                    ".jpeg",
+                    ".jpg",
+                    ".tif",
+                    ".tiff",
+                    ".png"
+                    )
+
+# Tuple of the file extensions of the supported formats of the morphometrics tables
+tableExtensions = (
+                    ".xlsx",
+                    ".csv",
+                    ".parquet",
+                    ".feather"
+                    )
+
+# Key of the metadata of AxonDeepSeg in the schema of the parquet and feather files
+metadata_key = b'axondeepseg'
+
+
+def compute_image_morphometrics(path_image, pixel_size=None, maps_format=None, tile_size=None):
+    """
+    Computes the morphometrics of the axons of a segmented image. This is the task run for each image of the CLI.
+    :param path_image: path of the image, whose axon and myelin masks are in the same folder
+    :param pixel_size: pixel size of the image in micrometers. If None, it is read from the
+    pixel_size_in_micrometer.txt file of the image folder.
+    :param maps_format: 'png' or 'tif' to also save the colour-coded maps of the morphometrics, or None
+    :param tile_size: if not None, the maps are saved as tiles of this size (in pixels)
+    :return: DataFrame of the morphometrics of each axon, with the path of the image in the 'image' column, and the
+    pixel size used.
+    """
+
+    # If string, convert to Path objects
+    path_image = convert_path(path_image)
+
+    if path_image.suffix.lower() not in validExtensions:
+        raise ValueError("The path {0} is not an image.".format(path_image))
+
+    # load the axon mask
+    path_axon = Path(str(path_image.with_suffix("")) + str(axon_suffix))
+    if not path_axon.exists():
+        raise ValueError("Segmented axon mask is not present in the image folder. " +
+                         "Please check that the axon mask is located in the image folder. " +
+                         "If it is not present, perform segmentation of the image first using ADS.")
+    pred_axon = image.imread(str(path_axon))
+
+    # load myelin mask
+    path_myelin = Path(str(path_image.with_suffix("")) + str(myelin_suffix))
+    if not path_myelin.exists():
+        raise ValueError("Segmented myelin mask is not present in the image folder. " +
+                         "Please check that the myelin mask is located in the image folder. " +
+                         "If it is not present, perform segmentation of the image first using ADS.")
+    pred_myelin = image.imread(str(path_myelin))
+
+    if pixel_size is None:  # Handle cases if no resolution is provided on the CLI
+        if not (path_image.parent / 'pixel_size_in_micrometer.txt').exists():
+            raise ValueError("No pixel size is provided, and there is no pixel_size_in_micrometer.txt file in " +
+                             "image folder. Please provide a pixel size (using argument -s), or add a " +
+                             "pixel_size_in_micrometer.txt file containing the pixel size value.")
+        pixel_size = get_pixelsize(path_image.parent / 'pixel_size_in_micrometer.txt')
+
+    # Compute statistics
+    session = MorphometricsSession(pred_axon, pred_myelin, pixel_size=pixel_size)
+    table = pd.DataFrame(session.get_table())
+    table.insert(0, 'image', str(path_image))
+
+    # Save the maps of the morphometrics
+    if maps_format is not None:
+        session.save_maps(path_image.parent, ads.imread(path_image), image_format=maps_format, tile_size=tile_size)
+
+    return table, pixel_size
+
+
+def get_morphometrics_metadata(images):
+    """
+    :param images: dict associating the name of each image of a morphometrics table to a dict of its metadata, e.g.
+    its 'pixel_size' and the 'model' used to segment it
+    :return: dict of the metadata of the morphometrics table, with the version of AxonDeepSeg
+    """
+    return {'ads_version': AxonDeepSeg.__version__, 'images': images}
+
+
+def _import_pyarrow(suffix):
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("The {0} morphometrics files require pyarrow: pip install pyarrow".format(suffix))
+    return pa, feather, pq
+
+
+def save_morphometrics_table(table, path_file, metadata=None):
+    """
+    Saves a morphometrics table, in the format given by the extension of the file. The parquet and feather files have
+    typed columns (float64 metrics and categorical image column) and store the metadata in their schema, see
+    load_morphometrics_table. They require pyarrow.
+    :param table: DataFrame of the morphometrics
+    :param path_file: path of the .xlsx, .csv, .parquet or .feather file
+    :param metadata: dict of the metadata of the table (see get_morphometrics_metadata), stored in the parquet and
+    feather files
+    :return: Nothing.
+    """
+
+    # If string, convert to Path objects
+    path_file = convert_path(path_file)
+    suffix = path_file.suffix.lower()
+
+    if suffix == '.xlsx':
+        table.to_excel(path_file)
+    elif suffix == '.csv':
+        table.to_csv(path_file)
+    elif suffix in ('.parquet', '.feather'):
+        pa, feather, pq = _import_pyarrow(suffix)
+
+        table = table.astype({column: 'float64' for column in table.columns if column in morphometrics_columns})
+        if 'image' in table.columns:
+            table = table.astype({'image': 'category'})
+
+        arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+        schema_metadata = dict(arrow_table.schema.metadata or {})
+        schema_metadata[metadata_key] = json.dumps(metadata if metadata is not None else get_morphometrics_metadata({}))
+        arrow_table = arrow_table.replace_schema_metadata(schema_metadata)
+
+        if suffix == '.parquet':
+            pq.write_table(arrow_table, str(path_file))
+        else:
+            feather.write_feather(arrow_table, str(path_file))
+    else:
+        raise ValueError("Invalid morphometrics file extension: {0}. Must be one of {1}.".format(suffix,
+                                                                                                 tableExtensions))
+
+
+def load_morphometrics_table(path_file):
+    """
+    Loads a morphometrics table saved in the parquet or feather format.
+    :param path_file: path of the .parquet or .feather file
+    :return: DataFrame of the morphometrics, and dict of the metadata of the table (see get_morphometrics_metadata).
+    """
+
+    # If string, convert to Path objects
+    path_file = convert_path(path_file)
+    suffix = path_file.suffix.lower()
+
+    pa, feather, pq = _import_pyarrow(suffix)
+    if suffix == '.parquet':
+        arrow_table = pq.read_table(str(path_file))
+    elif suffix == '.feather':
+        arrow_table = feather.read_table(str(path_file))
+    else:
+        raise ValueError("Invalid morphometrics file extension: {0}. Must be .parquet or .feather.".format(suffix))
+
+    schema_metadata = arrow_table.schema.metadata or {}
+    metadata = json.loads(schema_metadata[metadata_key]) if metadata_key in schema_metadata else {}
+
+    return arrow_table.to_pandas(), metadata
+
+
 def main(argv=None):
     ap = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter)
 
@@ -83,120 +246,89 @@ def main(argv=None):
 
     ap.add_argument('-i', '--imgpath', required=True, nargs='+', help='Path to the image.')
 
-    ap.add_argument('-f', '--filename', required=False,  help='Name of the excel file in which the morphometrics will be stored',
+    ap.add_argument('-f', '--filename', required=False,  help='Name of the file in which the morphometrics will be stored \n' +
+                                                              '(.xlsx, .csv, .parquet or .feather). A file is saved in each \n' +
+                                                              'image folder, with the morphometrics of all the images of that folder.',
                                                               default="axon_morphometrics")
 
+    ap.add_argument('-o', '--output', required=False, default=None,
+                                                              help='Also save the morphometrics of all the images in this single file \n' +
+                                                                   '(.xlsx, .csv, .parquet or .feather), with an image column.')
+
+    ap.add_argument('--model', required=False, default=None,
+                                                              help='Name of the model used to segment the images, stored with the pixel \n' +
+                                                                   'size and the version of AxonDeepSeg in the parquet and feather files.')
+
+    ap.add_argument('-j', '--jobs', required=False, type=int, default=1,
+                                                              help='Number of images processed in parallel.')
+
+    ap.add_argument('--maps', required=False, choices=['png', 'tif'], default=None,
+                                                              help='Also save colour-coded maps of the axon diameter, g-ratio, myelin \n' +
+                                                                   'thickness and eccentricity at the resolution of the image, in this format.')
+
+    ap.add_argument('--tile-size', required=False, type=int, default=None,
+                                                              help='Save the maps as tiles of this size (in pixels) instead of single images.')
+
     # Processing the arguments
     args = vars(ap.parse_args(argv))
     path_target_list = [Path(p) for p in args["imgpath"]]
     filename = str(args["filename"])
+    if not (filename.lower().endswith(tableExtensions)):  # If the user didn't add the extension, add it here
+        filename = filename + '.xlsx'
+
+    pixel_size = float(args["sizepixel"]) if args["sizepixel"] is not None else None
+    task_args = [(path_target, pixel_size, args["maps"], args["tile_size"]) for path_target in path_target_list]
+
+    # Each image is processed independently, so a failed image doesn't stop the others
+    results = {}
+    failures = {}
+    if args["jobs"] > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args["jobs"]) as executor:
+            futures = {executor.submit(compute_image_morphometrics, *task): task[0] for task in task_args}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    failures[futures[future]] = e
+    else:
+        for task in task_args:
+            try:
+                results[task[0]] = compute_image_morphometrics(*task)
+            except Exception as e:
+                failures[task[0]] = e
+
+    # The tables are consolidated in the order of the images
+    tables = [results[path_target][0] for path_target in path_target_list if path_target in results]
+    images_metadata = {str(path_target): {'pixel_size': image_pixel_size, 'model': args["model"]}
+                       for path_target, (_, image_pixel_size) in results.items()}
+    if tables:
+        table = pd.concat(tables, ignore_index=True, sort=False)
+
+        # Save the morphometrics of the images of each folder together, so that they don't overwrite each other
+        path_folders = list(dict.fromkeys(path_target.parent for path_target in path_target_list
+                                          if path_target not in failures))
+        for path_folder in path_folders:
+            folder_images = [str(path_target) for path_target in path_target_list
+                             if path_target.parent == path_folder and path_target not in failures]
+            try:
+                metadata = get_morphometrics_metadata({image: images_metadata[image] for image in folder_images})
+                save_morphometrics_table(table[table['image'].isin(folder_images)].reset_index(drop=True),
+                                         path_folder / filename, metadata)
+                print(f"Morphometrics file: {filename} has been saved in the {str(path_folder.absolute())} directory")
+            except (IOError, ImportError, ValueError) as e:
+                print("Cannot save morphometrics data in file '%s': %s" % (filename, e))
+
+        if args["output"] is not None:
+            try:
+                save_morphometrics_table(table, args["output"], get_morphometrics_metadata(images_metadata))
+                print(f"Morphometrics of {len(tables)} images have been saved in {args['output']}")
+            except (IOError, ImportError, ValueError) as e:
+                print("Cannot save morphometrics data in file '%s': %s" % (args["output"], e))
 
-    # Tuple of valid file extensions
-    validExtensions = (
-                        ".jpeg",
-                        ".jpg",
-                        ".tif",
-                        ".tiff",
-                        ".png"
-                        )
-
-    for current_path_target in path_target_list:
-        if current_path_target.suffix.lower() in validExtensions:
-
-            # load the axon mask
-            if (Path(str(current_path_target.with_suffix("")) + str(axon_suffix))).exists():
-                pred_axon = image.imread(str(current_path_target.with_suffix("")) + str(axon_suffix))
-            else: 
-                print("ERROR: Segmented axon mask is not present in the image folder. ",
-                              "Please check that the axon mask is located in the image folder. ",
-                              "If it is not present, perform segmentation of the image first using ADS."
-                      )
-                sys.exit(3)
-
-            # load myelin mask    
-            if (Path(str(current_path_target.with_suffix("")) + str(myelin_suffix))).exists():
-                pred_myelin = image.imread(str(current_path_target.with_suffix("")) + str(myelin_suffix))
-            else: 
-                print("ERROR: Segmented myelin mask is not present in the image folder. ",
-                              "Please check that the myelin mask is located in the image folder. ",
-                              "If it is not present, perform segmentation of the image first using ADS."
-                      )
-                sys.exit(3)
-
-            if args["sizepixel"] is not None:
-                psm = float(args["sizepixel"])
-            else:  # Handle cases if no resolution is provided on the CLI
-
-                # Check if a pixel size file exists, if so read it.
-                if (current_path_target.parent / 'pixel_size_in_micrometer.txt').exists():
-
-                    resolution_file = open(current_path_target.parent / 'pixel_size_in_micrometer.txt', 'r')
-
-                    psm = float(resolution_file.read())
-                else:
-
-                    print("ERROR: No pixel size is provided, and there is no pixel_size_in_micrometer.txt file in image folder. ",
-                                  "Please provide a pixel size (using argument -s), or add a pixel_size_in_micrometer.txt file ",
-                                  "containing the pixel size value."
-                          )
-                    sys.exit(3)
-
-            x = np.array([], dtype=[
-                                        ('x0', 'f4'),
-                                        ('y0', 'f4'),
-                                        ('gratio', 'f4'),
-                                        ('axon_area', 'f4'),
-                                        ('myelin_area', 'f4'),
-                                        ('axon_diam', 'f4'),
-                                        ('myelin_thickness', 'f4'),
-                                        ('axonmyelin_area', 'f4'),
-                                        ('solidity', 'f4'),
-                                        ('eccentricity', 'f4'),
-                                        ('orientation', 'f4')
-                                    ]
-                         )
-            
-            # Compute statistics
-            stats_array = get_axon_morphometrics(im_axon=pred_axon, im_myelin=pred_myelin, pixel_size=psm)
-
-            for stats in stats_array:
-
-                x = np.append(x, np.array(
-                        [(
-                            stats['x0'],
-                            stats['y0'],
-                            stats['gratio'],
-                            stats['axon_area'],
-                            stats['myelin_area'],
-                            stats['axon_diam'],
-                            stats['myelin_thickness'],
-                            stats['axonmyelin_area'],
-                            stats['solidity'],
-                            stats['eccentricity'],
-                            stats['orientation']
-                        )],
-                        dtype=x.dtype)
-                    )
+    for path_target, error in failures.items():
+        print("ERROR: {0}: {1}".format(path_target, error))
 
-            # save the current contents in the file
-            if not (filename.lower().endswith((".xlsx", ".csv"))):  # If the user didn't add the extension, add it here
-                filename = filename + '.xlsx' 
-            try:
-                # Export to excel
-                if filename.endswith('.xlsx'):
-                    pd.DataFrame(x).to_excel(current_path_target.parent / filename)
-                # Export to csv    
-                else: 
-                    pd.DataFrame(x).to_csv(current_path_target.parent / filename)
-                    
-                print(f"Moprhometrics file: {filename} has been saved in the {str(current_path_target.parent.absolute())} directory")
-            except IOError:
-                print("Cannot save morphometrics data in file '%s'." % filename)
-
-        else: 
-            print("The path(s) specified is/are not image(s). Please update the input path(s) and try again.")
-            break    
-    sys.exit(0)
+    sys.exit(3 if failures else 0)
 
 
 # Calling the script
@@ -0,0 +1,311 @@
+# coding: utf-8
+
+# Morphometric maps
+# -----------------
+# Writes colour-coded maps of the per-axon morphometrics (axon diameter, g-ratio, myelin thickness, eccentricity) at
+# the native resolution of the image. Each axon is painted with the colour of its value through a colormap lookup
+# table, and blended over the grayscale image in uint8. The maps are processed in bands of rows, so that the full
+# colour image is never held in memory: a PNG is streamed band after band, and tiled maps are written one tile at a
+# time. The colour scale is written in a separate, small legend image.
+
+import struct
+import zlib
+
+import numpy as np
+from matplotlib import cm
+from PIL import Image, ImageDraw
+
+from AxonDeepSeg.ads_utils import convert_path
+
+# Metrics that can be mapped, with the title of their legend
+map_metrics = {
+    'axon_diam': 'Axon diameter (um)',
+    'gratio': 'g-ratio',
+    'myelin_thickness': 'Myelin thickness (um)',
+    'eccentricity': 'Eccentricity'
+}
+
+
+def get_colormap_lut(colormap='hot', n_colors=256):
+    """
+    :param colormap: name of a matplotlib colormap
+    :param n_colors: number of colours of the lookup table
+    :return: Array (uint8) of shape (n_colors, 3), the RGB colour of each level of the colormap
+    """
+    return np.round(cm.get_cmap(colormap)(np.linspace(0, 1, n_colors))[:, :3] * 255).astype(np.uint8)
+
+
+def get_label_colors(values, colormap='hot', vmin=None, vmax=None):
+    """
+    Computes the colour of each axon from its value. The axons whose value is NaN are not coloured.
+    :param values: Array: value of each axon, the i-th value being the value of label i + 1
+    :param colormap: name of a matplotlib colormap
+    :param vmin: value mapped to the first colour of the colormap (minimum of the values if None)
+    :param vmax: value mapped to the last colour of the colormap (maximum of the values if None)
+    :return: Arrays indexed by label: the RGB colour (uint8) of each label and whether it is coloured (the
+    background, label 0, isn't), and the vmin and vmax used
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+
+    if vmin is None:
+        vmin = values[valid].min() if valid.any() else 0.
+    if vmax is None:
+        vmax = values[valid].max() if valid.any() else 1.
+
+    lut = get_colormap_lut(colormap)
+    levels = np.zeros(values.size, dtype=int)
+    if vmax > vmin:
+        levels[valid] = np.round((values[valid] - vmin) / (vmax - vmin) * (len(lut) - 1))
+    levels = np.clip(levels, 0, len(lut) - 1)
+
+    label_colors = np.zeros((values.size + 1, 3), dtype=np.uint8)
+    label_colors[1:] = lut[levels]
+    label_colored = np.zeros(values.size + 1, dtype=bool)
+    label_colored[1:] = valid
+
+    return label_colors, label_colored, vmin, vmax
+
+
+def blend_band(img_band, label_band, label_colors, label_colored, alpha=0.5):
+    """
+    Blends the colours of the axons of a band of rows over the grayscale image.
+    :param img_band: Array (uint8): band of the grayscale image
+    :param label_band: Array: same band of the label image of the axons
+    :param label_colors: Array: colour of each label, see get_label_colors
+    :param label_colored: Array: whether each label is coloured, see get_label_colors
+    :param alpha: opacity of the colours
+    :return: Array (uint8) of shape (rows, columns, 3), the RGB band of the map
+    """
+    weight = np.uint16(round(alpha * 256))
+
+    band = np.repeat(img_band[..., np.newaxis], 3, axis=2)
+    colored = label_colored[label_band]
+
+    # Integer blending: (gray * (256 - w) + colour * w) / 256, rounded
+    gray = band[colored].astype(np.uint16)
+    color = label_colors[label_band[colored]].astype(np.uint16)
+    band[colored] = ((gray * (256 - weight) + color * weight + 128) >> 8).astype(np.uint8)
+
+    return band
+
+
+def iter_map_bands(img, im_axon_label, values, colormap='hot', vmin=None, vmax=None, alpha=0.5, band_height=1024):
+    """
+    Generates the map of a per-axon value band after band.
+    :param img: Array: grayscale (or colour) image, can be a memory-mapped array
+    :param im_axon_label: Array: label image of the axons, of the same height and width as the image
+    :param values: Array: value of each axon, the i-th value being the value of label i + 1
+    :param colormap: name of a matplotlib colormap
+    :param vmin: value mapped to the first colour of the colormap (minimum of the values if None)
+    :param vmax: value mapped to the last colour of the colormap (maximum of the values if None)
+    :param alpha: opacity of the colours
+    :param band_height: number of rows of each band
+    :return: generator of (first row, RGB band) tuples
+    """
+    if img.shape[:2] != im_axon_label.shape:
+        raise ValueError("The image and the label image must have the same size.")
+
+    label_colors, label_colored, vmin, vmax = get_label_colors(values, colormap, vmin, vmax)
+
+    # The intensities of images that aren't in uint8 are scaled with the maximum of the whole image, so that all the
+    # bands have the same scale
+    scale = None
+    if img.dtype != np.uint8:
+        img_max = float(np.max(img))
+        scale = 255. / img_max if img_max > 0 else 1.
+
+    for row in range(0, img.shape[0], band_height):
+        img_band = np.asarray(img[row:row + band_height])
+        if img_band.ndim == 3:
+            img_band = img_band[..., :3].mean(axis=2)
+        if scale is not None:
+            img_band = img_band * scale
+        img_band = np.clip(np.round(img_band), 0, 255).astype(np.uint8)
+
+        yield row, blend_band(img_band, np.asarray(im_axon_label[row:row + band_height]), label_colors,
+                              label_colored, alpha)
+
+
+class PNGStreamWriter(object):
+    """
+    Writes an RGB PNG image band of rows after band of rows, without holding the whole image in memory.
+    """
+
+    def __init__(self, path_output, width, height):
+        """
+        :param path_output: path of the PNG file
+        :param width: width of the image
+        :param height: height of the image
+        """
+        self.width = width
+        self.height = height
+        self.n_rows = 0
+        self.compressor = zlib.compressobj()
+        self.file = open(str(path_output), 'wb')
+
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bits per channel, RGB, no interlacing
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    def write_rows(self, band):
+        """
+        :param band: Array (uint8) of shape (rows, width, 3), the next rows of the image
+        """
+        if band.shape[1:] != (self.width, 3):
+            raise ValueError("The band must have shape (rows, {0}, 3).".format(self.width))
+
+        # Each row starts with its filter type (0: none)
+        rows = np.zeros((band.shape[0], self.width * 3 + 1), dtype=np.uint8)
+        rows[:, 1:] = band.reshape(band.shape[0], -1)
+        data = self.compressor.compress(rows.tobytes())
+        if data:
+            self._write_chunk(b'IDAT', data)
+        self.n_rows += band.shape[0]
+
+    def close(self):
+        if self.n_rows != self.height:
+            self.file.close()
+            raise ValueError("{0} rows were written instead of {1}.".format(self.n_rows, self.height))
+        self._write_chunk(b'IDAT', self.compressor.flush())
+        self._write_chunk(b'IEND', b'')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+
+def write_morphometric_map(path_output, img, im_axon_label, values, colormap='hot', vmin=None, vmax=None,
+                           alpha=0.5, tile_size=None, band_height=1024):
+    """
+    Writes the map of a per-axon value at the native resolution of the image.
+    :param path_output: path of the map. Its extension gives the format (png, tif or tiff). For tiled maps, the tiles
+        are written next to it, as <name>_r<first row>_c<first column><extension>.
+    :param img: Array: grayscale (or colour) image, can be a memory-mapped array
+    :param im_axon_label: Array: label image of the axons, of the same height and width as the image
+    :param values: Array: value of each axon, the i-th value being the value of label i + 1
+    :param colormap: name of a matplotlib colormap
+    :param vmin: value mapped to the first colour of the colormap (minimum of the values if None)
+    :param vmax: value mapped to the last colour of the colormap (maximum of the values if None)
+    :param alpha: opacity of the colours
+    :param tile_size: if not None, the map is written as square tiles of this size instead of a single image
+    :param band_height: number of rows processed at once. For tiled maps, the bands are one tile high.
+    :return: list of the paths of the written images
+    """
+
+    # If string, convert to Path objects
+    path_output = convert_path(path_output)
+
+    height, width = im_axon_label.shape
+    suffix = path_output.suffix.lower()
+    if suffix not in ['.png', '.tif', '.tiff']:
+        raise ValueError("Invalid map format: {0}. Must be png, tif or tiff.".format(suffix))
+
+    if tile_size is not None:
+        paths_tiles = []
+        for row, band in iter_map_bands(img, im_axon_label, values, colormap, vmin, vmax, alpha, tile_size):
+            for col in range(0, width, tile_size):
+                path_tile = path_output.parent / "{0}_r{1}_c{2}{3}".format(path_output.stem, row, col,
+                                                                          path_output.suffix)
+                Image.fromarray(band[:, col:col + tile_size]).save(str(path_tile))
+                paths_tiles.append(path_tile)
+        return paths_tiles
+
+    if suffix == '.png':
+        with PNGStreamWriter(path_output, width, height) as writer:
+            for _, band in iter_map_bands(img, im_axon_label, values, colormap, vmin, vmax, alpha, band_height):
+                writer.write_rows(band)
+    else:
+        # TIFF images are written at once, the bands are only used to limit the memory of the computation
+        map_rgb = np.empty((height, width, 3), dtype=np.uint8)
+        for row, band in iter_map_bands(img, im_axon_label, values, colormap, vmin, vmax, alpha, band_height):
+            map_rgb[row:row + band.shape[0]] = band
+        Image.fromarray(map_rgb).save(str(path_output))
+
+    return [path_output]
+
+
+def write_map_legend(path_legend, vmin, vmax, title='', colormap='hot', width=320, height=80):
+    """
+    Writes the colour scale of a map in a small image.
+    :param path_legend: path of the legend image
+    :param vmin: value of the first colour of the colormap
+    :param vmax: value of the last colour of the colormap
+    :param title: title of the legend, e.g. the name and unit of the value
+    :param colormap: name of a matplotlib colormap
+    :param width: width of the legend image
+    :param height: height of the legend image
+    :return: None
+    """
+
+    # If string, convert to Path objects
+    path_legend = convert_path(path_legend)
+
+    margin = 10
+    bar_top, bar_bottom = height // 3, 2 * height // 3
+
+    legend = Image.new('RGB', (width, height), color=(255, 255, 255))
+    lut = get_colormap_lut(colormap)
+    bar = lut[np.linspace(0, len(lut) - 1, width - 2 * margin).astype(int)]
+    legend.paste(Image.fromarray(np.repeat(bar[np.newaxis], bar_bottom - bar_top, axis=0)), (margin, bar_top))
+
+    draw = ImageDraw.Draw(legend)
+    draw.text((margin, 2), title, fill=(0, 0, 0))
+    draw.text((margin, bar_bottom + 4), "{0:.3g}".format(vmin), fill=(0, 0, 0))
+    vmax_text = "{0:.3g}".format(vmax)
+    draw.text((width - margin - draw.textsize(vmax_text)[0], bar_bottom + 4), vmax_text, fill=(0, 0, 0))
+
+    legend.save(str(path_legend))
+
+
+def save_morphometric_maps(path_folder, img, im_axon_label, stats_array, metrics=None, image_format='png',
+                           colormap='hot', alpha=0.5, tile_size=None, band_height=1024):
+    """
+    Writes the map and the legend of each metric, as AxonDeepSeg_map-<metric>.<format> and
+    AxonDeepSeg_map-<metric>_legend.png.
+    :param path_folder: folder where the maps are written
+    :param img: Array: grayscale (or colour) image
+    :param im_axon_label: Array: label image of the axons whose morphometrics are in stats_array
+    :param stats_array: morphometrics of the axons, as returned by get_axon_morphometrics_table
+    :param metrics: list of the metrics to map (the metrics of map_metrics that are in stats_array if None)
+    :param image_format: format of the maps, png, tif or tiff
+    :param colormap: name of a matplotlib colormap
+    :param alpha: opacity of the colours
+    :param tile_size: if not None, the maps are written as square tiles of this size
+    :param band_height: number of rows processed at once
+    :return: dict associating each metric to the list of the paths of its map images
+    """
+
+    # If string, convert to Path objects
+    path_folder = convert_path(path_folder)
+
+    if metrics is None:
+        metrics = [metric for metric in map_metrics if metric in stats_array.dtype.names]
+
+    paths_maps = {}
+    for metric in metrics:
+        values = stats_array[metric]
+        valid = ~np.isnan(values)
+        vmin = values[valid].min() if valid.any() else 0.
+        vmax = values[valid].max() if valid.any() else 1.
+
+        paths_maps[metric] = write_morphometric_map(
+            path_folder / "AxonDeepSeg_map-{0}.{1}".format(metric, image_format), img, im_axon_label, values,
+            colormap=colormap, vmin=vmin, vmax=vmax, alpha=alpha, tile_size=tile_size, band_height=band_height
+        )
+        write_map_legend(path_folder / "AxonDeepSeg_map-{0}_legend.png".format(metric), vmin, vmax,
+                         title=map_metrics.get(metric, metric), colormap=colormap)
+
+    return paths_maps
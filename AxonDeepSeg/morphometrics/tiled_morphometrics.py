@@ -0,0 +1,196 @@
+# Tiled morphometrics
+# -------------------
+# Computes the axon morphometrics of masks that are too large to be labelled and flooded at once (e.g. whole-slide OM
+# segmentations). The image is cut into tiles, and each tile is processed in a window made of the tile and a halo
+# around it. The tiles are processed in parallel in a pool of processes. Each axon is computed by the tile that owns
+# its centroid, and the halo is large enough for the fibres of the tile and all their neighbours to be complete in
+# the window. With the 'nearest' myelin assignment (the default), the myelin of a fibre only depends on its
+# neighbours, so the per-axon results are the same as the ones of the single pass on the whole image. The watershed
+# floods each connected component of the axon+myelin mask as a whole, so it is only used for the tiles whose fibres
+# belong to components that are complete in the window, and the other tiles raise an error.
+
+import concurrent.futures
+import math
+import multiprocessing as mp
+import os
+
+import numpy as np
+from skimage import measure
+
+from AxonDeepSeg.morphometrics.compute_morphometrics import MorphometricsSession
+
+default_tile_size = 4096
+# Maximum expected diameter of an axon with its myelin, in micrometers
+default_max_fiber_diameter = 20.
+
+
+def get_tiles(image_shape, tile_size, halo):
+    """
+    Cuts an image into tiles, and computes the window of each tile, i.e. the tile extended by the halo on each side.
+    :param image_shape: tuple: (height, width) of the image
+    :param tile_size: int: size of the tiles, in pixels
+    :param halo: int: width of the halo, in pixels
+    :return: list of the (tile, window) of each tile, in raster order. The tile and the window are tuples of slices.
+    """
+    height, width = image_shape
+
+    tiles = []
+    for r0 in range(0, height, tile_size):
+        for c0 in range(0, width, tile_size):
+            r1, c1 = min(r0 + tile_size, height), min(c0 + tile_size, width)
+            tile = (slice(r0, r1), slice(c0, c1))
+            window = (slice(max(r0 - halo, 0), min(r1 + halo, height)),
+                      slice(max(c0 - halo, 0), min(c1 + halo, width)))
+            tiles.append((tile, window))
+
+    return tiles
+
+
+def _edge_labels(im_label, window, image_shape):
+    """
+    :return: labels of the objects touching the edges of the window that are not edges of the image.
+    """
+    edges = []
+    if window[0].start > 0:
+        edges.append(im_label[0, :])
+    if window[0].stop < image_shape[0]:
+        edges.append(im_label[-1, :])
+    if window[1].start > 0:
+        edges.append(im_label[:, 0])
+    if window[1].stop < image_shape[1]:
+        edges.append(im_label[:, -1])
+
+    if not edges:
+        return np.array([], dtype=im_label.dtype)
+    return np.unique(np.concatenate(edges))
+
+
+def process_tile(im_axon, im_myelin, pixel_size, tile, window, image_shape, myelin_assignment='nearest'):
+    """
+    Computes the morphometrics of the axons owned by a tile, i.e. the axons whose centroid is in the tile. This is the
+    task run by the workers for each tile.
+    :param im_axon: Array: axon binary mask of the window of the tile
+    :param im_myelin: Array: myelin binary mask of the window of the tile, or None
+    :param pixel_size: float: pixel size in micrometers
+    :param tile: tuple of slices: position of the tile in the image
+    :param window: tuple of slices: position of the window in the image
+    :param image_shape: tuple: (height, width) of the image
+    :param myelin_assignment: str: method used to assign the myelin pixels to the axons, see assign_myelin_to_axons
+    :return: structured array of the morphometrics of the axons of the tile, in image coordinates, and array of the
+    raster index in the image of the first pixel of each of these axons, which gives their order in the single pass.
+    """
+    session = MorphometricsSession(im_axon, im_myelin=im_myelin, pixel_size=pixel_size,
+                                   myelin_assignment=myelin_assignment)
+    table = session.get_table()
+
+    # Axons owned by the tile
+    y0 = table['y0'] + window[0].start
+    x0 = table['x0'] + window[1].start
+    owned = ((y0 >= tile[0].start) & (y0 < tile[0].stop) & (x0 >= tile[1].start) & (x0 < tile[1].stop))
+
+    # Position of the first pixel of each axon in the raster order of the window, which is the order of the labels
+    labels, first_pixels = np.unique(session.axon_label, return_index=True)
+    first_pixels = first_pixels[labels > 0]
+    first_rows, first_cols = np.unravel_index(first_pixels, im_axon.shape)
+
+    # The owned axons and their myelin must be complete in the window, otherwise the halo is too small
+    truncated_axons = np.isin(np.arange(1, session.n_axons + 1),
+                              _edge_labels(session.axon_label, window, image_shape))
+    truncated = truncated_axons.copy()
+    if im_myelin is not None:
+        ind_centroid = (table['y0'].astype(int), table['x0'].astype(int))
+        if myelin_assignment == 'nearest':
+            # The axonmyelin objects have the labels of their axons
+            label_axonmyelin = np.arange(1, session.n_axons + 1)
+        else:
+            label_axonmyelin = session.axonmyelin_label[ind_centroid]
+        truncated_fibers = _edge_labels(session.axonmyelin_label, window, image_shape)
+        truncated |= (label_axonmyelin > 0) & np.isin(label_axonmyelin, truncated_fibers)
+    if np.any(owned & truncated):
+        raise ValueError("Some axons of the tile at [y:{0}, x:{1}] are larger than the halo of the tiles. ".format(
+            tile[0].start, tile[1].start) + "Please increase the maximum fiber diameter.")
+
+    # The watershed floods a connected component of the axon+myelin mask from the centroids of all the axons in it,
+    # so the component of each owned fibre, and the axons whose centroid is in it, must be complete in the window
+    if im_myelin is not None and myelin_assignment == 'watershed':
+        im_component = measure.label(np.logical_or(im_axon, im_myelin))
+        owned_components = im_component.flat[first_pixels[owned]]
+        marker_components = im_component[ind_centroid]
+        if (np.any(np.isin(owned_components, _edge_labels(im_component, window, image_shape))) or
+                np.any(truncated_axons & (marker_components > 0) & np.isin(marker_components, owned_components))):
+            raise ValueError("The myelin of some axons of the tile at [y:{0}, x:{1}] is connected to fibres ".format(
+                tile[0].start, tile[1].start) + "outside of the halo of the tiles, so the watershed can't be "
+                "computed by tiles. Please use the 'nearest' myelin assignment.")
+
+    raster_index = (first_rows + window[0].start) * image_shape[1] + (first_cols + window[1].start)
+
+    table = table[owned]
+    table['y0'] += window[0].start
+    table['x0'] += window[1].start
+
+    return table, raster_index[owned]
+
+
+def get_tiled_axon_morphometrics_table(im_axon, im_myelin=None, pixel_size=None, tile_size=default_tile_size,
+                                       max_fiber_diameter=default_max_fiber_diameter, myelin_assignment='nearest',
+                                       n_workers=None, verbosity_level=0):
+    """
+    Computes the morphometrics of each axon tile by tile, in a pool of processes. The result is the same as the one
+    of get_axon_morphometrics_table with the same myelin assignment, but the memory needed only depends on the size of
+    the tiles.
+    :param im_axon: Array: axon binary mask, output of axondeepseg. It can be a memory-mapped array, of which only
+    the windows of the tiles being processed are read.
+    :param im_myelin: Array: myelin binary mask, output of axondeepseg
+    :param pixel_size: float: pixel size in micrometers
+    :param tile_size: int: size of the tiles, in pixels
+    :param max_fiber_diameter: float: maximum expected diameter of an axon with its myelin, in micrometers. The halo
+    of the tiles is twice this diameter, so that the fibres of a tile and their neighbours are complete in its window.
+    :param myelin_assignment: str: method used to assign the myelin pixels to the axons, see assign_myelin_to_axons.
+    With 'watershed', a ValueError is raised if the myelin of the fibres of a tile is connected to fibres outside of
+    its window.
+    :param n_workers: int: number of processes (defaults to the number of CPUs). If 1, the tiles are processed in the
+    current process.
+    :param verbosity_level: int: level of verbosity. The higher, the more information is given about the tiles.
+    :return: structured array with one row per axon and one field per metric (see morphometrics_columns), in the
+    order of get_axon_morphometrics_table.
+    """
+    if pixel_size is None:
+        raise ValueError("The pixel size must be given.")
+
+    image_shape = im_axon.shape
+    halo = int(math.ceil(2 * max_fiber_diameter / pixel_size))
+    tiles = get_tiles(image_shape, tile_size, halo)
+
+    def tile_args(tile, window):
+        return (np.asarray(im_axon[window]), None if im_myelin is None else np.asarray(im_myelin[window]),
+                pixel_size, tile, window, image_shape, myelin_assignment)
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    results = []
+    if n_workers == 1 or len(tiles) == 1:
+        for tile, window in tiles:
+            results.append(process_tile(*tile_args(tile, window)))
+    else:
+        # The workers are started from a fresh interpreter, as the current process may have started TensorFlow
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers,
+                                                    mp_context=mp.get_context('spawn')) as executor:
+            # Only a few windows per worker are sent at once, so that the windows of all the tiles are never in
+            # memory together
+            max_pending = 2 * n_workers
+            pending = set()
+            for tile, window in tiles:
+                if len(pending) >= max_pending:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    results += [future.result() for future in done]
+                pending.add(executor.submit(process_tile, *tile_args(tile, window)))
+            results += [future.result() for future in concurrent.futures.as_completed(pending)]
+
+    if verbosity_level >= 1:
+        print("Morphometrics of {0} tiles computed.".format(len(tiles)))
+
+    table = np.concatenate([tile_table for tile_table, _ in results])
+    raster_index = np.concatenate([tile_raster_index for _, tile_raster_index in results])
+
+    return table[np.argsort(raster_index)]
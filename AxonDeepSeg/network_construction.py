@@ -1,5 +1,6 @@
 from keras.layers import (
                             Conv2D,
+                            SeparableConv2D,
                             BatchNormalization,
                             Activation,
                             Dropout,
@@ -13,21 +14,39 @@ from keras.models import Model
 import tensorflow as tf
 import AxonDeepSeg.ads_utils
 
+def convolution(convolution_type='standard', kernel_initializer='glorot_normal', **kwargs):
+    """
+    Builds the Keras layer corresponding to a type of convolution.
+    :param convolution_type: String, 'standard' for dense convolutions, 'separable' for depthwise-separable
+    convolutions (a depthwise convolution followed by a 1x1 convolution), which need far fewer operations.
+    :param kernel_initializer: Initializer of the kernels (both the depthwise and pointwise ones if separable).
+    :param kwargs: The other arguments of the convolution layer (filters, kernel_size, strides, ...).
+    :return: The Keras layer.
+    """
+    if convolution_type == 'standard':
+        return Conv2D(kernel_initializer=kernel_initializer, **kwargs)
+    elif convolution_type == 'separable':
+        return SeparableConv2D(depthwise_initializer=kernel_initializer, pointwise_initializer=kernel_initializer,
+                               **kwargs)
+    else:
+        raise ValueError("Invalid convolution_type: {0}. Must be 'standard' or 'separable'.".format(convolution_type))
+
+
 def conv_relu(x, filters, kernel_size, strides, name, activation='relu', kernel_initializer='glorot_normal',
               activate_bn=True,
-              bn_decay=0.999, keep_prob=1.0):
+              bn_decay=0.999, keep_prob=1.0, convolution_type='standard'):
     with tf.name_scope(name):
         with tf.name_scope("convolution"):
             if activate_bn == True:
 
-                net = Conv2D(filters=filters, kernel_size=kernel_size, strides=strides, padding='same', use_bias=False,
-                             kernel_initializer=kernel_initializer)(x)
+                net = convolution(convolution_type, filters=filters, kernel_size=kernel_size, strides=strides,
+                                  padding='same', use_bias=False, kernel_initializer=kernel_initializer)(x)
                 net = BatchNormalization(axis=3, momentum=1 - bn_decay)(net)
                 net = Activation(activation)(net)
 
             else:
-                net = Conv2D(filters=filters, kernel_size=kernel_size, strides=strides, activation=activation,
-                             kernel_initializer=kernel_initializer, padding='same')(x)
+                net = convolution(convolution_type, filters=filters, kernel_size=kernel_size, strides=strides,
+                                  activation=activation, kernel_initializer=kernel_initializer, padding='same')(x)
 
         net = Dropout(1 - keep_prob)(net)
 
@@ -35,20 +54,20 @@ def conv_relu(x, filters, kernel_size, strides, name, activation='relu', kernel_
 
 
 def downconv(x, filters, name, kernel_size=5, strides=2, activation='relu', kernel_initializer='glorot_normal',
-             activate_bn=True, bn_decay=0.999):
+             activate_bn=True, bn_decay=0.999, convolution_type='standard'):
     with tf.name_scope(name):
         with tf.name_scope("convolution"):
             if activate_bn == True:
 
-                net = Conv2D(filters=filters, kernel_size=kernel_size, strides=strides, padding='same', use_bias=False,
-                             kernel_initializer=kernel_initializer)(x)
+                net = convolution(convolution_type, filters=filters, kernel_size=kernel_size, strides=strides,
+                                  padding='same', use_bias=False, kernel_initializer=kernel_initializer)(x)
                 net = BatchNormalization(axis=3, momentum=1 - bn_decay)(net)
                 net = Activation(activation)(net)
 
             else:
 
-                net = Conv2D(filters=filters, kernel_size=kernel_size, strides=strides, activation=activation,
-                             kernel_initializer=kernel_initializer, padding='same')(x)
+                net = convolution(convolution_type, filters=filters, kernel_size=kernel_size, strides=strides,
+                                  activation=activation, kernel_initializer=kernel_initializer, padding='same')(x)
 
     return net
 
@@ -78,6 +97,8 @@ def uconv_net(training_config, bn_updated_decay=None, verbose=True):
     features_per_convolution = training_config["features_per_convolution"]
     downsampling = training_config["downsampling"]
     activate_bn = training_config["batch_norm_activate"]
+    # For retrocompatibility with old configs
+    convolution_type = training_config.get("convolution_type", "standard")
     if bn_updated_decay is None:
         bn_decay = training_config["batch_norm_decay_starting_decay"]
     else:
@@ -108,7 +129,8 @@ def uconv_net(training_config, bn_updated_decay=None, verbose=True):
             net = conv_relu(net, filters=features_per_convolution[i][conv_number][1],
                             kernel_size=size_of_convolutions_per_layer[i][conv_number], strides=1,
                             activation='relu', kernel_initializer='glorot_normal', activate_bn=activate_bn,
-                            bn_decay=bn_decay,keep_prob=dropout, name='cconv-d' + str(i) + '-c' + str(conv_number))
+                            bn_decay=bn_decay,keep_prob=dropout, name='cconv-d' + str(i) + '-c' + str(conv_number),
+                            convolution_type=convolution_type)
 
         relu_results.append(net)  # We keep them for the upconvolutions
 
@@ -116,7 +138,7 @@ def uconv_net(training_config, bn_updated_decay=None, verbose=True):
 
             net = downconv(net, filters=features_per_convolution[i][conv_number][1], kernel_size=5, strides=2,
                            activation='relu', kernel_initializer='glorot_normal', activate_bn=activate_bn,
-                           bn_decay=bn_decay, name='downconv-d' + str(i))
+                           bn_decay=bn_decay, name='downconv-d' + str(i), convolution_type=convolution_type)
 
         else:
 
@@ -135,7 +157,8 @@ def uconv_net(training_config, bn_updated_decay=None, verbose=True):
         # Convolution
         net = conv_relu(net, filters=features_per_convolution[depth - i - 1][-1][1], kernel_size=2, strides=1,
                         activation='relu', kernel_initializer='glorot_normal', activate_bn=activate_bn,
-                        bn_decay=bn_decay, keep_prob=dropout, name='upconv-d' + str(depth - i - 1))
+                        bn_decay=bn_decay, keep_prob=dropout, name='upconv-d' + str(depth - i - 1),
+                        convolution_type=convolution_type)
 
         data_temp_size.append(data_temp_size[-1] * 2)
 
@@ -147,7 +170,8 @@ def uconv_net(training_config, bn_updated_decay=None, verbose=True):
             net = conv_relu(net, filters=features_per_convolution[depth - i - 1][conv_number][1],
                             kernel_size=size_of_convolutions_per_layer[depth - i - 1][conv_number], strides=1,
                             activation='relu', kernel_initializer='glorot_normal', activate_bn=activate_bn,
-                            bn_decay=bn_decay,keep_prob=dropout, name='econv-d' + str(depth - i - 1) + '-c' + str(conv_number))
+                            bn_decay=bn_decay,keep_prob=dropout, name='econv-d' + str(depth - i - 1) + '-c' + str(conv_number),
+                            convolution_type=convolution_type)
 
     net = Conv2D(filters=n_classes, kernel_size=1, strides=1, name='finalconv', padding='same', activation="softmax")(net)
 
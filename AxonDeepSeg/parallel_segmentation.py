@@ -0,0 +1,345 @@
+# Parallel segmentation
+# ---------------------
+# Reads and resamples the acquisitions in worker processes while the network segments the patches in the main
+# process. The patches are handed over through a ring of buffers allocated in shared memory: only small descriptors
+# go through the queue, so that the large arrays are never pickled.
+
+import argparse
+import ctypes
+import multiprocessing as mp
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.apply_model import (load_acquisitions, prepare_patches, load_model, predict_patches,
+                                     process_segmented_patches)
+
+
+class SharedBatchRing(object):
+    """
+    Ring of batch buffers allocated in shared memory. A producer acquires a free slot, writes a batch of patches in
+    it and sends the index of the slot to the consumer, which releases the slot once the batch is consumed.
+    The ring must be created before the processes using it, which inherit the buffers.
+    """
+
+    def __init__(self, n_slots, batch_size, patch_size):
+        """
+        :param n_slots: Int, number of buffers of the ring.
+        :param batch_size: Int, maximum number of patches in a buffer.
+        :param patch_size: Int, size of the side of a patch.
+        """
+        self.batch_shape = (batch_size, patch_size, patch_size)
+        self.buffers = [mp.RawArray(ctypes.c_uint8, int(np.prod(self.batch_shape))) for _ in range(n_slots)]
+        self.free_slots = mp.Queue()
+        for slot in range(n_slots):
+            self.free_slots.put(slot)
+
+    def acquire(self):
+        """
+        Waits for a free buffer.
+        :return: Int, index of the buffer.
+        """
+        return self.free_slots.get()
+
+    def release(self, slot):
+        """
+        Gives a buffer back to the producers.
+        :param slot: Int, index of the buffer.
+        """
+        self.free_slots.put(slot)
+
+    def view(self, slot):
+        """
+        :param slot: Int, index of the buffer.
+        :return: Array of shape (batch_size, patch_size, patch_size) sharing the memory of the buffer.
+        """
+        return np.frombuffer(self.buffers[slot], dtype=np.uint8).reshape(self.batch_shape)
+
+
+def load_resampled_acquisition(path_acquisition, acquisition_resolution, resampled_resolution, cache=None):
+    """
+    Loads an acquisition and resamples it to the resolution of the model.
+    :param path_acquisition: Path to the acquisition.
+    :param acquisition_resolution: Float, the resolution the acquisition was acquired with.
+    :param resampled_resolution: Float, the resolution to resample to.
+    :param cache: ResampledAcquisitionCache, if not None the resampled acquisition is read from and added to this
+    cache.
+    :return: The resampled acquisition and the shape of the original acquisition.
+    """
+
+    rs_acquisitions, rs_coeffs, original_acquisitions_shapes = load_acquisitions(
+        [path_acquisition], [acquisition_resolution], [resampled_resolution], cache=cache)
+
+    return rs_acquisitions[0], original_acquisitions_shapes[0]
+
+
+def read_acquisitions(L_indices, load_function, L_load_args, patch_size, overlap_value, batch_size, descriptors,
+                      ring=None):
+    """
+    Loop of the reader processes: loads the acquisitions, cuts them into patches and sends the patches batch after
+    batch. With a ring, the patches are written in shared memory and only the index of the buffer is sent through the
+    queue, else the batches themselves are sent (and pickled).
+    :param L_indices: List of the indices of the acquisitions to read.
+    :param load_function: Function returning a resampled acquisition and its original shape.
+    :param L_load_args: List of the arguments of load_function for each acquisition.
+    :param patch_size: Int, size of a patch.
+    :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+    :param batch_size: Int, number of patches per batch.
+    :param descriptors: Queue receiving the descriptors of the acquisitions and of the batches.
+    :param ring: SharedBatchRing, or None to send the batches through the queue.
+    :return: Nothing.
+    """
+
+    try:
+        for i in L_indices:
+            rs_acquisition, original_shape = load_function(*L_load_args[i])
+            L_data, L_n_patches, L_positions = prepare_patches([rs_acquisition], patch_size, overlap_value)
+
+            descriptors.put(('acquisition', i, L_n_patches[0], L_positions[0], original_shape))
+
+            for start in range(0, len(L_data), batch_size):
+                batch = L_data[start:start + batch_size]
+
+                if ring is not None:
+                    slot = ring.acquire()
+                    buffer = ring.view(slot)
+                    for k, patch in enumerate(batch):
+                        buffer[k] = patch
+                    descriptors.put(('batch', i, start, len(batch), slot))
+                else:
+                    descriptors.put(('batch', i, start, len(batch), np.stack(batch)))
+
+        descriptors.put(('done',))
+
+    except Exception as e:
+        descriptors.put(('error', repr(e)))
+
+
+def receive_batches(descriptors, n_readers, ring=None):
+    """
+    Receives the descriptors sent by the reader processes until all of them are done.
+    The descriptors of the acquisitions are yielded as sent, the ones of the batches as ('batch', index of the
+    acquisition, index of the first patch, batch). With a ring, the batch is a view of the shared buffer, which is
+    released when the next descriptor is requested: it must be consumed before that.
+    :param descriptors: Queue receiving the descriptors.
+    :param n_readers: Int, number of reader processes.
+    :param ring: SharedBatchRing used by the readers, or None.
+    :return: Generator of the descriptors.
+    """
+
+    n_done = 0
+
+    while n_done < n_readers:
+        descriptor = descriptors.get()
+
+        if descriptor[0] == 'done':
+            n_done += 1
+        elif descriptor[0] == 'error':
+            raise Exception("A reader process failed: {0}".format(descriptor[1]))
+        elif descriptor[0] == 'batch':
+            _, i, start, size, batch = descriptor
+            if ring is not None:
+                yield 'batch', i, start, ring.view(batch)[:size]
+                ring.release(batch)
+            else:
+                yield 'batch', i, start, batch
+        else:
+            yield descriptor
+
+
+def start_readers(load_function, L_load_args, patch_size, overlap_value, batch_size, n_readers=2, n_slots=None,
+                  shared_memory=True):
+    """
+    Starts the reader processes, each one reading a part of the acquisitions.
+    :param load_function: Function returning a resampled acquisition and its original shape.
+    :param L_load_args: List of the arguments of load_function for each acquisition.
+    :param patch_size: Int, size of a patch.
+    :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+    :param batch_size: Int, number of patches per batch.
+    :param n_readers: Int, number of reader processes.
+    :param n_slots: Int, number of batches that can wait for the consumer. Defaults to 4 per reader.
+    :param shared_memory: Boolean, whether to hand the batches over through shared memory or through the queue.
+    :return: The reader processes, the queue of descriptors and the ring (None without shared memory).
+    """
+
+    n_readers = max(1, min(n_readers, len(L_load_args)))
+    if n_slots is None:
+        n_slots = 4 * n_readers
+
+    ring = SharedBatchRing(n_slots, batch_size, patch_size) if shared_memory else None
+    descriptors = mp.Queue(maxsize=2 * n_slots)
+
+    readers = [mp.Process(target=read_acquisitions,
+                          args=(list(range(k, len(L_load_args), n_readers)), load_function, L_load_args, patch_size,
+                                overlap_value, batch_size, descriptors, ring),
+                          daemon=True)
+               for k in range(n_readers)]
+    for reader in readers:
+        reader.start()
+
+    return readers, descriptors, ring
+
+
+def segment_in_parallel(path_acquisitions, acquisitions_resolutions, path_model_folder, config_dict,
+                        ckpt_name='model', inference_batch_size=1, overlap_value=25, resampled_resolutions=[0.1],
+                        n_readers=2, shared_memory=True, cache=None, gpu_per=1.0, verbosity_level=0):
+    """
+    Segments acquisitions like apply_convnet, while the acquisitions are read, resampled and cut into patches by
+    reader processes. The network processes the batches in the order they are ready, and each acquisition is stitched
+    as soon as all its patches are segmented.
+    :param path_acquisitions: List of path to the acquisitions.
+    :param acquisitions_resolutions: List of the acquisitions resolutions (floats).
+    :param path_model_folder: Path to the model folder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param ckpt_name: String, checkpoint to use.
+    :param inference_batch_size: Int, batch size to use when doing inference.
+    :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+    :param resampled_resolutions: List of resolutions (floats) to resample to before performing inference.
+    :param n_readers: Int, number of reader processes.
+    :param shared_memory: Boolean, whether to hand the batches over through shared memory.
+    :param cache: ResampledAcquisitionCache, if not None the readers read the resampled acquisitions from and add them
+    to this cache.
+    :param gpu_per: Float, percentage of GPU to use if we use it.
+    :param verbosity_level: Int, how much information to display.
+    :return: List of segmentations.
+    """
+
+    # If string, convert to Path objects
+    path_acquisitions = convert_path(path_acquisitions)
+    path_model_folder = convert_path(path_model_folder)
+
+    patch_size = config_dict["trainingset_patchsize"]
+    n_classes = config_dict["n_classes"]
+
+    if not isinstance(acquisitions_resolutions, list):
+        acquisitions_resolutions = [acquisitions_resolutions] * len(path_acquisitions)
+    if not isinstance(resampled_resolutions, list) or len(resampled_resolutions) != len(path_acquisitions):
+        resampled_resolutions = [np.ravel(resampled_resolutions)[0]] * len(path_acquisitions)
+
+    L_load_args = [(path_acquisition, acquisitions_resolutions[i], resampled_resolutions[i], cache)
+                   for i, path_acquisition in enumerate(path_acquisitions)]
+
+    # The readers are forked before Tensorflow starts its session
+    readers, descriptors, ring = start_readers(load_resampled_acquisition, L_load_args, patch_size, overlap_value,
+                                               inference_batch_size, n_readers=n_readers,
+                                               shared_memory=shared_memory)
+
+    model, sess, pred, x = load_model(path_model_folder, config_dict, ckpt_name=ckpt_name, gpu_per=gpu_per,
+                                      verbosity_level=verbosity_level)
+
+    predictions = [None] * len(path_acquisitions)
+    L_acquisitions = {}
+
+    try:
+        for descriptor in receive_batches(descriptors, len(readers), ring):
+
+            if descriptor[0] == 'acquisition':
+                _, i, n_patches, positions, original_shape = descriptor
+                L_acquisitions[i] = {'positions': positions, 'shape': original_shape,
+                                     'predictions': [None] * n_patches, 'n_remaining': n_patches}
+                continue
+
+            _, i, start, batch = descriptor
+            acquisition = L_acquisitions[i]
+
+            batch_predictions = predict_patches(model, sess, pred, x, batch, patch_size, n_classes,
+                                                inference_batch_size=inference_batch_size)
+            acquisition['predictions'][start:start + len(batch)] = batch_predictions
+            acquisition['n_remaining'] -= len(batch)
+
+            if acquisition['n_remaining'] == 0:
+                predictions[i] = process_segmented_patches(acquisition['predictions'],
+                                                           [len(acquisition['predictions'])],
+                                                           [acquisition['positions']], [acquisition['shape']],
+                                                           overlap_value, n_classes)[0]
+                del L_acquisitions[i]
+
+                if verbosity_level >= 2:
+                    print("Acquisition {0} segmented.".format(path_acquisitions[i]))
+    finally:
+        for reader in readers:
+            reader.join(timeout=1)
+            if reader.is_alive():
+                reader.terminate()
+        tf.reset_default_graph()
+
+    return predictions
+
+
+def synthetic_acquisition(size, seed=0):
+    """
+    Generates a random acquisition, already at the resolution of the model.
+    :param size: Int, size of the side of the acquisition.
+    :param seed: Int, seed of the random generator.
+    :return: The acquisition and its shape.
+    """
+
+    acquisition = np.random.RandomState(seed).randint(0, 256, (size, size), dtype=np.uint8)
+
+    return acquisition, acquisition.shape
+
+
+def benchmark_handoff(image_size=20000, patch_size=512, overlap_value=25, batch_size=8, n_images=1):
+    """
+    Compares the time needed to hand the patches of synthetic acquisitions over from a reader process to the main
+    process, through shared memory and through the pickling of the queue. The consumer only reads the batches, and
+    the generation of the acquisitions is the same in both modes, so the difference between the timings is the cost of
+    the handoff. The consumer sums the first pixel of each patch, and the sums of both modes are compared to check
+    that the patches are received intact.
+    :param image_size: Int, size of the side of the synthetic acquisitions.
+    :param patch_size: Int, size of a patch.
+    :param overlap_value: Int, number of pixels of overlap between the patches.
+    :param batch_size: Int, number of patches per batch.
+    :param n_images: Int, number of synthetic acquisitions.
+    :return: dict with the time in seconds of the 'shared_memory' and 'pickling' handoffs.
+    """
+
+    L_load_args = [(image_size, seed) for seed in range(n_images)]
+    timings = {}
+    checksums = {}
+
+    for mode, shared_memory in [('shared_memory', True), ('pickling', False)]:
+        start_time = time.time()
+        readers, descriptors, ring = start_readers(synthetic_acquisition, L_load_args, patch_size, overlap_value,
+                                                   batch_size, n_readers=1, shared_memory=shared_memory)
+
+        checksum = 0
+        for descriptor in receive_batches(descriptors, len(readers), ring):
+            if descriptor[0] == 'batch':
+                checksum += int(descriptor[3][:, 0, 0].sum())
+
+        for reader in readers:
+            reader.join()
+        timings[mode] = time.time() - start_time
+        checksums[mode] = checksum
+
+    if checksums['shared_memory'] != checksums['pickling']:
+        raise ValueError("The patches received through shared memory differ from the ones received through the "
+                         "queue.")
+
+    return timings
+
+
+def main(argv=None):
+    """
+    Runs the handoff benchmark.
+    :return: Nothing.
+    """
+
+    ap = argparse.ArgumentParser(description='Benchmark of the handoff of patches between the reader processes and '
+                                             'the inference process.')
+    ap.add_argument('--size', type=int, default=20000, help='Size of the side of the synthetic image.')
+    ap.add_argument('--batch-size', type=int, default=8, help='Number of patches per batch.')
+    ap.add_argument('--patch-size', type=int, default=512, help='Size of a patch.')
+    args = ap.parse_args(argv)
+
+    timings = benchmark_handoff(image_size=args.size, patch_size=args.patch_size, batch_size=args.batch_size)
+
+    print("Shared memory handoff: {0:.2f} s".format(timings['shared_memory']))
+    print("Pickling handoff: {0:.2f} s".format(timings['pickling']))
+
+
+if __name__ == '__main__':
+    main()
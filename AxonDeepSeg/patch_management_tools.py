@@ -110,3 +110,63 @@ def patches2im_overlap(L_patches, L_pos, overlap_value=25, scw=512):
         new_img[e[0]:e[0] + spw, e[1]:e[1] + spw] = L_pred[i]
 
     return new_img
+
+
+def get_tiles(image_shape, tile_size, margin=0, min_size=0):
+
+    '''
+    Splits an image into tiles, to process images that are too large to be processed at once.
+    :param image_shape: the shape of the image.
+    :param tile_size: Int, the size of the side of the tiles.
+    :param margin: Int, the number of pixels of context added on each side of the tiles.
+    :param min_size: Int, the minimum size of the side of the context windows.
+    :return: List of (tile, context) tuples, both being (h0, w0, h1, w1) coordinates in the image. The tiles cover the
+    image without overlapping, and each context window contains its tile and its margin, clipped to the image.
+    '''
+
+    L_tiles = []
+
+    for h0 in range(0, image_shape[0], tile_size):
+        for w0 in range(0, image_shape[1], tile_size):
+            h1 = min(h0 + tile_size, image_shape[0])
+            w1 = min(w0 + tile_size, image_shape[1])
+
+            ch0, ch1 = _extend_range(h0, h1, margin, min_size, image_shape[0])
+            cw0, cw1 = _extend_range(w0, w1, margin, min_size, image_shape[1])
+
+            L_tiles.append(((h0, w0, h1, w1), (ch0, cw0, ch1, cw1)))
+
+    return L_tiles
+
+
+def get_roi_context(roi, image_shape, margin=0, min_size=0):
+
+    '''
+    Computes the context window of a region of interest, i.e. the region extended by a margin on each side.
+    :param roi: (h0, w0, h1, w1) coordinates of the region of interest in the image.
+    :param image_shape: the shape of the image.
+    :param margin: Int, the number of pixels of context added on each side of the region.
+    :param min_size: Int, the minimum size of the side of the context window.
+    :return: (ch0, cw0, ch1, cw1) coordinates of the context window, clipped to the image.
+    '''
+
+    h0, w0, h1, w1 = roi
+
+    ch0, ch1 = _extend_range(h0, h1, margin, min_size, image_shape[0])
+    cw0, cw1 = _extend_range(w0, w1, margin, min_size, image_shape[1])
+
+    return ch0, cw0, ch1, cw1
+
+
+def _extend_range(start, end, margin, min_size, length):
+    '''
+    Extends the range [start, end[ by a margin on each side and to at least min_size, without going out of [0, length[.
+    '''
+
+    start, end = max(start - margin, 0), min(end + margin, length)
+
+    if end - start < min_size:
+        start = max(end - min_size, 0)
+        end = min(start + min_size, length)
+
+    return start, end
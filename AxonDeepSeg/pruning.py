@@ -0,0 +1,264 @@
+# Structured pruning
+# ------------------
+# Removes the least important channels of the convolutions of a trained U-net, fine-tunes the pruned network and
+# compares its speed and segmentations to the original network.
+
+import argparse
+import copy
+import json
+
+import numpy as np
+import tensorflow as tf
+import keras.backend.tensorflow_backend as K
+from keras.layers import Conv2D, SeparableConv2D, BatchNormalization, Concatenate, InputLayer
+from prettytable import PrettyTable
+
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.config_tools import update_config, default_configuration
+from AxonDeepSeg.distillation import compare_to_teacher
+from AxonDeepSeg.network_construction import uconv_net
+from AxonDeepSeg.train_network import train_model
+
+
+def prune_config(config, pruning_ratio):
+    """
+    Generates the configuration of a pruned network, with a fraction of the features of each convolution removed.
+    :param config: Dict, configuration of the network.
+    :param pruning_ratio: Float between 0 and 1, fraction of the channels to remove.
+    :return: Dict, configuration of the pruned network.
+    """
+
+    pruned_config = copy.deepcopy(config)
+    features_per_convolution = []
+    in_features = 1
+
+    for layer in config["features_per_convolution"]:
+        pruned_layer = []
+        for _, out_features in layer:
+            n_features = max(1, int(round(out_features * (1 - pruning_ratio))))
+            pruned_layer.append([in_features, n_features])
+            in_features = n_features
+        features_per_convolution.append(pruned_layer)
+
+    pruned_config["features_per_convolution"] = features_per_convolution
+
+    return pruned_config
+
+
+def get_consumers(model):
+    """
+    Finds the layers using the output of each layer of a model.
+    :param model: Keras model.
+    :return: Dict associating the name of each layer to the list of the layers using its output.
+    """
+
+    consumers = {layer.name: [] for layer in model.layers}
+    for layer in model.layers:
+        for inbound_layer in layer._inbound_nodes[0].inbound_layers:
+            consumers[inbound_layer.name].append(layer)
+
+    return consumers
+
+
+def channel_importance(conv_layer, consumers, criterion='bn'):
+    """
+    Ranks the output channels of a convolution.
+    :param conv_layer: Keras Conv2D or SeparableConv2D layer.
+    :param consumers: Dict of the consumers of each layer, as returned by get_consumers.
+    :param criterion: String, 'bn' to use the scale of the batch normalization following the convolution (the L1 norm
+    is used if there is none), or 'l1' to use the L1 norm of the filters.
+    :return: Array of the importance of each output channel.
+    """
+
+    following_bn = [layer for layer in consumers[conv_layer.name] if isinstance(layer, BatchNormalization)]
+
+    if criterion == 'bn' and following_bn:
+        return np.abs(following_bn[0].get_weights()[0])
+    elif criterion in ('bn', 'l1'):
+        # The output channels of a separable convolution are the ones of its pointwise kernel
+        kernel = conv_layer.get_weights()[1 if isinstance(conv_layer, SeparableConv2D) else 0]
+        return np.abs(kernel).sum(axis=(0, 1, 2))
+    else:
+        raise ValueError("Invalid pruning criterion: {0}. Must be 'bn' or 'l1'.".format(criterion))
+
+
+def transfer_pruned_weights(model, pruned_model, criterion='bn'):
+    """
+    Copies the weights of the most important channels of a network into its pruned version. The channels kept by each
+    layer are propagated to the layers using its output, so that the skip connections (concatenations) stay
+    consistent.
+    :param model: Keras model, the trained network.
+    :param pruned_model: Keras model, the network built from the pruned configuration.
+    :param criterion: String, criterion used to rank the channels, see channel_importance.
+    :return: Dict associating the name of each layer of the original network to the indices of its kept channels.
+    """
+
+    consumers = get_consumers(model)
+    kept_channels = {}
+
+    # Both networks are built by the same code, so their layers are in the same order
+    for layer, pruned_layer in zip(model.layers, pruned_model.layers):
+
+        if isinstance(layer, InputLayer):
+            kept_channels[layer.name] = np.arange(layer.output_shape[-1])
+            continue
+
+        inbound_layers = layer._inbound_nodes[0].inbound_layers
+        in_channels = kept_channels[inbound_layers[0].name]
+
+        if isinstance(layer, (Conv2D, SeparableConv2D)):
+            weights = layer.get_weights()
+            if pruned_layer.filters == layer.filters:
+                out_channels = np.arange(layer.filters)
+            else:
+                importance = channel_importance(layer, consumers, criterion)
+                out_channels = np.sort(np.argsort(-importance)[:pruned_layer.filters])
+
+            if isinstance(layer, SeparableConv2D):
+                # Depthwise kernel (k, k, in, 1) and pointwise kernel (1, 1, in, out)
+                pruned_weights = [weights[0][:, :, in_channels], weights[1][:, :, in_channels][:, :, :, out_channels]]
+            else:
+                pruned_weights = [weights[0][:, :, in_channels][:, :, :, out_channels]]
+            if layer.use_bias:
+                pruned_weights.append(weights[-1][out_channels])
+            pruned_layer.set_weights(pruned_weights)
+            kept_channels[layer.name] = out_channels
+
+        elif isinstance(layer, BatchNormalization):
+            pruned_layer.set_weights([w[in_channels] for w in layer.get_weights()])
+            kept_channels[layer.name] = in_channels
+
+        elif isinstance(layer, Concatenate):
+            # The channels of each input are shifted by the number of channels of the previous inputs
+            offset = 0
+            concatenated_channels = []
+            for inbound_layer in inbound_layers:
+                concatenated_channels.append(kept_channels[inbound_layer.name] + offset)
+                offset += inbound_layer.output_shape[-1]
+            kept_channels[layer.name] = np.concatenate(concatenated_channels)
+
+        else:
+            # Activation, dropout, pooling and upsampling layers keep the channels of their input
+            kept_channels[layer.name] = in_channels
+
+    return kept_channels
+
+
+def prune_model(path_model, path_pruned_model, pruning_ratio, path_trainingset=None, fine_tuning_epochs=2,
+                criterion='bn'):
+    """
+    Prunes a trained model, and fine-tunes it if a trainingset is given. The pruned model folder contains the new
+    config_network.json and the weights, in the formats written by train_model.
+    :param path_model: Path to the model folder, containing config_network.json and model.hdf5.
+    :param path_pruned_model: Path indicating where to save the pruned model.
+    :param pruning_ratio: Float between 0 and 1, fraction of the channels to remove.
+    :param path_trainingset: Path to the trainingset used to fine-tune the pruned model, or None.
+    :param fine_tuning_epochs: Int, number of epochs of fine-tuning.
+    :param criterion: String, criterion used to rank the channels, see channel_importance.
+    :return: Dict, configuration of the pruned model.
+    """
+
+    # If string, convert to Path objects
+    path_model = convert_path(path_model)
+    path_pruned_model = convert_path(path_pruned_model)
+    path_pruned_model.mkdir(parents=True, exist_ok=True)
+
+    with open(str(path_model / 'config_network.json'), 'r') as fd:
+        config = update_config(default_configuration(), json.loads(fd.read()))
+    pruned_config = prune_config(config, pruning_ratio)
+
+    K.clear_session()
+    model = uconv_net(config, verbose=False)
+    model.load_weights(str(path_model / 'model.hdf5'))
+    pruned_model = uconv_net(pruned_config, verbose=False)
+    transfer_pruned_weights(model, pruned_model, criterion)
+    pruned_weights = pruned_model.get_weights()
+
+    # The pruned network is rebuilt alone, so that its variables have the names expected when it is restored
+    K.clear_session()
+    pruned_model = uconv_net(pruned_config, verbose=False)
+    pruned_model.set_weights(pruned_weights)
+    pruned_model.save(str(path_pruned_model / 'model.hdf5'))
+
+    if path_trainingset is not None:
+        # The number of epochs of the fine-tuning is not saved in the configuration of the pruned model
+        fine_tuning_config = dict(pruned_config, epochs=fine_tuning_epochs)
+        K.clear_session()
+        train_model(path_trainingset, path_pruned_model, fine_tuning_config, path_model_init=path_pruned_model)
+    else:
+        saver = tf.train.Saver()
+        saver.save(K.get_session(), str(path_pruned_model / 'model.ckpt'))
+
+    with open(str(path_pruned_model / 'config_network.json'), 'w') as fd:
+        json.dump(pruned_config, fd, indent=2)
+
+    K.clear_session()
+
+    return pruned_config
+
+
+def pruning_report(path_model, path_output_folder, path_trainingset, pruning_ratios=[0.25, 0.5, 0.75],
+                   fine_tuning_epochs=2, criterion='bn', batch_size=8):
+    """
+    Prunes a model with several ratios, and compares the throughput and the segmentations of each pruned model to the
+    original model on the Validation folder of the trainingset.
+    :param path_model: Path to the model folder.
+    :param path_output_folder: Path of the folder where the pruned models are saved, in one subfolder per ratio.
+    :param path_trainingset: Path to the trainingset used to fine-tune and evaluate the pruned models.
+    :param pruning_ratios: List of the fractions of channels to remove.
+    :param fine_tuning_epochs: Int, number of epochs of fine-tuning.
+    :param criterion: String, criterion used to rank the channels, see channel_importance.
+    :param batch_size: Int, inference batch size used to measure the throughput.
+    :return: Dict associating each pruning ratio to its report, as returned by distillation.compare_to_teacher.
+    """
+
+    # If string, convert to Path objects
+    path_output_folder = convert_path(path_output_folder)
+    path_trainingset = convert_path(path_trainingset)
+
+    reports = {}
+
+    for pruning_ratio in pruning_ratios:
+        path_pruned_model = path_output_folder / 'pruned_{0}'.format(int(round(100 * pruning_ratio)))
+        prune_model(path_model, path_pruned_model, pruning_ratio, path_trainingset=path_trainingset,
+                    fine_tuning_epochs=fine_tuning_epochs, criterion=criterion)
+        reports[pruning_ratio] = compare_to_teacher(path_model, path_pruned_model, path_trainingset / 'Validation',
+                                                    batch_size=batch_size, verbose=False)
+
+    table = PrettyTable()
+    table.field_names = ["pruning ratio", "patches/s", "speedup", "axon dice", "myelin dice"]
+    for pruning_ratio, report in reports.items():
+        # Dice against the masks when available, else against the original model
+        axon_dice = report.get('student_axon_dice', report['axon_dice_to_teacher'])
+        myelin_dice = report.get('student_myelin_dice', report['myelin_dice_to_teacher'])
+        table.add_row([pruning_ratio, round(report['student_throughput'], 2), round(report['speedup'], 2),
+                       round(axon_dice, 4), round(myelin_dice, 4)])
+    print(table)
+
+    return reports
+
+
+def main(argv=None):
+    """
+    Prunes a model with several ratios and displays the report.
+    :return: Nothing.
+    """
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-m", "--path_model", required=True, help="Folder of the trained model (with model.hdf5).")
+    ap.add_argument("-o", "--path_output", required=True, help="Folder where the pruned models are saved.")
+    ap.add_argument("-p", "--path_training", required=True, help="Trainingset used for fine-tuning and evaluation.")
+    ap.add_argument("-r", "--ratios", required=False, type=float, nargs='+', default=[0.25, 0.5, 0.75],
+                    help="Fractions of the channels to remove.")
+    ap.add_argument("-e", "--epochs", required=False, type=int, default=2, help="Number of epochs of fine-tuning.")
+    ap.add_argument("-c", "--criterion", required=False, choices=['bn', 'l1'], default='bn',
+                    help="Ranking of the channels: scale of the batch normalization, or L1 norm of the filters.")
+
+    args = vars(ap.parse_args(argv))
+
+    pruning_report(args["path_model"], args["path_output"], args["path_training"], pruning_ratios=args["ratios"],
+                   fine_tuning_epochs=args["epochs"], criterion=args["criterion"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Cache of the resampled acquisitions
+# -----------------------------------
+# Keeps the acquisitions resampled to the resolution of a model on disk, so that segmenting the same images again
+# (with another overlap, zoom factor or model) skips their decoding and resampling.
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from AxonDeepSeg.ads_utils import convert_path
+
+DEFAULT_CACHE_PATH = Path.home() / '.axondeepseg_cache'
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3  # bytes
+
+
+class ResampledAcquisitionCache(object):
+    """
+    On-disk cache of resampled acquisitions. Each entry is a uint8 .npy file, read as a memory map, and its key is
+    computed from the path, the size and the modification time of the source image and from the resampling
+    coefficient, so that the source image doesn't need to be read to find its entry.
+    When the cache grows over its size limit, the least recently used entries are removed.
+    """
+
+    def __init__(self, path_cache=DEFAULT_CACHE_PATH, max_size=DEFAULT_CACHE_SIZE):
+        """
+        :param path_cache: Path of the folder where the entries are stored.
+        :param max_size: Int, maximum size of the cache in bytes.
+        """
+        self.path_cache = convert_path(path_cache)
+        self.max_size = max_size
+        self.path_cache.mkdir(parents=True, exist_ok=True)
+
+    def get_key(self, path_acquisition, resampling_coeff):
+        """
+        Computes the key of a resampled acquisition.
+        :param path_acquisition: Path of the source image.
+        :param resampling_coeff: Float, the resampling coefficient.
+        :return: String, the key of the entry.
+        """
+
+        path_acquisition = convert_path(path_acquisition).resolve()
+        stat = os.stat(str(path_acquisition))
+
+        sha1 = hashlib.sha1()
+        sha1.update('{0}-{1}-{2}-{3!r}'.format(path_acquisition, stat.st_size, stat.st_mtime_ns,
+                                               float(resampling_coeff)).encode())
+
+        return sha1.hexdigest()
+
+    def get(self, path_acquisition, resampling_coeff, key=None):
+        """
+        Looks for a resampled acquisition in the cache.
+        :param path_acquisition: Path of the source image.
+        :param resampling_coeff: Float, the resampling coefficient.
+        :param key: String, the key of the entry if it was already computed with get_key.
+        :return: The resampled acquisition (read-only memory map) and the shape of the original acquisition, or
+        (None, None) if the entry is not in the cache.
+        """
+
+        if key is None:
+            key = self.get_key(path_acquisition, resampling_coeff)
+        path_entry = self.path_cache / (key + '.npy')
+        path_info = self.path_cache / (key + '.json')
+
+        if not (path_entry.exists() and path_info.exists()):
+            return None, None
+
+        # The modification time of the entries gives the order of their last use
+        os.utime(str(path_entry))
+
+        with open(str(path_info), 'r') as f:
+            original_shape = tuple(json.load(f)['original_shape'])
+
+        return np.load(str(path_entry), mmap_mode='r'), original_shape
+
+    def put(self, path_acquisition, resampling_coeff, resampled_acquisition, original_shape, key=None):
+        """
+        Adds a resampled acquisition to the cache, then removes the least recently used entries if the cache is full.
+        :param path_acquisition: Path of the source image.
+        :param resampling_coeff: Float, the resampling coefficient.
+        :param resampled_acquisition: The resampled acquisition.
+        :param original_shape: The shape of the original acquisition.
+        :param key: String, the key of the entry if it was already computed with get_key.
+        :return: Nothing.
+        """
+
+        if key is None:
+            key = self.get_key(path_acquisition, resampling_coeff)
+
+        with open(str(self.path_cache / (key + '.json')), 'w') as f:
+            json.dump({'source': str(path_acquisition), 'original_shape': [int(e) for e in original_shape]}, f)
+
+        # Written under a temporary name, so that an interrupted write doesn't leave a corrupted entry
+        path_tmp = self.path_cache / (key + '.tmp.npy')
+        np.save(str(path_tmp), np.asarray(resampled_acquisition, dtype=np.uint8))
+        os.replace(str(path_tmp), str(self.path_cache / (key + '.npy')))
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in its size limit.
+        :return: Nothing.
+        """
+
+        # The reader processes of the parallel segmentation may remove the same entries at the same time
+        entries = []
+        for path_entry in self.path_cache.glob('*.npy'):
+            try:
+                entries.append((path_entry, path_entry.stat()))
+            except FileNotFoundError:
+                pass
+        entries.sort(key=lambda e: e[1].st_mtime)
+        size = sum(stat.st_size for _, stat in entries)
+
+        for path_entry, stat in entries:
+            if size <= self.max_size:
+                break
+            size -= stat.st_size
+            for path_file in [path_entry, path_entry.with_suffix('.json')]:
+                try:
+                    path_file.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        """
+        Removes all the entries of the cache.
+        :return: Nothing.
+        """
+
+        for path_entry in list(self.path_cache.glob('*.npy')) + list(self.path_cache.glob('*.json')):
+            path_entry.unlink()
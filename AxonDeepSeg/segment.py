@@ -20,6 +20,8 @@ import pkg_resources
 import AxonDeepSeg
 import AxonDeepSeg.ads_utils as ads
 from AxonDeepSeg.apply_model import axon_segmentation
+from AxonDeepSeg.segmentation_planner import plan_segmentation, print_plan, probe_image_shape
+from AxonDeepSeg.resampling_cache import ResampledAcquisitionCache, DEFAULT_CACHE_PATH
 from AxonDeepSeg.ads_utils import convert_path
 from config import axonmyelin_suffix, axon_suffix, myelin_suffix
 
@@ -35,12 +37,15 @@ default_SEM_path = MODELS_PATH / SEM_DEFAULT_MODEL_NAME
 default_TEM_path = MODELS_PATH / TEM_DEFAULT_MODEL_NAME
 model_seg_pns_bf_path = MODELS_PATH / OM_MODEL_NAME
 default_overlap = 25
+default_batch_size = 1
+default_images_per_run = 20
 
 # Definition of the functions
 
 def segment_image(path_testing_image, path_model,
                   overlap_value, config, resolution_model,
-                  acquired_resolution = None, verbosity_level=0):
+                  acquired_resolution = None, inference_batch_size=default_batch_size, tissue_detection=False,
+                  tile_size=None, cache=None, callback=None, verbosity_level=0):
 
     '''
     Segment the image located at the path_testing_image location.
@@ -50,6 +55,15 @@ def segment_image(path_testing_image, path_model,
     border effects but more time to perform the segmentation.
     :param config: dict containing the configuration of the network
     :param resolution_model: the resolution the model was trained on.
+    :param inference_batch_size: the number of patches fed to the network at once.
+    :param tissue_detection: if True, only the patches intersecting the tissue are segmented, the rest of the image
+    is labelled as background.
+    :param tile_size: if not None, the image is segmented in tiles of this size (in pixels at the resolution of the
+    model), to limit the memory used for large images.
+    :param cache: ResampledAcquisitionCache, if not None the resampled image is read from and added to this cache, so
+    that segmenting the same image again skips its loading and resampling.
+    :param callback: if not None, function called with each event of the segmentation (see apply_convnet), e.g. to
+    report its progress. An exception raised by the callback stops the segmentation.
     :param verbosity_level: Level of verbosity. The higher, the more information is given about the segmentation
     process.
     :return: Nothing.
@@ -77,10 +91,12 @@ def segment_image(path_testing_image, path_model,
 
         axon_segmentation(path_acquisitions_folders=path_acquisition, acquisitions_filenames=[acquisition_name],
                           path_model_folder=path_model, config_dict=config, ckpt_name='model',
-                          inference_batch_size=1, overlap_value=overlap_value,
+                          inference_batch_size=inference_batch_size, overlap_value=overlap_value,
                           resampled_resolutions=resolution_model, verbosity_level=verbosity_level,
                           acquired_resolution=acquired_resolution,
-                          prediction_proba_activate=False, write_mode=True)
+                          prediction_proba_activate=False, write_mode=True,
+                          tissue_detection=tissue_detection, tile_size=tile_size, cache=cache,
+                          callback=callback)
 
         if verbosity_level >= 1:
             print(("Image {0} segmented.".format(path_testing_image)))
@@ -91,9 +107,76 @@ def segment_image(path_testing_image, path_model,
 
     return None
 
+def segment_images(path_images, path_model, overlap_value, config, resolution_model,
+                   acquired_resolutions, inference_batch_size=default_batch_size,
+                   images_per_run=default_images_per_run, tissue_detection=False, tile_size=None,
+                   n_readers=0, cache=None, verbosity_level=0):
+    '''
+    Segments several images while sharing the network and the inference batches between them.
+    The images are processed in runs of at most images_per_run images. The patches of all the images of a run are
+    fed to the network together in full batches, whatever the pixel size of each image, and the predictions are
+    then scattered back to their respective image.
+    :param path_images: list of paths of the images to segment.
+    :param path_model: where to access the model.
+    :param overlap_value: the number of pixels to be used for overlap when doing prediction. Higher value means less
+    border effects but more time to perform the segmentation.
+    :param config: dict containing the configuration of the network
+    :param resolution_model: the resolution the model was trained on.
+    :param acquired_resolutions: list of the pixel sizes of the images, or a single pixel size for all of them.
+    :param inference_batch_size: the number of patches fed to the network at once.
+    :param images_per_run: the maximum number of images loaded in memory at the same time.
+    :param tissue_detection: if True, only the patches intersecting the tissue are segmented.
+    :param tile_size: if not None, the images are segmented in tiles of this size (in pixels at the resolution of the
+    model), to limit the memory used for large images.
+    :param n_readers: the number of processes reading the images while the network segments them (0 to read them in
+    the main process).
+    :param cache: ResampledAcquisitionCache, if not None the resampled images are read from and added to this cache.
+    :param verbosity_level: Level of verbosity. The higher, the more information is given about the segmentation
+    process.
+    :return: Nothing.
+    '''
+
+    # If string, convert to Path objects
+    path_images = convert_path(path_images)
+    path_model = convert_path(path_model)
+
+    if not isinstance(acquired_resolutions, list):
+        acquired_resolutions = [acquired_resolutions] * len(path_images)
+
+    # Images with the same pixel size are placed next to each other, so that the resampled images of a run
+    # have similar sizes.
+    order = sorted(range(len(path_images)), key=lambda i: acquired_resolutions[i])
+    path_images = [path_images[i] for i in order]
+    acquired_resolutions = [acquired_resolutions[i] for i in order]
+
+    for i in tqdm(range(0, len(path_images), images_per_run), desc="Segmentation..."):
+        path_images_run = path_images[i:i + images_per_run]
+
+        axon_segmentation(path_acquisitions_folders=[path_img.parent for path_img in path_images_run],
+                          acquisitions_filenames=[path_img.name for path_img in path_images_run],
+                          path_model_folder=path_model, config_dict=config, ckpt_name='model',
+                          inference_batch_size=inference_batch_size, overlap_value=overlap_value,
+                          acquired_resolution=acquired_resolutions[i:i + images_per_run],
+                          verbosity_level=verbosity_level,
+                          resampled_resolutions=resolution_model, prediction_proba_activate=False,
+                          write_mode=True, tissue_detection=tissue_detection, tile_size=tile_size,
+                          n_readers=n_readers, cache=cache)
+
+        if verbosity_level >= 1:
+            for path_img in path_images_run:
+                tqdm.write("Image {0} segmented.".format(str(path_img)))
+
+    return None
+
 def segment_folders(path_testing_images_folder, path_model,
                     overlap_value, config, resolution_model,
                     acquired_resolution = None,
+                    inference_batch_size=default_batch_size,
+                    images_per_run=default_images_per_run,
+                    tissue_detection=False,
+                    tile_size=None,
+                    n_readers=0,
+                    cache=None,
                     verbosity_level=0):
     '''
     Segments the images contained in the image folders located in the path_testing_images_folder.
@@ -104,6 +187,14 @@ def segment_folders(path_testing_images_folder, path_model,
     border effects but more time to perform the segmentation.
     :param config: dict containing the configuration of the network
     :param resolution_model: the resolution the model was trained on.
+    :param inference_batch_size: the number of patches fed to the network at once.
+    :param images_per_run: the maximum number of images loaded in memory at the same time.
+    :param tissue_detection: if True, only the patches intersecting the tissue are segmented.
+    :param tile_size: if not None, the images are segmented in tiles of this size (in pixels at the resolution of the
+    model), to limit the memory used for large images.
+    :param n_readers: the number of processes reading the images while the network segments them (0 to read them in
+    the main process).
+    :param cache: ResampledAcquisitionCache, if not None the resampled images are read from and added to this cache.
     :param verbosity_level: Level of verbosity. The higher, the more information is given about the segmentation
     process.
     :return: Nothing.
@@ -113,12 +204,10 @@ def segment_folders(path_testing_images_folder, path_model,
     path_testing_images_folder = convert_path(path_testing_images_folder)
     path_model = convert_path(path_model)
 
-    # Update list of images to segment by selecting only image files (not already segmented or not masks)
-    img_files = [file for file in path_testing_images_folder.iterdir() if (file.suffix.lower() in ('.png','.jpg','.jpeg','.tif','.tiff'))
-                 and (not str(file).endswith((str(axonmyelin_suffix), str(axon_suffix), str(myelin_suffix),'mask.png')))]
+    img_files = get_images_to_segment(path_testing_images_folder)
 
-    # Pre-processing: convert to png if not already done and adapt to model contrast
-    for file_ in tqdm(img_files, desc="Segmentation..."):
+    # Check that every image is large enough before segmenting any of them
+    for file_ in img_files:
         print(path_testing_images_folder / file_)
         try:
             height, width, _ = ads.imread(str(path_testing_images_folder / file_)).shape
@@ -140,29 +229,54 @@ def segment_folders(path_testing_images_folder, path_model,
 
             sys.exit(2)
 
-        selected_model = path_model.name
+    # The images of the folder share the same pixel size, so their patches are batched together
+    segment_images([path_testing_images_folder / file_ for file_ in img_files], path_model, overlap_value, config,
+                   resolution_model, acquired_resolution, inference_batch_size=inference_batch_size,
+                   images_per_run=images_per_run, tissue_detection=tissue_detection, tile_size=tile_size,
+                   n_readers=n_readers, cache=cache, verbosity_level=verbosity_level)
 
-        # Read image for conversion
-        img = ads.imread(str(path_testing_images_folder / file_))
+    return None
 
-        img_name_original = file_.stem
+def get_images_to_segment(path_folder):
+    '''
+    Lists the images of a folder that can be segmented, i.e. the image files that are not segmentations or masks.
+    :param path_folder: the folder containing the images.
+    :return: list of the paths of the images.
+    '''
 
-        acquisition_name = file_.name
+    # If string, convert to Path objects
+    path_folder = convert_path(path_folder)
 
-        axon_segmentation(path_acquisitions_folders=path_testing_images_folder, acquisitions_filenames=[acquisition_name],
-                              path_model_folder=path_model, config_dict=config, ckpt_name='model',
-                              inference_batch_size=1, overlap_value=overlap_value,
-                              acquired_resolution=acquired_resolution,
-                              verbosity_level=verbosity_level,
-                              resampled_resolutions=resolution_model, prediction_proba_activate=False,
-                              write_mode=True)
+    return [file for file in path_folder.iterdir() if (file.suffix.lower() in ('.png','.jpg','.jpeg','.tif','.tiff'))
+            and (not str(file).endswith((str(axonmyelin_suffix), str(axon_suffix), str(myelin_suffix),'mask.png')))]
 
-        if verbosity_level >= 1:
-            tqdm.write("Image {0} segmented.".format(str(path_testing_images_folder / file_)))
+def plan_images_segmentation(path_images, acquired_resolution, resolution_model, config, overlap_value,
+                             max_memory=None, inference_batch_size=None, dry_run=False):
+    '''
+    Chooses the batch size, the number of images segmented together and the tile size of the segmentation of
+    images, from their dimensions read in their headers.
+    :param path_images: list of paths of the images to segment.
+    :param acquired_resolution: the pixel size of the images.
+    :param resolution_model: the resolution the model was trained on.
+    :param config: dict containing the configuration of the network
+    :param overlap_value: the number of pixels to be used for overlap when doing prediction.
+    :param max_memory: the memory budget in gigabytes, or None for no limit.
+    :param inference_batch_size: the batch size to use, or None to let the planner choose it.
+    :param dry_run: if True, the plan is displayed.
+    :return: dict describing the plan, as returned by plan_segmentation.
+    '''
 
+    image_shapes = [probe_image_shape(path_image) for path_image in path_images]
+    plan = plan_segmentation(image_shapes, acquired_resolution, resolution_model, config, overlap_value,
+                             max_memory=None if max_memory is None else max_memory * 1024 ** 3,
+                             batch_size=inference_batch_size, images_per_run=default_images_per_run)
 
+    if dry_run:
+        print_plan(plan, path_images)
+    elif not plan['fits']:
+        print("WARNING: the segmentation is not expected to fit in {0} GB of memory.".format(max_memory))
 
-    return None
+    return plan
 
 def generate_default_parameters(type_acquisition, new_path):
     '''
@@ -287,6 +401,32 @@ def main(argv=None):
                                                             'Default value: '+str(default_overlap)+'\n'+
                                                             'Recommended range of values: [10-100]. \n',
                                                             default=25)
+    ap.add_argument('--batch-size', required=False, type=int, help='Number of patches fed to the network at once. \n'+
+                                                            'The patches of all the images segmented together are batched \n'+
+                                                            'together. Higher values are faster but use more memory. \n'+
+                                                            'Default value: chosen from --max-memory if it is given, \n'+
+                                                            'else '+str(default_batch_size)+'\n',
+                                                            default=None)
+    ap.add_argument('--tissue-detection', required=False, action='store_true', help='Detect the tissue on a downsampled version of the image \n'+
+                                                            'first, and only segment the patches that intersect it. The rest \n'+
+                                                            'of the image is labelled as background. Useful for large optical \n'+
+                                                            'microscopy slides where most of the image is background.')
+    ap.add_argument('--max-memory', required=False, type=float, help='Memory budget of the segmentation, in gigabytes. The batch \n'+
+                                                            'size, the number of images segmented together and the tiling \n'+
+                                                            'of large images are chosen to fit in this budget, from the \n'+
+                                                            'dimensions of the images and the configuration of the model.',
+                                                            default=None)
+    ap.add_argument('--readers', required=False, type=int, help='Number of processes reading and resampling the images of a \n'+
+                                                            'folder while the network segments them. The patches are handed \n'+
+                                                            'over through shared memory. Default value: 0 (no reader process).',
+                                                            default=0)
+    ap.add_argument('--cache', required=False, nargs='?', const=str(DEFAULT_CACHE_PATH), help='Keep the images resampled to the resolution of the model in a \n'+
+                                                            'cache folder, so that segmenting them again (e.g. with another \n'+
+                                                            'model or overlap) skips their loading and resampling. \n'+
+                                                            'Default folder: '+str(DEFAULT_CACHE_PATH)+'\n',
+                                                            default=None)
+    ap.add_argument('--dry-run', required=False, action='store_true', help='Display the segmentation plan (batch size, tiling, number \n'+
+                                                            'of patches, estimated memory and runtime) without segmenting.')
     ap._action_groups.reverse()
 
     # Processing the arguments
@@ -294,6 +434,12 @@ def main(argv=None):
     type_ = str(args["type"])
     verbosity_level = int(args["verbose"])
     overlap_value = int(args["overlap"])
+    inference_batch_size = int(args["batch_size"]) if args["batch_size"] is not None else None
+    tissue_detection = bool(args["tissue_detection"])
+    max_memory = float(args["max_memory"]) if args["max_memory"] is not None else None
+    dry_run = bool(args["dry_run"])
+    n_readers = int(args["readers"])
+    cache = ResampledAcquisitionCache(args["cache"]) if args["cache"] is not None else None
     if args["sizepixel"] is not None:
         psm = float(args["sizepixel"])
     else:
@@ -362,10 +508,26 @@ def main(argv=None):
 
                     sys.exit(2)
 
+                plan = plan_images_segmentation([current_path_target], psm, resolution_model, config,
+                                                overlap_value, max_memory=max_memory,
+                                                inference_batch_size=inference_batch_size, dry_run=dry_run)
+                if dry_run:
+                    continue
+
+                if cache is not None and plan['tile_size'] is not None:
+                    print("ERROR: The images will be segmented in tiles to fit in the memory budget, and the tiles can't be cached. ",
+                          "Please remove the --cache argument, or increase the --max-memory value."
+                    )
+                    sys.exit(3)
+
                 # Performing the segmentation over the image
                 segment_image(current_path_target, path_model, overlap_value, config,
                             resolution_model,
                             acquired_resolution=psm,
+                            inference_batch_size=plan['batch_size'],
+                            tissue_detection=tissue_detection,
+                            tile_size=plan['tile_size'],
+                            cache=cache,
                             verbosity_level=verbosity_level)
 
                 print("Segmentation finished.")
@@ -394,10 +556,28 @@ def main(argv=None):
                     )
                     sys.exit(3)
 
+            plan = plan_images_segmentation(get_images_to_segment(current_path_target), psm, resolution_model,
+                                            config, overlap_value, max_memory=max_memory,
+                                            inference_batch_size=inference_batch_size, dry_run=dry_run)
+            if dry_run:
+                continue
+
+            if cache is not None and plan['tile_size'] is not None:
+                print("ERROR: The images will be segmented in tiles to fit in the memory budget, and the tiles can't be cached. ",
+                      "Please remove the --cache argument, or increase the --max-memory value."
+                )
+                sys.exit(3)
+
             # Performing the segmentation over all folders in the specified folder containing acquisitions to segment.
             segment_folders(current_path_target, path_model, overlap_value, config,
                         resolution_model,
                             acquired_resolution=psm,
+                            inference_batch_size=plan['batch_size'],
+                            images_per_run=plan['images_per_run'],
+                            tissue_detection=tissue_detection,
+                            tile_size=plan['tile_size'],
+                            n_readers=n_readers,
+                            cache=cache,
                             verbosity_level=verbosity_level)
 
             print("Segmentation finished.")
@@ -0,0 +1,303 @@
+# Segmentation planner
+# --------------------
+# Estimates the memory and the time needed to segment images before loading them, and chooses the batch size, the
+# number of images segmented together and the tile size so that the segmentation fits in a given memory budget.
+
+import numpy as np
+from PIL import Image
+from prettytable import PrettyTable
+
+from AxonDeepSeg.ads_utils import convert_path
+
+# Candidate values tried by the planner, from the fastest to the most economical
+BATCH_SIZES = [32, 16, 8, 4, 2, 1]
+TILE_SIZES = [None, 8192, 4096, 2048, 1024]
+
+# Rough throughput of a CPU running the network, used for the runtime estimate
+DEFAULT_FLOPS_PER_SECOND = 50e9
+
+# Bytes per value of each of the arrays used during segmentation
+FLOAT32_BYTES = 4
+FLOAT64_BYTES = 8
+UINT8_BYTES = 1
+
+
+def probe_image_shape(path_image):
+    '''
+    Reads the dimensions of an image from its header, without decoding the pixels.
+    :param path_image: path of the image.
+    :return: (height, width) of the image.
+    '''
+
+    path_image = convert_path(path_image)
+
+    with Image.open(str(path_image)) as img:
+        width, height = img.size
+
+    return height, width
+
+
+def resampled_shape(image_shape, acquired_resolution, resolution_model):
+    '''
+    Computes the shape of an image once resampled to the resolution of the model, as done by skimage's rescale.
+    :param image_shape: (height, width) of the image.
+    :param acquired_resolution: pixel size of the image.
+    :param resolution_model: pixel size the model was trained on.
+    :return: (height, width) of the resampled image.
+    '''
+
+    coeff = acquired_resolution / resolution_model
+
+    return tuple(int(np.round(e * coeff)) for e in image_shape[:2])
+
+
+def count_patches(image_shape, patch_size, overlap_value=25):
+    '''
+    Counts the patches extracted from an image by im2patches_overlap.
+    :param image_shape: (height, width) of the image, at the resolution of the model.
+    :param patch_size: Int, size of the side of a patch.
+    :param overlap_value: Int, number of pixels of overlap between the patches.
+    :return: Int, number of patches.
+    '''
+
+    spw = patch_size - 2 * overlap_value
+
+    n_patches = 1
+    for length in image_shape[:2]:
+        q, r = divmod(max(length - 2 * overlap_value, 0), spw)
+        n_patches *= q + (r != 0)
+
+    return n_patches
+
+
+def estimate_network(config):
+    '''
+    Estimates the resources used by the network defined in the configuration to segment one patch.
+    The activation memory is an upper bound: it assumes all the intermediate tensors of the network are alive at once.
+    :param config: dict containing the configuration of the network.
+    :return: dict with the bytes of activations per patch, the bytes of the weights, and the FLOPs per patch.
+    '''
+
+    size = config["trainingset_patchsize"]
+    depth = config["depth"]
+    features = config["features_per_convolution"]
+    kernel_sizes = config["size_of_convolutions_per_layer"]
+    # Convolution, batch normalization and activation outputs, or only the convolution output without batch norm
+    tensors_per_conv = 3 if config["batch_norm_activate"] else 1
+    separable = config.get("convolution_type", "standard") == 'separable'
+
+    activations = size * size  # input
+    weights = 0
+    flops = 0
+
+    def add_conv(size, in_channels, out_channels, kernel_size, stride=1, separable=separable):
+        out_size = size // stride
+        if separable:
+            # Depthwise convolution followed by a 1x1 convolution, with the intermediate depthwise output
+            weights = kernel_size * kernel_size * in_channels + in_channels * out_channels
+            return (out_size * out_size * (in_channels + out_channels * tensors_per_conv), weights,
+                    2 * out_size * out_size * weights)
+        return (out_size * out_size * out_channels * tensors_per_conv,
+                kernel_size * kernel_size * in_channels * out_channels,
+                2 * out_size * out_size * kernel_size * kernel_size * in_channels * out_channels)
+
+    layers = []
+    channels = 1
+    skip_channels = []
+
+    # Contraction phase
+    for i in range(depth):
+        for conv_number in range(config["convolution_per_layer"][i]):
+            out_channels = features[i][conv_number][1]
+            layers.append(add_conv(size, channels, out_channels, kernel_sizes[i][conv_number]))
+            channels = out_channels
+        skip_channels.append(channels)
+
+        if config["downsampling"] == 'convolution':
+            layers.append(add_conv(size, channels, channels, 5, stride=2))
+        else:
+            layers.append(((size // 2) ** 2 * channels, 0, 0))
+        size //= 2
+
+    # Expansion phase
+    for i in reversed(range(depth)):
+        size *= 2
+        layers.append((size * size * channels, 0, 0))  # upsampling
+        layers.append(add_conv(size, channels, features[i][-1][1], 2))
+        channels = skip_channels[i] + features[i][-1][1]
+        layers.append((size * size * channels, 0, 0))  # concatenation
+        for conv_number in range(config["convolution_per_layer"][i]):
+            out_channels = features[i][conv_number][1]
+            layers.append(add_conv(size, channels, out_channels, kernel_sizes[i][conv_number]))
+            channels = out_channels
+
+    layers.append(add_conv(size, channels, config["n_classes"], 1, separable=False))
+
+    for layer_activations, layer_weights, layer_flops in layers:
+        activations += layer_activations
+        weights += layer_weights
+        flops += layer_flops
+
+    return {'activation_bytes': activations * FLOAT32_BYTES,
+            'weight_bytes': weights * FLOAT32_BYTES,
+            'flops': flops}
+
+
+def estimate_memory(image_shape, acquired_resolution, resolution_model, config, overlap_value=25, batch_size=1,
+                    tile_size=None, network=None):
+    '''
+    Estimates the memory used to segment one image.
+    :param image_shape: (height, width) of the image.
+    :param acquired_resolution: pixel size of the image.
+    :param resolution_model: pixel size the model was trained on.
+    :param config: dict containing the configuration of the network.
+    :param overlap_value: Int, number of pixels of overlap between the patches.
+    :param batch_size: Int, number of patches fed to the network at once.
+    :param tile_size: Int, size of the tiles at the resolution of the model, or None to segment the image at once.
+    :param network: estimate of the network as returned by estimate_network, computed if None.
+    :return: dict with the number of patches, and the bytes used by each step: 'image' (original image and its
+    segmentation, kept during the whole process), 'resampled' (resampled image and predictions of its patches, kept
+    from the loading to the stitching), and the transient bytes of the 'resampling', 'inference' and 'stitching' steps.
+    '''
+
+    if network is None:
+        network = estimate_network(config)
+
+    patch_size = config["trainingset_patchsize"]
+    rs_shape = resampled_shape(image_shape, acquired_resolution, resolution_model)
+    n_patches = count_patches(rs_shape, patch_size, overlap_value)
+
+    # Part of the image processed at once, at the resolution of the model
+    if tile_size is None:
+        region = rs_shape
+    else:
+        region = tuple(min(max(tile_size + 2 * overlap_value, patch_size), e) for e in rs_shape)
+        n_tiles = int(np.prod([np.ceil(e / float(tile_size)) for e in rs_shape]))
+        n_patches = n_tiles * count_patches(region, patch_size, overlap_value)
+    region_pixels = region[0] * region[1]
+    region_original_pixels = region_pixels * (resolution_model / acquired_resolution) ** 2
+    region_patches = count_patches(region, patch_size, overlap_value)
+
+    return {
+        'n_patches': n_patches,
+        'image': image_shape[0] * image_shape[1] * 2 * UINT8_BYTES,
+        'resampled': region_pixels * UINT8_BYTES + region_patches * patch_size ** 2 * UINT8_BYTES,
+        'resampling': region_pixels * FLOAT64_BYTES,
+        'inference': batch_size * (patch_size ** 2 * FLOAT32_BYTES + network['activation_bytes']),
+        'stitching': (region_pixels + region_original_pixels) * FLOAT64_BYTES,
+    }
+
+
+def estimate_run_memory(L_estimates, network_bytes):
+    '''
+    Estimates the peak memory of a run of images segmented together: all the images of the run are resampled and
+    predicted before being stitched one after the other.
+    :param L_estimates: list of the estimates of the images of the run, as returned by estimate_memory.
+    :param network_bytes: bytes of the weights of the network.
+    :return: Int, peak memory of the run in bytes.
+    '''
+
+    kept = sum(e['image'] + e['resampled'] for e in L_estimates)
+    transient = max(max(e['resampling'], e['inference'], e['stitching']) for e in L_estimates)
+
+    return int(kept + transient + network_bytes)
+
+
+def plan_segmentation(image_shapes, acquired_resolutions, resolution_model, config, overlap_value=25,
+                      max_memory=None, batch_size=None, images_per_run=20,
+                      flops_per_second=DEFAULT_FLOPS_PER_SECOND):
+    '''
+    Chooses the segmentation parameters of a list of images. The largest batch size is preferred, then segmenting
+    the images at once rather than in tiles, then segmenting many images together.
+    :param image_shapes: list of (height, width) of the images.
+    :param acquired_resolutions: list of the pixel sizes of the images, or a single pixel size for all of them.
+    :param resolution_model: pixel size the model was trained on.
+    :param config: dict containing the configuration of the network.
+    :param overlap_value: Int, number of pixels of overlap between the patches.
+    :param max_memory: memory budget in bytes, or None for no limit.
+    :param batch_size: Int, batch size to use, or None to let the planner choose it.
+    :param images_per_run: Int, maximum number of images segmented together.
+    :param flops_per_second: throughput of the device, used to estimate the runtime.
+    :return: dict describing the plan: 'batch_size', 'images_per_run', 'tile_size', 'peak_memory' (bytes),
+    'n_patches', 'estimated_time' (seconds), 'fits' (False if no candidate fits in the budget, in which case the most
+    economical one is returned), and 'images', the list of the estimates of each image.
+    '''
+
+    if not isinstance(acquired_resolutions, list):
+        acquired_resolutions = [acquired_resolutions] * len(image_shapes)
+
+    network = estimate_network(config)
+    budget = float('inf') if max_memory is None else max_memory
+
+    batch_sizes = BATCH_SIZES if batch_size is None else [batch_size]
+    if max_memory is None and batch_size is None:
+        batch_sizes = [1]
+
+    # Images are segmented in runs sorted by pixel size, as done by segment_images
+    order = sorted(range(len(image_shapes)), key=lambda i: acquired_resolutions[i])
+
+    def evaluate(batch, tile, n_images):
+        L_estimates = [estimate_memory(shape, acquired_resolutions[i], resolution_model, config,
+                                       overlap_value, batch, tile, network) for i, shape in enumerate(image_shapes)]
+        L_sorted = [L_estimates[i] for i in order]
+        peak = max(estimate_run_memory(L_sorted[i:i + n_images], network['weight_bytes'])
+                   for i in range(0, len(L_sorted), n_images)) if L_sorted else 0
+        return peak, L_estimates
+
+    candidate = None
+    for batch in batch_sizes:
+        for tile in TILE_SIZES:
+            # Images segmented by tiles are processed one after the other
+            for n_images in ([images_per_run, 4, 1] if tile is None else [1]):
+                peak, L_estimates = evaluate(batch, tile, min(n_images, images_per_run))
+                candidate = (batch, tile, min(n_images, images_per_run), peak, L_estimates)
+                if peak <= budget:
+                    break
+            if peak <= budget:
+                break
+        if peak <= budget:
+            break
+
+    batch, tile, n_images, peak, L_estimates = candidate
+    n_patches = sum(e['n_patches'] for e in L_estimates)
+
+    return {
+        'batch_size': batch,
+        'images_per_run': n_images,
+        'tile_size': tile,
+        'peak_memory': peak,
+        'n_patches': n_patches,
+        'estimated_time': n_patches * network['flops'] / flops_per_second,
+        'fits': peak <= budget,
+        'images': L_estimates,
+    }
+
+
+def print_plan(plan, path_images=None):
+    '''
+    Displays a segmentation plan.
+    :param plan: dict as returned by plan_segmentation.
+    :param path_images: list of the paths of the images, in the order given to plan_segmentation.
+    :return: Nothing.
+    '''
+
+    gigabyte = float(1024 ** 3)
+
+    if path_images is not None:
+        table = PrettyTable()
+        table.field_names = ["image", "patches", "memory (GB)"]
+        for path_image, estimate in zip(path_images, plan['images']):
+            table.add_row([str(path_image), estimate['n_patches'],
+                           round((estimate['image'] + estimate['resampled'] +
+                                  max(estimate['resampling'], estimate['inference'], estimate['stitching'])) /
+                                 gigabyte, 2)])
+        print(table)
+
+    print("Batch size: {0}".format(plan['batch_size']))
+    print("Images segmented together: {0}".format(plan['images_per_run']))
+    print("Tile size: {0}".format(plan['tile_size'] if plan['tile_size'] is not None else "no tiling"))
+    print("Number of patches: {0}".format(plan['n_patches']))
+    print("Estimated peak memory: {0:.2f} GB".format(plan['peak_memory'] / gigabyte))
+    print("Estimated runtime: {0:.0f} s".format(plan['estimated_time']))
+    if not plan['fits']:
+        print("WARNING: the segmentation is not expected to fit in the requested memory.")
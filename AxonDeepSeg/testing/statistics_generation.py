@@ -9,13 +9,16 @@ from prettytable import PrettyTable
 from sklearn.metrics import accuracy_score, log_loss
 import time
 import pandas as pd
+import tensorflow as tf
 
 # AxonDeepSeg imports
 import AxonDeepSeg.ads_utils as ads
 from AxonDeepSeg.ads_utils import convert_path
 from AxonDeepSeg.testing.segmentation_scoring import pw_dice
-from AxonDeepSeg.apply_model import axon_segmentation
-from AxonDeepSeg.config_tools import rec_update
+from AxonDeepSeg.apply_model import load_acquisitions, prepare_patches, load_model, predict_patches, \
+    process_segmented_patches
+from AxonDeepSeg.config_tools import rec_update, update_config, default_configuration
+from AxonDeepSeg.morphometrics.compute_morphometrics import get_pixelsize
 
 def metrics_classic_wrapper(path_model_folder, path_images_folder, resampled_resolution, overlap_value=25,
                             statistics_filename='model_statistics_validation.json',
@@ -135,13 +138,16 @@ def print_metrics(metrics_dict, filter_ckpt=None):
 
 
 def generate_statistics(path_model_folder, path_images_folder, resampled_resolution, overlap_value,
-                        verbosity_level=0):
+                        inference_batch_size=1, verbosity_level=0):
     """
     Generates the implemented statistics for all the checkpoints of a given model, for each requested image.
+    The images are loaded and cut into patches, and the graph of the network is built, only once: for each
+    checkpoint, only its weights are restored before segmenting the patches.
     :param path_model_folder: Path to the model to use.
     :param path_images_folder: Path to the folders that contain the images to compute the metrics on.
     :param resampled_resolution: Float, the resolution to resample to to make the predictions.
     :param overlap_value: Int, the number of pixels to use for overlap.
+    :param inference_batch_size: Int, the number of patches fed to the network at once.
     :param verbosity_level: Int. The higher, the more displayed information.
     :return:
     """
@@ -158,88 +164,113 @@ def generate_statistics(path_model_folder, path_images_folder, resampled_resolut
         config_network = json.loads(fd.read())
 
     n_classes = config_network['n_classes']
+    patch_size = config_network['trainingset_patchsize']
     model_name = path_model_folder.parts[-2] # Extraction of the name of the model.
 
-    # We loop over all checkpoint files to compute statistics for each checkpoint.
-    for checkpoint in path_model_folder.iterdir():
-
-        if str(checkpoint)[-10:] == '.ckpt.meta':
-
-            result_model = {}
-            name_checkpoint = str(checkpoint)[:-10]
-
-            result_model.update({'id_model': model_name,
-                                 'ckpt': name_checkpoint,
-                                 'config': config_network})
-
-            # 1/ We load the saved training statistics, which are independent of the testing images
+    checkpoints = sorted(checkpoint for checkpoint in path_model_folder.iterdir()
+                         if str(checkpoint)[-10:] == '.ckpt.meta')
+    if not checkpoints:
+        return model_statistics_dict
+
+    # The images, their patches and their masks are shared by all the checkpoints.
+    acquisitions_resolutions = [get_pixelsize(image_folder / 'pixel_size_in_micrometer.txt')
+                                for image_folder in path_images_folder]
+    rs_acquisitions, rs_coeffs, original_acquisitions_shapes = load_acquisitions(
+        [image_folder / 'image.png' for image_folder in path_images_folder], acquisitions_resolutions,
+        [resampled_resolution] * len(path_images_folder), verbose_mode=verbosity_level)
+    L_data, L_n_patches, L_positions = prepare_patches(rs_acquisitions, patch_size, overlap_value)
+    del rs_acquisitions
+
+    masks = [labellize(ads.imread(image_folder / 'mask.png')) for image_folder in path_images_folder]
+
+    # The graph is built once, with the weights of the first checkpoint. The default parameters are only used to
+    # build the graph, the saved config is the one of the model.
+    full_config_network = update_config(default_configuration(), config_network)
+    model, sess, pred, x = load_model(path_model_folder, full_config_network, ckpt_name=str(checkpoints[0])[:-10],
+                                      verbosity_level=verbosity_level)
+    saver = tf.train.Saver()
 
-            try:
-                f = open(path_model_folder + '/' + name_checkpoint + '.pkl', 'r')
-                res = pickle.load(f)
-                acc_stats = res['accuracy']
-                loss_stats = res['loss']
-                epoch_stats = res['steps']
-
-            except:
-                print('No stats file found...')
-                #f = open(path_model_folder + '/evolution.pkl', 'r')
-                #res = pickle.load(f)
-                #epoch_stats = max(res['steps'])
-                #acc_stats = np.mean(res['accuracy'][-10:])
-                #loss_stats = np.mean(res['loss'][-10:])
-
-                epoch_stats = None
-                acc_stats = None
-                loss_stats = None
-
-            result_model.update({
-                'training_stats': {
-                'training_epoch': epoch_stats,
-                'training_mvg_avg10_acc': acc_stats,
-                'training_mvg_avg10_loss': loss_stats
-            },
-                'testing_stats': {}
-            })
-
-            # 2/ Computation of the predictions / outputs of the network for each image at the same time.
-
-            predictions, outputs_network = axon_segmentation(path_images_folder,
-                                                            ['image.png']*len(path_images_folder),
-                                                            path_model_folder,
-                                                            config_network, ckpt_name=name_checkpoint,
-                                                            overlap_value=overlap_value,
-                                                            resampled_resolutions=[resampled_resolution]*len(path_images_folder),
-                                                            prediction_proba_activate=True,
-                                                            write_mode=False,
-                                                            gpu_per=1.0,
-                                                            verbosity_level=verbosity_level
-                                                            )
-            # These two variables are list, as long as the number of images that are tested.
-
-            if verbosity_level>=2:
-                print('Statistics extraction...')
-
-            # 3/ Computation of the statistics for each image.
-            for i, image_folder in tqdm(enumerate(path_images_folder)):
-
-                current_prediction = predictions[i]
-                current_network_output = outputs_network[i]
-
-                # Reading the images and processing them
-                mask_raw = ads.imread(image_folder / 'mask.png')
-                mask = labellize(mask_raw)
-
-                # We infer the name of the different files
-                name_image = image_folder.name
-
-                # Computing metrics and storing them in the json file.
-                current_proba = output_network_to_proba(current_network_output, n_classes)
-                testing_stats_dict = compute_metrics(current_prediction, current_proba, mask, n_classes)
-                result_model['testing_stats'].update({name_image:testing_stats_dict})
-
-            # We add the metrics for all the checkpoints from this model (on all images) to the data list.
-            model_statistics_dict["data"].update({name_checkpoint:result_model})
+    # We loop over all checkpoint files to compute statistics for each checkpoint.
+    for i_checkpoint, checkpoint in enumerate(checkpoints):
+
+        result_model = {}
+        name_checkpoint = str(checkpoint)[:-10]
+
+        result_model.update({'id_model': model_name,
+                             'ckpt': name_checkpoint,
+                             'config': config_network})
+
+        # 1/ We load the saved training statistics, which are independent of the testing images
+
+        try:
+            f = open(path_model_folder + '/' + name_checkpoint + '.pkl', 'r')
+            res = pickle.load(f)
+            acc_stats = res['accuracy']
+            loss_stats = res['loss']
+            epoch_stats = res['steps']
+
+        except:
+            print('No stats file found...')
+            #f = open(path_model_folder + '/evolution.pkl', 'r')
+            #res = pickle.load(f)
+            #epoch_stats = max(res['steps'])
+            #acc_stats = np.mean(res['accuracy'][-10:])
+            #loss_stats = np.mean(res['loss'][-10:])
+
+            epoch_stats = None
+            acc_stats = None
+            loss_stats = None
+
+        result_model.update({
+            'training_stats': {
+            'training_epoch': epoch_stats,
+            'training_mvg_avg10_acc': acc_stats,
+            'training_mvg_avg10_loss': loss_stats
+        },
+            'testing_stats': {}
+        })
+
+        # 2/ Computation of the predictions / outputs of the network for each image at the same time.
+
+        # Only the weights change from one checkpoint to the next.
+        if i_checkpoint > 0:
+            saver.restore(sess, name_checkpoint + '.ckpt')
+
+        predictions_list, predictions_proba_list = predict_patches(
+            model, sess, pred, x, L_data, patch_size, n_classes, inference_batch_size=inference_batch_size,
+            prediction_proba_activate=True, verbosity_level=verbosity_level)
+
+        predictions, outputs_network = process_segmented_patches(predictions_list, L_n_patches, L_positions,
+                                                                 original_acquisitions_shapes, overlap_value,
+                                                                 n_classes,
+                                                                 predictions_proba_list=predictions_proba_list,
+                                                                 prediction_proba_activate=True)
+        # These two variables are list, as long as the number of images that are tested.
+
+        if verbosity_level>=2:
+            print('Statistics extraction...')
+
+        # 3/ Computation of the statistics for each image.
+        for i, image_folder in tqdm(enumerate(path_images_folder)):
+
+            current_prediction = predictions[i]
+            current_network_output = outputs_network[i]
+
+            mask = masks[i]
+
+            # We infer the name of the different files
+            name_image = image_folder.name
+
+            # Computing metrics and storing them in the json file.
+            current_proba = output_network_to_proba(current_network_output, n_classes)
+            testing_stats_dict = compute_metrics(current_prediction, current_proba, mask, n_classes)
+            result_model['testing_stats'].update({name_image:testing_stats_dict})
+
+        # We add the metrics for all the checkpoints from this model (on all images) to the data list.
+        model_statistics_dict["data"].update({name_checkpoint:result_model})
+
+    # End of the inference step.
+    tf.reset_default_graph()
 
     return model_statistics_dict
 
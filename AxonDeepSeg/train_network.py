@@ -5,7 +5,7 @@ import os
 
 # AxonDeepSeg imports
 from AxonDeepSeg.network_construction import uconv_net
-from AxonDeepSeg.data_management.input_data import DataGen
+from AxonDeepSeg.data_management.input_data import DataGen, DistillationGen
 from AxonDeepSeg.ads_utils import convert_path
 from AxonDeepSeg.config_tools import generate_config
 import AxonDeepSeg.ads_utils
@@ -39,24 +39,37 @@ def train_model(
     gpu=None,
     debug_mode=False,
     gpu_per=1.0,
+    path_teacher=None,
+    distillation_weight=0.5,
+    distillation_temperature=2.0,
 ):
     """
     Main function. Trains a model using the configuration parameters.
     :param path_trainingset: Path to access the trainingset.
     :param path_model: Path indicating where to save the model.
     :param config: Dict, containing the configuration parameters of the network.
-    :param path_model_init: Path to where the model to use for initialization is stored.
+    :param path_model_init: Path to the folder of a model (with a model.hdf5 file) whose weights initialize the
+    network. The architecture of that model must be the one described by config.
     :param save_trainable: Boolean. If True, only saves in the model variables that are trainable (evolve from gradient)
     :param gpu: String, name of the gpu to use. Prefer use of CUDA_VISIBLE_DEVICES environment variable.
     :param debug_mode: Boolean. If activated, saves more information about the distributions of
     most trainable variables, and also outputs more information.
     :param gpu_per: Float, between 0 and 1. Percentage of GPU to use.
+    :param path_teacher: Path to a trained model folder containing a model.hdf5 file. If given, the model is trained
+    as a student network by knowledge distillation: it learns both the masks and the soft probabilities predicted by
+    this teacher network.
+    :param distillation_weight: Float, between 0 and 1. Weight of the teacher's soft probabilities in the loss, the
+    masks having a weight of 1 - distillation_weight.
+    :param distillation_temperature: Float, temperature used to soften the probabilities of the teacher and of the
+    student before comparing them.
     :return: Nothing.
     """
 
     # If string, convert to Path objects
     path_trainingset = convert_path(path_trainingset)
     path_model = convert_path(path_model)
+    path_teacher = convert_path(path_teacher)
+    path_model_init = convert_path(path_model_init)
 
     ###################################################################################################################
     ############################################## VARIABLES INITIALIZATION ###########################################
@@ -214,6 +227,43 @@ def train_model(
 
     model = uconv_net(config, bn_updated_decay=None, verbose=True)
 
+    if path_model_init is not None:
+        model.load_weights(str(path_model_init / "model.hdf5"))
+
+    ########################### Knowledge distillation ###########
+
+    # The loss and the metrics used to select the checkpoints
+    loss = dice_coef_loss
+    metrics = ["accuracy", dice_axon, dice_myelin]
+    monitor_acc = "val_acc"
+    workers = 1
+    custom_objects = {
+        "dice_axon": dice_axon,
+        "dice_myelin": dice_myelin,
+        "dice_coef_loss": dice_coef_loss,
+    }
+
+    if path_teacher is not None:
+        # The teacher is loaded after the student, so that the variables of the student keep the names they have when
+        # the model is built alone for inference.
+        teacher = load_model(
+            str(path_teacher / "model.hdf5"), custom_objects=custom_objects, compile=False
+        )
+        teacher.trainable = False
+
+        # The targets are the masks followed by the soft probabilities of the teacher
+        train_generator = DistillationGen(train_generator, teacher)
+        valid_generator = DistillationGen(valid_generator, teacher)
+
+        loss = get_distillation_loss(config["n_classes"], distillation_weight, distillation_temperature)
+        hard_accuracy = get_hard_accuracy(config["n_classes"])
+        metrics = [hard_accuracy, dice_axon, dice_myelin]
+        monitor_acc = "val_hard_accuracy"
+        custom_objects.update({"distillation_loss": loss, "hard_accuracy": hard_accuracy})
+
+        # The teacher predicts in the generators, which must run in the thread of the Tensorflow graph
+        workers = 0
+
     ########################### Tensorboard for Visualization ###########
     tensorboard = TensorBoard(log_dir=str(path_model))
 
@@ -227,8 +277,8 @@ def train_model(
     # Compile the model with Categorical Cross Entropy loss and Adam Optimizer
     model.compile(
         optimizer=adam,
-        loss=dice_coef_loss,
-        metrics=["accuracy", dice_axon, dice_myelin],
+        loss=loss,
+        metrics=metrics,
     )
 
     train_steps = len(train_ids) // batch_size
@@ -242,7 +292,7 @@ def train_model(
     # Keep only a single checkpoint, the best over test accuracy.
     checkpoint_acc = ModelCheckpoint(
         filepath_acc,
-        monitor="val_acc",
+        monitor=monitor_acc,
         verbose=0,
         save_best_only=True,
         mode="max",
@@ -276,6 +326,7 @@ def train_model(
         validation_steps=valid_steps,
         epochs=epochs,
         callbacks=[tensorboard, checkpoint_loss, checkpoint_acc],
+        workers=workers,
     )
 
     ########################## Save the model after Training ###########
@@ -286,11 +337,6 @@ def train_model(
     saver = tf.train.Saver()
 
     # Save Model in ckpt format
-    custom_objects = {
-        "dice_axon": dice_axon,
-        "dice_myelin": dice_myelin,
-        "dice_coef_loss": dice_coef_loss,
-    }
     model = load_model(
         str(path_model) + "/model.hdf5", custom_objects=custom_objects
     )
@@ -351,6 +397,60 @@ def dice_coef_loss(y_true, y_pred):
     return 1 - dice_coef(y_true, y_pred)
 
 
+def soften_probabilities(proba, temperature):
+    """
+    Softens probabilities as if the logits they were computed from were divided by the temperature.
+    :param proba: Tensor, probabilities outputted by a softmax. Shape (N,H,W,C).
+    :param temperature: Float, the temperature. Higher values give softer probabilities.
+    :return: Tensor, the softened probabilities.
+    """
+
+    return K.softmax(K.log(proba + K.epsilon()) / temperature)
+
+
+def get_distillation_loss(n_classes, distillation_weight=0.5, temperature=2.0):
+    """
+    Builds the loss of a student network trained by knowledge distillation. The targets given to the loss are the
+    masks concatenated with the probabilities predicted by the teacher, along the channels.
+    :param n_classes: Int, number of classes.
+    :param distillation_weight: Float, weight of the teacher's probabilities in the loss.
+    :param temperature: Float, temperature used to soften the probabilities.
+    :return: The loss function.
+    """
+
+    def distillation_loss(y_true, y_pred):
+        mask = y_true[..., :n_classes]
+        teacher_proba = soften_probabilities(y_true[..., n_classes:], temperature)
+        student_proba = soften_probabilities(y_pred, temperature)
+
+        # Kullback-Leibler divergence between the softened probabilities, scaled by T^2 to keep its gradients of the
+        # same magnitude as the ones of the masks.
+        kl_divergence = K.mean(
+            K.sum(
+                teacher_proba * (K.log(teacher_proba + K.epsilon()) - K.log(student_proba + K.epsilon())),
+                axis=-1,
+            )
+        )
+
+        return (1 - distillation_weight) * dice_coef_loss(mask, y_pred) + \
+            distillation_weight * temperature ** 2 * kl_divergence
+
+    return distillation_loss
+
+
+def get_hard_accuracy(n_classes):
+    """
+    Builds the accuracy metric of a student network trained by knowledge distillation, computed on the masks only.
+    :param n_classes: Int, number of classes.
+    :return: The metric function.
+    """
+
+    def hard_accuracy(y_true, y_pred):
+        return keras.metrics.categorical_accuracy(y_true[..., :n_classes], y_pred)
+
+    return hard_accuracy
+
+
 # To Call the training in the terminal
 
 
@@ -369,17 +469,19 @@ def main():
     )
     ap.add_argument("-m_init", "--path_model_init", required=False, help="")
     ap.add_argument("-gpu", "--GPU", required=False, help="")
+    ap.add_argument("-t", "--path_teacher", required=False, help="Trained model to distill into the new model.")
 
     args = vars(ap.parse_args())
     path_training = Path(args["path_training"])
     path_model = Path(args["path_model"])
-    path_model_init = Path(args["path_model_init"])
+    path_model_init = Path(args["path_model_init"]) if args["path_model_init"] else None
     config_file = args["config_file"]
     gpu = args["GPU"]
+    path_teacher = Path(args["path_teacher"]) if args["path_teacher"] else None
 
     config = generate_config(config_file)
 
-    train_model(path_training, path_model, config, path_model_init, gpu=gpu)
+    train_model(path_training, path_model, config, path_model_init, gpu=gpu, path_teacher=path_teacher)
 
 
 if __name__ == "__main__":
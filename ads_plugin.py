@@ -8,36 +8,49 @@ import wx
 import wx.lib.agw.hyperlink as hl
 
 import fsleyes.controls.controlpanel as ctrlpanel
-import fsleyes.actions.loadoverlay as ovLoad
+import fsl.data.image as fslimage
 
 import numpy as np
 import nibabel as nib
-from PIL import Image, ImageDraw, ImageOps
+from PIL import ImageDraw, ImageOps
 import scipy.misc
 import json
 from pathlib import Path
 
 import AxonDeepSeg
-from AxonDeepSeg.apply_model import axon_segmentation
-from AxonDeepSeg.segment import segment_image
+from AxonDeepSeg.apply_model import axon_segmentation, segment_roi
+from AxonDeepSeg.segment import default_batch_size
+from AxonDeepSeg.resampling_cache import ResampledAcquisitionCache
+from AxonDeepSeg.segmentation_planner import probe_image_shape, resampled_shape, count_patches
 import AxonDeepSeg.morphometrics.compute_morphometrics as compute_morphs
 from AxonDeepSeg import postprocessing, params, ads_utils
 from config import axonmyelin_suffix, axon_suffix, myelin_suffix
 
 import math
-from scipy import ndimage as ndi
-from skimage import measure, morphology, feature
+from skimage import measure, feature
 
-import tempfile
+import threading
 import openpyxl
 import pandas as pd
 import imageio
 
 from AxonDeepSeg.morphometrics.compute_morphometrics import *
+from AxonDeepSeg.morphometrics.launch_morphometrics_computation import (
+                                                                        save_morphometrics_table,
+                                                                        get_morphometrics_metadata,
+                                                                        tableExtensions
+                                                                        )
 
 VERSION = "0.2.16"
 
 
+class TaskCancelled(Exception):
+    """
+    Raised in a background task when the user cancels it.
+    """
+    pass
+
+
 class ADScontrol(ctrlpanel.ControlPanel):
     """
     This class is the object corresponding to the AxonDeepSeg control panel.
@@ -117,6 +130,30 @@ class ADScontrol(ctrlpanel.ControlPanel):
         )
         sizer_h.Add(apply_model_button, flag=wx.SHAPED, proportion=1)
 
+        # Add the button that previews the segmentation
+        preview_model_button = wx.Button(self, label="Preview segmentation")
+        preview_model_button.SetForegroundColour(button_label_color)
+        preview_model_button.Bind(wx.EVT_BUTTON, self.on_preview_model_button)
+        preview_model_button.SetToolTip(
+            wx.ToolTip(
+                "Quickly segments a downsampled version of the image and displays it as a temporary overlay. "
+                "The full resolution segmentation is computed if the preview is accepted."
+            )
+        )
+        sizer_h.Add(preview_model_button, flag=wx.SHAPED, proportion=1)
+
+        # Add the button that segments the visible region
+        segment_roi_button = wx.Button(self, label="Segment visible region")
+        segment_roi_button.SetForegroundColour(button_label_color)
+        segment_roi_button.Bind(wx.EVT_BUTTON, self.on_segment_roi_button)
+        segment_roi_button.SetToolTip(
+            wx.ToolTip(
+                "Segments only the region of the image visible in the view (zoom on the region to segment). "
+                "The result replaces this region in the displayed axon and myelin masks."
+            )
+        )
+        sizer_h.Add(segment_roi_button, flag=wx.SHAPED, proportion=1)
+
         # The Watershed button's purpose isn't clear. It is unavailable for now.
 
         # # Add the button that runs the watershed algorithm
@@ -159,7 +196,7 @@ class ADScontrol(ctrlpanel.ControlPanel):
         compute_morphometrics_button.Bind(wx.EVT_BUTTON, self.on_compute_morphometrics_button)
         compute_morphometrics_button.SetToolTip(
             wx.ToolTip(
-                "Calculates and saves the morphometrics to an excel and csv file. "
+                "Calculates and saves the morphometrics to an excel, csv, parquet or feather file. "
                 "Shows the numbers of the axons at the coordinates specified in the morphometrics file."
             )
         )
@@ -171,6 +208,23 @@ class ADScontrol(ctrlpanel.ControlPanel):
         settings_button.Bind(wx.EVT_BUTTON, self.on_settings_button)
         sizer_h.Add(settings_button, flag=wx.SHAPED, proportion=1)
 
+        # Add the gauge showing the progress of the task running in the background
+        self.progress_gauge = wx.Gauge(self, range=100)
+        self.progress_gauge.SetToolTip(
+            wx.ToolTip("Progress of the segmentation, watershed or morphometrics computation")
+        )
+        sizer_h.Add(self.progress_gauge, flag=wx.EXPAND)
+
+        # Add the button that cancels the task running in the background
+        self.cancel_button = wx.Button(self, label="Cancel")
+        self.cancel_button.SetForegroundColour(button_label_color)
+        self.cancel_button.Bind(wx.EVT_BUTTON, self.on_cancel_button)
+        self.cancel_button.SetToolTip(
+            wx.ToolTip("Stops the running task. The segmentation stops after the batch of patches being processed.")
+        )
+        self.cancel_button.Disable()
+        sizer_h.Add(self.cancel_button, flag=wx.SHAPED, proportion=1)
+
         # Set the sizer of the control panel
         self.SetSizer(sizer_h)
 
@@ -178,6 +232,12 @@ class ADScontrol(ctrlpanel.ControlPanel):
         self.png_image_name = []
         self.image_dir_path = []
         self.most_recent_watershed_mask_name = None
+        self.preview_overlays = []
+
+        # The long computations run in a worker thread, so that FSLeyes stays responsive. The event is set to cancel
+        # them.
+        self.worker = None
+        self.cancel_event = threading.Event()
 
         # Toggle off the X and Y canvas
         oopts = ortho.sceneOpts
@@ -193,11 +253,6 @@ class ADScontrol(ctrlpanel.ControlPanel):
         # Invert the Y display
         self.frame.viewPanels[0].frame.viewPanels[0].getZCanvas().opts.invertY = True
 
-        # Create a temporary directory that will hold the NIfTI files
-        self.ads_temp_dir_var = tempfile.TemporaryDirectory()  #This variable needs to stay loaded to keep the temporary
-                                                               # directory from being destroyed
-        self.ads_temp_dir = Path(self.ads_temp_dir_var.name)
-
         # Check the version
         self.verrify_version()
 
@@ -207,6 +262,12 @@ class ADScontrol(ctrlpanel.ControlPanel):
         self.use_custom_resolution = False
         self.custom_resolution = 0.07
         self.zoom_factor = 1.0
+        self.preview_factor = 4.0
+        # Cache of the resampled images, so that applying the model again on the same image (e.g. after changing the
+        # settings) skips its loading and resampling. It writes to the disk, so it is only created if enabled in the
+        # settings.
+        self.use_resampling_cache = False
+        self.resampling_cache = None
 
 
     def on_load_png_button(self, event):
@@ -271,26 +332,23 @@ class ADScontrol(ctrlpanel.ControlPanel):
         image_name = in_file.stem
 
         # Extract the Axon mask
-        axon_mask = img_png2D > 200
-        axon_mask = params.intensity['binary'] * np.array(axon_mask, dtype=np.uint8)
+        axon_mask = np.array(img_png2D > 200, dtype=np.uint8)
 
         # Extract the Myelin mask
-        myelin_mask = (img_png2D > 100) & (img_png2D < 200)
-        myelin_mask = params.intensity['binary'] * np.array(myelin_mask, dtype=np.uint8)
+        myelin_mask = np.array((img_png2D > 100) & (img_png2D < 200), dtype=np.uint8)
 
         # Load the masks into FSLeyes
-        axon_outfile = self.ads_temp_dir / (image_name + "-axon.png")
-        ads_utils.imwrite(axon_outfile, axon_mask)
-        self.load_png_image_from_path(axon_outfile, is_mask=True, colormap="blue")
-
-        myelin_outfile = self.ads_temp_dir / (image_name + "-myelin.png")
-        ads_utils.imwrite(myelin_outfile, myelin_mask)
-        self.load_png_image_from_path(myelin_outfile, is_mask=True, colormap="red")
+        self.load_array_as_overlay(axon_mask, image_name + "-axon", colormap="blue")
+        self.load_array_as_overlay(myelin_mask, image_name + "-myelin", colormap="red")
 
-    def on_apply_model_button(self, event):
+    def get_segmentation_parameters(self):
         """
-        This function is called when the user presses on the ApplyModel button. It is used to apply the prediction model
-        selected in the combobox. The segmentation masks are then loaded into FSLeyes
+        Gathers what is needed to segment the visible image: its path, the path and configuration of the selected
+        model, the resolution of the model and the pixel size of the image. Asks the user for the pixel size if there
+        is no pixel_size_in_micrometer.txt file in the image folder.
+        :return: the path of the image, the path of the model, the configuration of the model, the resolution of the
+        model and the pixel size of the image, or None if one of them is unavailable.
+        :rtype: tuple
         """
 
         # Declare the default resolution of the model
@@ -299,7 +357,7 @@ class ADScontrol(ctrlpanel.ControlPanel):
         # Get the image name and directory
         image_overlay = self.get_visible_image_overlay()
         if self.get_visible_image_overlay() is None:
-            return
+            return None
 
         n_loaded_images = self.png_image_name.__len__()
         image_name = None
@@ -314,16 +372,15 @@ class ADScontrol(ctrlpanel.ControlPanel):
                 "Couldn't find the path to the loaded image. "
                 "Please use the plugin's image loader to import the image you wish to segment. "
             )
-            return
+            return None
 
         image_path = image_directory / image_name
-        image_name_no_extension = Path(image_name).stem
 
         # Get the selected model
         selected_model = self.model_combobox.GetStringSelection()
         if selected_model == "":
             self.show_message("Please select a model")
-            return
+            return None
 
         # Get the path of the selected model
         if any(selected_model in models for models in ads_utils.get_existing_models_list()):
@@ -331,7 +388,7 @@ class ADScontrol(ctrlpanel.ControlPanel):
             model_path = dir_path / "models" / selected_model
         else:
             self.show_message("Please select a model")
-            return
+            return None
 
         # If the TEM model is selected, modify the resolution
         if "TEM" in selected_model.upper():
@@ -346,7 +403,7 @@ class ADScontrol(ctrlpanel.ControlPanel):
                     self, "Enter the pixel size in micrometer", value="0.07"
             ) as text_entry:
                 if text_entry.ShowModal() == wx.ID_CANCEL:
-                    return
+                    return None
 
                 pixel_size_str = text_entry.GetValue()
             pixel_size_float = float(pixel_size_str)
@@ -355,33 +412,247 @@ class ADScontrol(ctrlpanel.ControlPanel):
             resolution_file = open((image_directory / "pixel_size_in_micrometer.txt").__str__(), 'r')
             pixel_size_float = float(resolution_file.read())
 
-        # Load model configs and apply prediction
+        # Load model configs
         model_configfile = model_path / "config_network.json"
         with open(model_configfile.__str__(), "r") as fd:
             config_network = json.loads(fd.read())
 
-        segment_image(
-                      image_path,
-                      model_path,
-                      self.overlap_value,
-                      config_network,
-                      resolution,
-                      acquired_resolution=pixel_size_float * self.zoom_factor,
-                      verbosity_level=3
-                      )
-
-        # The axon_segmentation function creates the segmentation masks and stores them as PNG files in the same folder
-        # as the original image file.
-
-        # Load the axon and myelin masks into FSLeyes
-        axon_mask_path = image_directory / (image_name_no_extension + str(axon_suffix))
-        myelin_mask_path = image_directory / (image_name_no_extension + str(myelin_suffix))
-        self.load_png_image_from_path(axon_mask_path, is_mask=True, colormap="blue")
-        self.load_png_image_from_path(myelin_mask_path, is_mask=True, colormap="red")
-        self.pixel_size_float = pixel_size_float
+        return image_path, model_path, config_network, resolution, pixel_size_float
+
+    def on_apply_model_button(self, event):
+        """
+        This function is called when the user presses on the ApplyModel button. It is used to apply the prediction model
+        selected in the combobox. The segmentation masks are then loaded into FSLeyes
+        """
+
+        segmentation_parameters = self.get_segmentation_parameters()
+        if segmentation_parameters is None:
+            return
+        image_path, model_path, config_network, resolution, pixel_size_float = segmentation_parameters
+        image_name_no_extension = image_path.stem
+
+        acquired_resolution = pixel_size_float * self.zoom_factor
+
+        # Number of patches to segment, used to report the progress
+        n_patches = count_patches(
+            resampled_shape(probe_image_shape(image_path), acquired_resolution, resolution),
+            config_network["trainingset_patchsize"],
+            self.overlap_value
+        )
+
+        def segmentation_task(report_progress, cancel_event):
+            n_segmented_patches = [0]
+
+            def on_segmentation_event(i, tile_bbox, *args):
+                # An event without bounding box marks the end of the image
+                if tile_bbox is not None:
+                    n_segmented_patches[0] += 1
+                    report_progress(n_segmented_patches[0] / n_patches)
+                # The patches of a batch are reported together, so the segmentation stops between two batches
+                if cancel_event.is_set():
+                    raise TaskCancelled()
+
+            # The segmentation is kept in memory, the masks are only written by the Save segmentation button
+            return axon_segmentation(
+                                     path_acquisitions_folders=image_path.parent,
+                                     acquisitions_filenames=[image_path.name],
+                                     path_model_folder=model_path,
+                                     config_dict=config_network,
+                                     inference_batch_size=default_batch_size,
+                                     overlap_value=self.overlap_value,
+                                     resampled_resolutions=resolution,
+                                     acquired_resolution=acquired_resolution,
+                                     write_mode=False,
+                                     cache=self.resampling_cache if self.use_resampling_cache else None,
+                                     callback=on_segmentation_event
+                                     )[0]
+
+        def on_segmentation_done(prediction):
+            # The preview is replaced by the full resolution segmentation
+            self.remove_preview_overlays()
+
+            # Load the axon and myelin masks into FSLeyes
+            self.load_prediction_as_overlays(
+                prediction,
+                Path(image_name_no_extension + str(axon_suffix)).stem,
+                Path(image_name_no_extension + str(myelin_suffix)).stem
+            )
+            self.pixel_size_float = pixel_size_float
+
+        # Apply prediction
+        self.run_in_background(segmentation_task, on_segmentation_done)
 
         return self
 
+    def on_preview_model_button(self, event):
+        """
+        This function is called when the user presses on the Preview segmentation button. The image is segmented as if
+        it had been acquired with a pixel size preview_factor times smaller, so that it is downsampled preview_factor
+        times more before being cut into patches, which divides the number of patches to segment by the square of
+        preview_factor. The preview masks are displayed as temporary overlays, and the full resolution segmentation is
+        computed if the user accepts the preview.
+        """
+
+        segmentation_parameters = self.get_segmentation_parameters()
+        if segmentation_parameters is None:
+            return
+        image_path, model_path, config_network, resolution, pixel_size_float = segmentation_parameters
+
+        acquired_resolution = pixel_size_float * self.zoom_factor / self.preview_factor
+
+        # Number of patches to segment, used to report the progress
+        n_patches = count_patches(
+            resampled_shape(probe_image_shape(image_path), acquired_resolution, resolution),
+            config_network["trainingset_patchsize"],
+            self.overlap_value
+        )
+
+        def preview_task(report_progress, cancel_event):
+            n_segmented_patches = [0]
+
+            def on_segmentation_event(i, tile_bbox, *args):
+                # An event without bounding box marks the end of the image
+                if tile_bbox is not None:
+                    n_segmented_patches[0] += 1
+                    report_progress(n_segmented_patches[0] / n_patches)
+                if cancel_event.is_set():
+                    raise TaskCancelled()
+
+            # The preview is segmented in memory, the masks on disk are left untouched
+            return axon_segmentation(
+                                     path_acquisitions_folders=image_path.parent,
+                                     acquisitions_filenames=[image_path.name],
+                                     path_model_folder=model_path,
+                                     config_dict=config_network,
+                                     overlap_value=self.overlap_value,
+                                     resampled_resolutions=resolution,
+                                     acquired_resolution=acquired_resolution,
+                                     write_mode=False,
+                                     cache=self.resampling_cache if self.use_resampling_cache else None,
+                                     callback=on_segmentation_event
+                                     )[0]
+
+        def on_preview_done(prediction):
+            # Replace the previous preview, if any
+            self.remove_preview_overlays()
+
+            self.preview_overlays.extend(
+                self.load_prediction_as_overlays(
+                    prediction, image_path.stem + "-axon-preview", image_path.stem + "-myelin-preview"
+                )
+            )
+
+            # Ask the user whether to compute the full resolution segmentation
+            with wx.MessageDialog(
+                self,
+                "Compute the full resolution segmentation?",
+                caption="Segmentation preview",
+                style=wx.YES_NO | wx.ICON_QUESTION,
+            ) as accept_dialog:
+                if accept_dialog.ShowModal() == wx.ID_YES:
+                    self.on_apply_model_button(event)
+
+        self.run_in_background(preview_task, on_preview_done)
+
+    def on_segment_roi_button(self, event):
+        """
+        This function is called when the user presses on the Segment visible region button. Only the region of the
+        image visible in the view is segmented, with a margin of context equal to the overlap value. The segmentation
+        of the region is merged into the visible axon and myelin masks, or displayed in new masks if there are none.
+        """
+
+        segmentation_parameters = self.get_segmentation_parameters()
+        if segmentation_parameters is None:
+            return
+        image_path, model_path, config_network, resolution, pixel_size_float = segmentation_parameters
+
+        # The image is taken from the displayed overlay, whose data is the transpose of the image
+        # (see load_array_as_overlay), so the file is not read again
+        image_overlay = self.get_visible_image_overlay()
+        acquisition = np.array(image_overlay[:, :, 0], copy=False).T
+
+        roi = self.get_viewport_roi(acquisition.shape)
+        h0, w0, h1, w1 = roi
+
+        def roi_task(report_progress, cancel_event):
+
+            def on_batch_segmented(n_segmented_batches, n_batches):
+                report_progress(n_segmented_batches / n_batches)
+                if cancel_event.is_set():
+                    raise TaskCancelled()
+
+            return segment_roi(
+                               acquisition,
+                               roi,
+                               pixel_size_float * self.zoom_factor,
+                               model_path,
+                               config_network,
+                               overlap_value=self.overlap_value,
+                               resampled_resolution=resolution,
+                               callback=on_batch_segmented
+                               )
+
+        def on_roi_done(prediction):
+            axon_roi = np.array(prediction == 2, dtype=np.uint8)
+            myelin_roi = np.array(prediction == 1, dtype=np.uint8)
+
+            # Find the displayed masks without warning the user if there are none
+            axon_overlays = [an_overlay for an_overlay in self.get_visible_overlays()
+                             if an_overlay.name.endswith(("-axon", "-Axon"))]
+            myelin_overlays = [an_overlay for an_overlay in self.get_visible_overlays()
+                               if an_overlay.name.endswith(("-myelin", "-Myelin"))]
+
+            if len(axon_overlays) == 1 and len(myelin_overlays) == 1:
+                # Only the region is replaced in the masks
+                axon_overlays[0][w0:w1, h0:h1, 0] = axon_roi.T
+                myelin_overlays[0][w0:w1, h0:h1, 0] = myelin_roi.T
+            else:
+                full_prediction = np.zeros(acquisition.shape, dtype=np.uint8)
+                full_prediction[h0:h1, w0:w1] = prediction
+                self.load_prediction_as_overlays(
+                    full_prediction,
+                    Path(image_path.stem + str(axon_suffix)).stem,
+                    Path(image_path.stem + str(myelin_suffix)).stem
+                )
+
+            self.pixel_size_float = pixel_size_float
+
+        self.run_in_background(roi_task, on_roi_done)
+
+    def get_viewport_roi(self, image_shape):
+        """
+        This function finds the region of the image that is visible in the view.
+        :param image_shape: the shape of the image
+        :type image_shape: tuple
+        :return: the (h0, w0, h1, w1) coordinates of the visible region in the image, or of the whole image if it
+        can't be found
+        :rtype: tuple
+        """
+
+        # The display coordinates are the voxel coordinates of the overlays (their affine is the identity), where x is
+        # the column and y is the row of the image. Each voxel spans half a unit around its coordinates.
+        z_canvas = self.frame.viewPanels[0].frame.viewPanels[0].getZCanvas()
+        xmin, xmax, ymin, ymax = z_canvas.opts.displayBounds[:4]
+
+        h0 = max(0, int(np.floor(ymin + 0.5)))
+        h1 = min(image_shape[0], int(np.ceil(ymax + 0.5)))
+        w0 = max(0, int(np.floor(xmin + 0.5)))
+        w1 = min(image_shape[1], int(np.ceil(xmax + 0.5)))
+
+        if (h1 <= h0) or (w1 <= w0):
+            return 0, 0, image_shape[0], image_shape[1]
+
+        return h0, w0, h1, w1
+
+    def remove_preview_overlays(self):
+        """
+        This function removes the overlays of the segmentation preview from FSLeyes.
+        """
+        for preview_overlay in self.preview_overlays:
+            if preview_overlay in self.overlayList:
+                self.overlayList.remove(preview_overlay)
+        self.preview_overlays = []
+
     def on_save_segmentation_button(self, event):
         """
         This function saves the active myelin and axon masks as PNG images. Three (3) images are generated in a folder
@@ -411,20 +682,14 @@ class ADScontrol(ctrlpanel.ControlPanel):
         save_dir = Path(file_dialog.GetPath())
 
         # store the data of the masks in variables as numpy arrays.
-        # Note: since PIL uses a different convention for the X and Y coordinates, some array manipulation has to be
-        # done.
-        # Note 2 : The image array loaded in FSLeyes is flipped. We need to flip it back
+        # Note: the data of the overlays is the transpose of the images (see load_array_as_overlay)
 
         myelin_array = np.array(
-            myelin_mask_overlay[:, :, 0], copy=True, dtype=np.uint8
-        )
-        myelin_array = np.flipud(myelin_array)
-        myelin_array = np.rot90(myelin_array, k=1, axes=(1, 0))
+            myelin_mask_overlay[:, :, 0], copy=False, dtype=np.uint8
+        ).T
         axon_array = np.array(
-            axon_mask_overlay[:, :, 0], copy=True, dtype=np.uint8
-        )
-        axon_array = np.flipud(axon_array)
-        axon_array = np.rot90(axon_array, k=1, axes=(1, 0))
+            axon_mask_overlay[:, :, 0], copy=False, dtype=np.uint8
+        ).T
 
         # Make sure the masks have the same size
         if myelin_array.shape != axon_array.shape:
@@ -475,32 +740,30 @@ class ADScontrol(ctrlpanel.ControlPanel):
             self.show_message("invalid visible masks dimensions")
             return
 
-        # If a watershed mask already exists, remove it.
-        for an_overlay in self.overlayList:
-            if (self.most_recent_watershed_mask_name is not None) and (
-                an_overlay.name == self.most_recent_watershed_mask_name
-            ):
-                self.overlayList.remove(an_overlay)
+        # The data of the overlays is copied, since they can be edited while the watershed is computed
+        axon_array = np.array(axon_array, copy=True)
+        myelin_array = np.array(myelin_array, copy=True)
 
-        # Compute the watershed mask
-        watershed_data = self.get_watershed_segmentation(axon_array, myelin_array)
-
-        # Save the watershed mask as a png then load it as an overlay
-        watershed_image_array = np.rot90(watershed_data, k=3, axes=(1, 0))
-        watershed_image = Image.fromarray(watershed_image_array)
-        file_name = self.ads_temp_dir.name + "/watershed_mask.png"
-        watershed_image.save(file_name)
-        wantershed_mask_overlay = self.load_png_image_from_path(
-            file_name, add_to_overlayList=False
-        )
-        wantershed_mask_overlay[:, :, 0] = watershed_data
-        self.overlayList.append(wantershed_mask_overlay)
+        def watershed_task(report_progress, cancel_event):
+            report_progress(None)
+            return self.get_watershed_segmentation(axon_array, myelin_array)
 
-        # Apply a "random" colour mapping to the watershed mask
-        opts = self.displayCtx.getOpts(wantershed_mask_overlay)
-        opts.cmap = "random"
+        def on_watershed_done(watershed_data):
+            # If a watershed mask already exists, remove it.
+            for an_overlay in self.overlayList:
+                if (self.most_recent_watershed_mask_name is not None) and (
+                    an_overlay.name == self.most_recent_watershed_mask_name
+                ):
+                    self.overlayList.remove(an_overlay)
 
-        self.most_recent_watershed_mask_name = "watershed_mask"
+            # Load the watershed mask as an overlay, with a "random" colour mapping. The watershed was computed on
+            # the data of the overlays, so it is transposed back to the convention of the images.
+            self.load_array_as_overlay(watershed_data.T, "watershed_mask", colormap="random")
+
+            self.most_recent_watershed_mask_name = "watershed_mask"
+
+        # Compute the watershed mask
+        self.run_in_background(watershed_task, on_watershed_done)
 
     def on_fill_axons_button(self, event):
         """
@@ -523,11 +786,11 @@ class ADScontrol(ctrlpanel.ControlPanel):
         # Perform the floodfill operation
         axon_extracted_array = postprocessing.floodfill_axons(axon_array, myelin_array)
 
-        axon_corr_array = np.flipud(axon_extracted_array)
-        axon_corr_array = params.intensity['binary'] * np.rot90(axon_corr_array, k=1, axes=(1, 0))
-        file_name = self.ads_temp_dir / (myelin_mask_overlay.name[:-len("-myelin")] + "-axon-corr.png")
-        ads_utils.imwrite(filename=file_name, img=axon_corr_array)
-        self.load_png_image_from_path(file_name, is_mask=True, colormap="blue")
+        # The filled axons are in the convention of the overlays, so they are transposed back to that of the images
+        axon_corr_array = np.array(axon_extracted_array, dtype=np.uint8).T
+        self.load_array_as_overlay(
+            axon_corr_array, myelin_mask_overlay.name[:-len("-myelin")] + "-axon-corr", colormap="blue"
+        )
 
     def on_compute_morphometrics_button(self, event):
         """
@@ -558,20 +821,14 @@ class ADScontrol(ctrlpanel.ControlPanel):
             return
 
         # store the data of the masks in variables as numpy arrays.
-        # Note: since PIL uses a different convention for the X and Y coordinates, some array manipulation has to be
-        # done.
-        # Note 2 : The image array loaded in FSLeyes is flipped. We need to flip it back
+        # Note: the data of the overlays is the transpose of the images (see load_array_as_overlay)
 
         myelin_array = np.array(
             myelin_mask_overlay[:, :, 0] * params.intensity['binary'], copy=True, dtype=np.uint8
-        )
-        myelin_array = np.flipud(myelin_array)
-        myelin_array = np.rot90(myelin_array, k=1, axes=(1, 0))
+        ).T
         axon_array = np.array(
             axon_mask_overlay[:, :, 0] * params.intensity['binary'], copy=True, dtype=np.uint8
-        )
-        axon_array = np.flipud(axon_array)
-        axon_array = np.rot90(axon_array, k=1, axes=(1, 0))
+        ).T
 
         # Make sure the masks have the same size
         if myelin_array.shape != axon_array.shape:
@@ -584,74 +841,129 @@ class ADScontrol(ctrlpanel.ControlPanel):
         pred_axon = pred > 200
         pred_myelin = np.logical_and(pred >= 50, pred <= 200)
 
-        x = np.array([], dtype=[
-                                ('x0', 'f4'),
-                                ('y0', 'f4'),
-                                ('gratio','f4'),
-                                ('axon_area','f4'),
-                                ('myelin_area','f4'),
-                                ('axon_diam','f4'),
-                                ('myelin_thickness','f4'),
-                                ('axonmyelin_area','f4'),
-                                ('solidity','f4'),
-                                ('eccentricity','f4'),
-                                ('orientation','f4')
-                            ]
-                    )
-
-        # Compute statistics
-        stats_array = get_axon_morphometrics(im_axon=pred_axon, im_myelin=pred_myelin, pixel_size=pixel_size)
-
-        for stats in stats_array:
-
-            x = np.append(x,
-                np.array(
-                    [(
-                    stats['x0'],
-                    stats['y0'],
-                    stats['gratio'],
-                    stats['axon_area'],
-                    stats['myelin_area'],
-                    stats['axon_diam'],
-                    stats['myelin_thickness'],
-                    stats['axonmyelin_area'],
-                    stats['solidity'],
-                    stats['eccentricity'],
-                    stats['orientation']
-                    )],
-                    dtype=x.dtype)
+        def morphometrics_task(report_progress, cancel_event):
+            # Compute statistics
+            report_progress(None)
+            return get_axon_morphometrics_table(im_axon=pred_axon, im_myelin=pred_myelin, pixel_size=pixel_size)
+
+        def on_morphometrics_done(x):
+            wildcards = [("Excel files (*.xlsx)", ".xlsx"), ("CSV files (*.csv)", ".csv"),
+                         ("Parquet files (*.parquet)", ".parquet"), ("Feather files (*.feather)", ".feather")]
+            with wx.FileDialog(self, "Save morphometrics file",
+                               wildcard="|".join("{0}|*{1}".format(*wildcard) for wildcard in wildcards),
+                               defaultFile="axon_morphometrics.xlsx", style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as fileDialog:
+
+                if fileDialog.ShowModal() == wx.ID_CANCEL:
+                    return     # the user changed their mind
+
+                # save the current contents in the file
+                pathname = fileDialog.GetPath()
+                if not (pathname.lower().endswith(tableExtensions)):  # If the user didn't add the extension, add it here
+                    pathname = pathname + wildcards[fileDialog.GetFilterIndex()][1]
+
+                # The name of the image is the name of the axon overlay without its suffix
+                image_name = axon_mask_overlay.name
+                for suffix in ["-axon-corr", "-Axon-corr", "-axon", "-Axon"]:
+                    if image_name.endswith(suffix):
+                        image_name = image_name[:-len(suffix)]
+                        break
+                model_name = self.model_combobox.GetStringSelection()
+                metadata = get_morphometrics_metadata(
+                    {image_name: {'pixel_size': pixel_size, 'model': model_name if model_name != "" else None}}
                 )
 
-        with wx.FileDialog(self, "Save morphometrics file", wildcard="Excel files (*.xlsx)|*.xlsx",
-                        defaultFile="axon_morphometrics.xlsx", style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as fileDialog:
+                try:
+                    save_morphometrics_table(pd.DataFrame(x), pathname, metadata)
+
+                except (IOError, ImportError) as e:
+                    wx.LogError("Cannot save current data in file '%s': %s" % (pathname, e))
+
+            # Create the axon coordinate array
+            mean_diameter_in_pixel = np.average(x['axon_diam']) / pixel_size
+            axon_indexes = np.arange(x.size)
+            number_array = postprocessing.generate_axon_numbers_image(axon_indexes, x['x0'], x['y0'],
+                                                                      tuple(reversed(axon_array.shape)),
+                                                                      mean_diameter_in_pixel)
+
+            # Load the axon coordinate image into FSLeyes
+            self.load_array_as_overlay(number_array, "numbers", colormap="yellow")
 
-            if fileDialog.ShowModal() == wx.ID_CANCEL:
-                return     # the user changed their mind
+        self.run_in_background(morphometrics_task, on_morphometrics_done)
 
-            # save the current contents in the file
-            pathname = fileDialog.GetPath()
-            if not (pathname.lower().endswith((".xlsx", ".csv"))):  # If the user didn't add the extension, add it here
-                pathname = pathname + ".xlsx"
+        return
+
+    def run_in_background(self, task, on_done):
+        """
+        Runs a long computation in a worker thread, so that FSLeyes stays responsive. Only one task runs at a time.
+        :param task: The function performing the computation. It is called in the worker thread with a function
+        reporting the progress (fraction of the task done, or None if unknown) and the event set when the user cancels
+        the task. It must not use the GUI. It can raise TaskCancelled to stop.
+        :type task: function
+        :param on_done: The function called in the GUI thread with the result of the task once it is completed, e.g.
+        to load the result in the overlay list.
+        :type on_done: function
+        :return: True if the task was started, False if another task is already running.
+        :rtype: bool
+        """
+
+        if (self.worker is not None) and self.worker.is_alive():
+            self.show_message("Another task is running. Wait for it to finish or cancel it.")
+            return False
+
+        self.cancel_event.clear()
+        self.progress_gauge.SetValue(0)
+        self.cancel_button.Enable()
+
+        def report_progress(fraction):
+            wx.CallAfter(self.update_progress, fraction)
+
+        def run_task():
             try:
-                # Export to excel
-                pd.DataFrame(x).to_excel(pathname)
+                result = task(report_progress, self.cancel_event)
+            except TaskCancelled:
+                wx.CallAfter(self.end_background_task, "The task was cancelled.", "Cancelled")
+                return
+            except Exception as e:
+                wx.CallAfter(self.end_background_task, "The task failed: {0}".format(e))
+                return
+            wx.CallAfter(self.end_background_task)
+            wx.CallAfter(on_done, result)
 
-            except IOError:
-                wx.LogError("Cannot save current data in file '%s'." % pathname)
+        self.worker = threading.Thread(target=run_task, daemon=True)
+        self.worker.start()
 
-        # Create the axon coordinate array
-        mean_diameter_in_pixel = np.average(x['axon_diam']) / pixel_size
-        axon_indexes = np.arange(x.size)
-        number_array = postprocessing.generate_axon_numbers_image(axon_indexes, x['x0'], x['y0'],
-                                                                  tuple(reversed(axon_array.shape)),
-                                                                  mean_diameter_in_pixel)
+        return True
 
-        # Load the axon coordinate image into FSLeyes
-        number_outfile = self.ads_temp_dir / "numbers.png"
-        ads_utils.imwrite(number_outfile, number_array)
-        self.load_png_image_from_path(number_outfile, is_mask=False, colormap="yellow")
+    def update_progress(self, fraction):
+        """
+        Displays the progress of the background task in the gauge. Must be called in the GUI thread.
+        :param fraction: The fraction of the task done, or None if it is unknown.
+        :type fraction: float
+        """
+        if fraction is None:
+            self.progress_gauge.Pulse()
+        else:
+            self.progress_gauge.SetValue(int(100 * min(fraction, 1.0)))
 
-        return
+    def end_background_task(self, message=None, caption="Error"):
+        """
+        Resets the gauge and the cancel button once the background task is over. Must be called in the GUI thread.
+        :param message: (Optional) Message to display, e.g. if the task failed.
+        :type message: String
+        :param caption: (Optional) The caption of the message box.
+        :type caption: String
+        """
+        self.progress_gauge.SetValue(0)
+        self.cancel_button.Disable()
+        if message is not None:
+            self.show_message(message, caption)
+
+    def on_cancel_button(self, event):
+        """
+        This function is called when the user presses on the Cancel button. It asks the background task to stop.
+        """
+        self.cancel_event.set()
+        self.cancel_button.Disable()
 
     def on_settings_button(self, event):
         #TODO: Add a class for the settings. Perhaps even one for the window
@@ -716,6 +1028,24 @@ class ADScontrol(ctrlpanel.ControlPanel):
         sizer_zoom_factor.Add(self.zoom_factor_spinCtrlDouble, flag=wx.SHAPED, proportion=1)
         frame_sizer_h.Add(sizer_zoom_factor)
 
+        # Add the preview factor to the settings menu
+        sizer_preview_factor = wx.BoxSizer(wx.HORIZONTAL)
+        sizer_preview_factor.Add(wx.StaticText(self.settings_frame, label="Preview downsampling factor: "))
+        self.preview_factor_spinCtrlDouble = wx.SpinCtrlDouble(
+            self.settings_frame, min=1, max=64, initial=self.preview_factor, inc=0.5)
+        self.preview_factor_spinCtrlDouble.Bind(wx.EVT_SPINCTRLDOUBLE, self.on_preview_factor_changed)
+        sizer_preview_factor.Add(self.preview_factor_spinCtrlDouble, flag=wx.SHAPED, proportion=1)
+        frame_sizer_h.Add(sizer_preview_factor)
+
+        # Add the option to cache the resampled images to the settings menu
+        sizer_resampling_cache = wx.BoxSizer(wx.HORIZONTAL)
+        self.use_resampling_cache_checkbox = wx.CheckBox(
+            self.settings_frame, label="Cache the resampled images on disk")
+        self.use_resampling_cache_checkbox.SetValue(self.use_resampling_cache)
+        self.use_resampling_cache_checkbox.Bind(wx.EVT_CHECKBOX, self.on_use_resampling_cache_state_change)
+        sizer_resampling_cache.Add(self.use_resampling_cache_checkbox)
+        frame_sizer_h.Add(sizer_resampling_cache)
+
         # Add the done button
         sizer_done_button = wx.BoxSizer(wx.HORIZONTAL)
         done_button = wx.Button(self.settings_frame, label="Done")
@@ -744,15 +1074,21 @@ class ADScontrol(ctrlpanel.ControlPanel):
     def on_zoom_factor_changed(self, event):
         self.zoom_factor = self.zoom_factor_spinCtrlDouble.GetValue()
 
+    def on_preview_factor_changed(self, event):
+        self.preview_factor = self.preview_factor_spinCtrlDouble.GetValue()
+
+    def on_use_resampling_cache_state_change(self, event):
+        self.use_resampling_cache = self.use_resampling_cache_checkbox.GetValue()
+        if self.use_resampling_cache and self.resampling_cache is None:
+            self.resampling_cache = ResampledAcquisitionCache()
+
     def on_done_button(self, event):
         # TODO: make sure every setting is saved
         self.settings_frame.Close()
 
     def get_watershed_segmentation(self, im_axon, im_myelin, return_centroids=False):
         """
-        Parts of this function were copied from the code found in this document :
-        https://github.com/neuropoly/axondeepseg/blob/master/AxonDeepSeg/morphometrics/compute_morphometrics.py
-        In the future, the referenced script should be modified in order to avoid repetition.
+        The axon+myelin objects are computed by compute_morphometrics.assign_myelin_by_watershed.
         :param im_axon: the binary mask corresponding to axons
         :type im_axon: ndarray
         :param im_myelin: the binary mask corresponding to the myelin
@@ -770,30 +1106,14 @@ class ADScontrol(ctrlpanel.ControlPanel):
         axon_objects = measure.regionprops(im_axon_label)
         # Deal with myelin mask
         if im_myelin is not None:
-            # sum axon and myelin masks
-            im_axonmyelin = im_axon + im_myelin
-            # Compute distance between each pixel and the background. Note: this distance is calculated from the im_axon,
-            # note from the im_axonmyelin image, because we know that each axon object is already isolated, therefore the
-            # distance metric will be more useful for the watershed algorithm below.
-            distance = ndi.distance_transform_edt(im_axon)
-            # local_maxi = feature.peak_local_max(distance, indices=False, footprint=np.ones((31, 31)), labels=axonmyelin)
-
             # Get axon centroid as int (not float) to be used as index
             ind_centroid = (
                 [int(props.centroid[0]) for props in axon_objects],
                 [int(props.centroid[1]) for props in axon_objects],
             )
 
-            # Create an image with axon centroids, which value corresponds to the value of the axon object
-            im_centroid = np.zeros_like(im_axon, dtype="uint16")
-            for i in range(len(ind_centroid[0])):
-                # Note: The value "i" corresponds to the label number of im_axon_label
-                im_centroid[ind_centroid[0][i], ind_centroid[1][i]] = i + 1
-
-            # Watershed segmentation of axonmyelin using distance map
-            im_axonmyelin_label = morphology.watershed(
-                -distance, im_centroid, mask=im_axonmyelin
-            )
+            # Watershed segmentation of axonmyelin, seeded at the axon centroids
+            im_axonmyelin_label = compute_morphs.assign_myelin_by_watershed(im_axon, im_myelin, ind_centroid)
             if return_centroids is True:
                 return im_axonmyelin_label, ind_centroid
             else:
@@ -826,24 +1146,34 @@ class ADScontrol(ctrlpanel.ControlPanel):
         if is_mask is True:
             img_png2D = img_png2D // params.intensity['binary']  # Segmentation masks should be binary
 
-        # Flip the image on the Y axis so that the morphometrics file shows the right coordinates
-        img_png2D = np.flipud(img_png2D)
-
-        # Convert image data into a NIfTI image
-        # Note: PIL and NiBabel use different axis conventions, so some array manipulation has to be done.
-        img_NIfTI = nib.Nifti1Image(
-            np.rot90(img_png2D, k=1, axes=(1, 0)), np.eye(4)
+        return self.load_array_as_overlay(
+            img_png2D, image_path.stem, add_to_overlayList=add_to_overlayList, colormap=colormap
         )
 
-        # Save the NIfTI image in a temporary directory
-        img_name = image_path.stem
-        out_file = self.ads_temp_dir.__str__() + "/" + img_name + ".nii.gz"
-        nib.save(img_NIfTI, out_file)
+    def load_array_as_overlay(self, image_array, name, add_to_overlayList=True, colormap="greyscale"):
+        """
+        This function creates an overlay directly from a 2D image array, without going through a file.
+        The parameter add_to_overlayList allows to display the overlay into FSLeyes.
+        :param image_array: The 2D image, in the convention of the image files (the first axis is the Y axis).
+        Segmentation masks should be binary.
+        :type image_array: ndarray
+        :param name: The name of the overlay.
+        :type name: string
+        :param add_to_overlayList: (optional) Whether or not to add the image to the overlay list. If so, the image will
+        be displayed in the application. This parameter is True by default.
+        :type add_to_overlayList: bool
+        :param colormap: (optional) the colormap of image that will be displayed. This parameter is set to greyscale by
+        default.
+        :type colormap: string
+        :return: the FSLeyes overlay corresponding to the image.
+        :rtype: overlay
+        """
 
-        # Load the NIfTI image as an overlay
-        img_overlay = ovLoad.loadOverlays(paths=[out_file], inmem=True, blocking=True)[
-            0
-        ]
+        # Convert image data into a NIfTI image
+        # Note: PIL and NiBabel use different axis conventions: the data of the overlay is the transpose of the image,
+        # so that the morphometrics file shows the right coordinates. The transpose is a view, the image isn't copied.
+        img_NIfTI = nib.Nifti1Image(image_array.T, np.eye(4))
+        img_overlay = fslimage.Image(img_NIfTI, name=name)
 
         # Display the overlay
         if add_to_overlayList is True:
@@ -853,6 +1183,26 @@ class ADScontrol(ctrlpanel.ControlPanel):
 
         return img_overlay
 
+    def load_prediction_as_overlays(self, prediction, axon_name, myelin_name):
+        """
+        This function splits a segmentation into the axon and myelin masks and displays them as overlays.
+        :param prediction: The segmentation, in which the axons are labelled 2 and the myelin 1.
+        :type prediction: ndarray
+        :param axon_name: The name of the axon mask overlay.
+        :type axon_name: string
+        :param myelin_name: The name of the myelin mask overlay.
+        :type myelin_name: string
+        :return: the axon and myelin mask overlays.
+        :rtype: tuple
+        """
+        axon_overlay = self.load_array_as_overlay(
+            np.array(prediction == 2, dtype=np.uint8), axon_name, colormap="blue"
+        )
+        myelin_overlay = self.load_array_as_overlay(
+            np.array(prediction == 1, dtype=np.uint8), myelin_name, colormap="red"
+        )
+        return axon_overlay, myelin_overlay
+
     def get_visible_overlays(self):
         """
         This function returns a list containing evey overlays that are visible on FSLeyes.
@@ -894,6 +1244,7 @@ class ADScontrol(ctrlpanel.ControlPanel):
                 and (not an_overlay.name.endswith("-Myelin"))
                 and (not an_overlay.name.endswith("-Axon"))
                 and (not an_overlay.name.endswith("-axon"))
+                and (not an_overlay.name.endswith("-preview"))
             ):
                 n_found_overlays = n_found_overlays + 1
                 image_overlay = an_overlay
@@ -52,6 +52,7 @@ setup(
         'docs': ['sphinx>=1.6',
                  'sphinx_rtd_theme>=0.2.4',
                  'recommonmark'],
+        'columnar': ['pyarrow'],
     },
     include_package_data=True,
     entry_points={
@@ -0,0 +1,34 @@
+# coding: utf-8
+
+from pathlib import Path
+
+from imageio import imread as imageio_imread
+import pytest
+
+from AxonDeepSeg.morphometrics.benchmark_myelin_assignment import benchmark_myelin_assignment
+from config import axon_suffix, myelin_suffix
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.fullPath = Path(__file__).resolve().parent
+        # Move up to the test directory, "test/"
+        self.testPath = self.fullPath.parent
+
+        self.test_folder_path = self.testPath / '__test_files__' / '__test_demo_files__'
+        self.pixelsizeValue = 0.07   # For current demo data.
+
+        self.pred_axon = imageio_imread(self.test_folder_path / ('image' + str(axon_suffix)), as_gray=True) > 0
+        self.pred_myelin = imageio_imread(self.test_folder_path / ('image' + str(myelin_suffix)), as_gray=True) > 0
+
+    # --------------benchmark_myelin_assignment tests-------------- #
+    @pytest.mark.unit
+    def test_benchmark_myelin_assignment_compares_methods_with_watershed(self):
+        results = benchmark_myelin_assignment(self.pred_axon, self.pred_myelin, self.pixelsizeValue, n_repeats=1)
+
+        assert set(results) == {'watershed', 'nearest'}
+        assert results['watershed']['pixel_agreement'] == 1
+        assert results['watershed']['gratio_difference'] == 0
+        assert 0 < results['nearest']['pixel_agreement'] <= 1
+        assert results['nearest']['time'] > 0
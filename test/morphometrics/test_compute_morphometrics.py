@@ -7,14 +7,21 @@ import shutil
 import numpy as np
 from imageio import imread as imageio_imread  # to avoid confusion with mpl.pyplot.imread
 import pytest
+from scipy import ndimage as ndi
+from skimage import measure, morphology
 
 import AxonDeepSeg
 from AxonDeepSeg.morphometrics.compute_morphometrics import (  
                                                                 get_pixelsize,
+                                                                MorphometricsSession,
                                                                 get_axon_morphometrics, 
+                                                                get_axon_morphometrics_table,
+                                                                _measure_labels,
+                                                                assign_myelin_to_nearest_axon,
                                                                 save_axon_morphometrics, 
                                                                 load_axon_morphometrics, 
                                                                 draw_axon_diameter,
+                                                                map_axon_values,
                                                                 save_map_of_axon_diameters,
                                                                 get_aggregate_morphometrics,
                                                                 write_aggregate_morphometrics 
@@ -180,6 +187,160 @@ class TestCore(object):
             assert axon_prop['myelin_area'] == pytest.approx(0.0, rel=0.01)
             assert axon_prop['gratio'] == pytest.approx(1.0, rel=0.01)
 
+    # --------------get_axon_morphometrics_table tests-------------- #
+    @pytest.mark.unit
+    def test_get_axon_morphometrics_table_returns_expected_fields(self):
+        table = get_axon_morphometrics_table(self.pred_axon, str(self.test_folder_path))
+        assert set(table.dtype.names) == {'x0', 'y0', 'axon_area', 'axon_diam', 'solidity', 'eccentricity',
+                                          'orientation'}
+
+        table = get_axon_morphometrics_table(
+            self.pred_axon,
+            str(self.test_folder_path),
+            im_myelin=self.pred_myelin
+            )
+        assert 'gratio' in table.dtype.names
+
+    @pytest.mark.unit
+    def test_get_axon_morphometrics_table_matches_regionprops(self):
+        table = get_axon_morphometrics_table(
+            self.pred_axon,
+            str(self.test_folder_path),
+            im_myelin=self.pred_myelin
+            )
+
+        # Reference morphometrics, computed with regionprops on the axon objects and on the axon+myelin objects
+        # flooded from the axon centroids
+        pixelsize = get_pixelsize(self.test_folder_path / 'pixel_size_in_micrometer.txt')
+        axon_objects = measure.regionprops(measure.label(self.pred_axon))
+        im_centroid = np.zeros(self.pred_axon.shape, dtype='uint16')
+        for i, prop_axon in enumerate(axon_objects):
+            im_centroid[int(prop_axon.centroid[0]), int(prop_axon.centroid[1])] = i + 1
+        im_axonmyelin_label = morphology.watershed(-ndi.distance_transform_edt(self.pred_axon), im_centroid,
+                                                   mask=self.pred_axon + self.pred_myelin)
+        axonmyelin_objects = {prop.label: prop for prop in measure.regionprops(im_axonmyelin_label)}
+
+        assert table.size == len(axon_objects)
+        for row, prop_axon in zip(table, axon_objects):
+            y0, x0 = prop_axon.centroid
+            assert row['y0'] == pytest.approx(y0)
+            assert row['x0'] == pytest.approx(x0)
+            assert row['axon_diam'] == pytest.approx(prop_axon.equivalent_diameter * pixelsize)
+            assert row['axon_area'] == pytest.approx(prop_axon.area * pixelsize ** 2)
+            assert row['solidity'] == pytest.approx(prop_axon.solidity)
+            assert row['eccentricity'] == pytest.approx(prop_axon.eccentricity, abs=1e-6)
+            assert row['orientation'] == pytest.approx(prop_axon.orientation, abs=1e-6)
+
+            label_axonmyelin = im_axonmyelin_label[int(y0), int(x0)]
+            if not label_axonmyelin:
+                assert np.isnan(row['gratio'])
+                continue
+            prop_axonmyelin = axonmyelin_objects[label_axonmyelin]
+            assert row['myelin_thickness'] == pytest.approx(
+                (prop_axonmyelin.equivalent_diameter - prop_axon.equivalent_diameter) / 2 * pixelsize)
+            assert row['myelin_area'] == pytest.approx((prop_axonmyelin.area - prop_axon.area) * pixelsize ** 2)
+            assert row['axonmyelin_area'] == pytest.approx(prop_axonmyelin.area * pixelsize ** 2)
+            assert row['gratio'] == pytest.approx(np.sqrt(prop_axon.area / prop_axonmyelin.area))
+
+    @pytest.mark.unit
+    def test_get_axon_morphometrics_table_summarizes_missing_myelin_objects(self, capsys):
+        # Two C-shaped axons, whose centroids are outside of the axons and of the (empty) myelin
+        im_axon = np.zeros((50, 100), dtype=np.uint8)
+        for x_start in [10, 60]:
+            im_axon[10:40, x_start:x_start + 3] = 1
+            im_axon[10:13, x_start:x_start + 30] = 1
+            im_axon[37:40, x_start:x_start + 30] = 1
+
+        table = get_axon_morphometrics_table(im_axon, im_myelin=np.zeros_like(im_axon), pixel_size=0.1)
+
+        assert table.size == 2
+        assert np.all(np.isnan(table['gratio']))
+        assert capsys.readouterr().out.count("Myelin object not found") == 1
+
+    @pytest.mark.unit
+    def test_measure_labels_matches_regionprops(self):
+        im_axon_label = measure.label(self.pred_axon)
+        props = _measure_labels(im_axon_label)
+
+        for i, prop_axon in enumerate(measure.regionprops(im_axon_label)):
+            assert props['area'][i] == prop_axon.area
+            assert props['centroid'][0][i] == pytest.approx(prop_axon.centroid[0])
+            assert props['centroid'][1][i] == pytest.approx(prop_axon.centroid[1])
+            assert props['equivalent_diameter'][i] == pytest.approx(prop_axon.equivalent_diameter)
+            assert props['eccentricity'][i] == pytest.approx(prop_axon.eccentricity, abs=1e-6)
+            assert props['orientation'][i] == pytest.approx(prop_axon.orientation, abs=1e-6)
+
+    # --------------MorphometricsSession tests-------------- #
+    @pytest.mark.unit
+    def test_morphometrics_session_computes_labels_and_tables_once(self):
+        session = MorphometricsSession(self.pred_axon, self.pred_myelin, path_folder=str(self.test_folder_path))
+
+        assert session.axon_label is session.axon_label
+        assert session.get_table() is session.get_table()
+        assert session.n_axons == session.axon_label.max()
+
+        # The axon columns of the axon-only table are those of the full table
+        table = session.get_table()
+        axon_table = session.get_table(include_myelin=False)
+        for column in axon_table.dtype.names:
+            assert np.array_equal(axon_table[column], table[column])
+
+    @pytest.mark.unit
+    def test_morphometrics_session_matches_functional_api(self):
+        session = MorphometricsSession(self.pred_axon, self.pred_myelin, path_folder=str(self.test_folder_path))
+
+        table = get_axon_morphometrics_table(self.pred_axon, str(self.test_folder_path), im_myelin=self.pred_myelin)
+        for column in table.dtype.names:
+            assert np.allclose(session.get_table()[column], table[column], equal_nan=True)
+
+        aggregate_metrics = get_aggregate_morphometrics(self.pred_axon, self.pred_myelin, str(self.test_folder_path))
+        assert session.get_aggregate_metrics() == pytest.approx(aggregate_metrics)
+
+    @pytest.mark.exceptionhandling
+    def test_morphometrics_session_without_pixel_size_raises_exception(self):
+        with pytest.raises(ValueError):
+            MorphometricsSession(self.pred_axon, self.pred_myelin)
+
+    @pytest.mark.exceptionhandling
+    def test_morphometrics_session_with_invalid_myelin_assignment_raises_exception(self):
+        with pytest.raises(ValueError):
+            MorphometricsSession(self.pred_axon, self.pred_myelin, pixel_size=self.pixelsizeValue,
+                                 myelin_assignment='invalid')
+
+    # --------------assign_myelin_to_nearest_axon tests-------------- #
+    @pytest.mark.unit
+    def test_nearest_assignment_finds_myelin_of_axon_whose_centroid_is_outside(self):
+        # C-shaped axon, whose centroid is outside of the axon and of its myelin
+        im_axon = np.zeros((50, 50), dtype=np.uint8)
+        im_axon[10:40, 10:13] = 1
+        im_axon[10:13, 10:40] = 1
+        im_axon[37:40, 10:40] = 1
+        im_myelin = (ndi.binary_dilation(im_axon, iterations=2) & ~im_axon.astype(bool)).astype(np.uint8)
+
+        nearest_table = MorphometricsSession(im_axon, im_myelin, pixel_size=0.1,
+                                             myelin_assignment='nearest').get_table()
+        watershed_table = MorphometricsSession(im_axon, im_myelin, pixel_size=0.1,
+                                               myelin_assignment='watershed').get_table()
+
+        assert nearest_table['myelin_area'][0] == pytest.approx(np.count_nonzero(im_myelin) * 0.1 ** 2)
+        assert 0 < nearest_table['gratio'][0] < 1
+        assert np.isnan(watershed_table['gratio'][0])
+
+    @pytest.mark.unit
+    def test_nearest_assignment_leaves_disconnected_myelin_unassigned(self):
+        rows, cols = np.mgrid[0:50, 0:80]
+        distance = np.sqrt((rows - 25) ** 2 + (cols - 20) ** 2)
+        im_axon = distance <= 6
+        im_ring = (distance > 6) & (distance <= 9)
+        im_blob = np.zeros((50, 80), dtype=bool)
+        im_blob[20:30, 60:70] = True
+
+        im_axonmyelin_label = assign_myelin_to_nearest_axon(measure.label(im_axon), im_ring | im_blob)
+
+        assert np.all(im_axonmyelin_label[im_axon | im_ring] == 1)
+        assert np.all(im_axonmyelin_label[im_blob] == 0)
+        assert np.all(im_axonmyelin_label[~(im_axon | im_ring | im_blob)] == 0)
+
     # --------------save and load _axon_morphometrics tests-------------- #
     @pytest.mark.unit
     def test_save_axon_morphometrics_creates_file_in_expected_location(self):
@@ -237,6 +398,26 @@ class TestCore(object):
         assert result_path.is_file()
         result_path.unlink()
 
+    @pytest.mark.unit
+    def test_draw_axon_diameter_with_precomputed_labels_and_stats(self):
+        img = imageio_imread(self.test_folder_path / 'image.png')
+        im_axon_label = measure.label(self.pred_axon)
+        table = get_axon_morphometrics_table(self.pred_axon, pixel_size=self.pixelsizeValue)
+
+        fig = draw_axon_diameter(img, None, self.pred_axon, self.pred_myelin, im_axon_label=im_axon_label,
+                                 stats_array=table)
+        assert fig.axes
+
+    # --------------map_axon_values tests-------------- #
+    @pytest.mark.unit
+    def test_map_axon_values_paints_each_label_with_its_value(self):
+        im_axon_label = np.array([[0, 1, 1], [2, 0, 3]])
+
+        value_map = map_axon_values(im_axon_label, [1.5, 2.5, 3.5])
+
+        assert value_map.dtype == np.float32
+        assert np.array_equal(value_map, np.array([[0, 1.5, 1.5], [2.5, 0, 3.5]], dtype=np.float32))
+
     # --------------get_aggregate_morphometrics tests-------------- #
     @pytest.mark.unit
     def test_get_aggregate_morphometrics_returns_expected_type(self):
@@ -6,9 +6,16 @@ import string
 import pytest
 import shutil
 
+import pandas as pd
+
 import AxonDeepSeg
 import AxonDeepSeg.ads_utils as ads
-from AxonDeepSeg.morphometrics.launch_morphometrics_computation import launch_morphometrics_computation
+from AxonDeepSeg.morphometrics.launch_morphometrics_computation import (
+                                                                        launch_morphometrics_computation,
+                                                                        save_morphometrics_table,
+                                                                        load_morphometrics_table,
+                                                                        get_morphometrics_metadata
+                                                                        )
 from config import axonmyelin_suffix, axon_suffix, myelin_suffix
 
 
@@ -110,6 +117,65 @@ class TestCore(object):
 
         assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0) and self.morphometricsPath.exists() and morphometricsPathcopy.exists()
 
+    @pytest.mark.unit
+    def test_main_cli_consolidates_morphometrics_of_images_processed_in_parallel(self):
+        pathImg = self.dataPath / 'image.png'
+
+        pathCopy = self.dataPath.parent / '__test_demo_files_parallel__'
+        shutil.copytree(self.dataPath, pathCopy, copy_function=shutil.copy)
+        pathImgcopy = pathCopy / 'image.png'
+        pathOutput = pathCopy / 'cohort_morphometrics.csv'
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.morphometrics.launch_morphometrics_computation.main(
+                ["-i", str(pathImg), str(pathImgcopy), "--jobs", "2", "-o", str(pathOutput)]
+                )
+
+        table = pd.read_csv(pathOutput)
+        shutil.rmtree(pathCopy)
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+        assert list(table['image'].unique()) == [str(pathImg), str(pathImgcopy)]
+        assert 'axon_diam' in table.columns
+
+    @pytest.mark.exceptionhandling
+    def test_main_cli_processes_other_images_if_an_image_is_not_segmented(self):
+        pathImg = self.dataPath / 'image.png'
+        pathNotSegmented = self.testPath / '__test_files__' / '__test_segment_files__' / 'image.png'
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.morphometrics.launch_morphometrics_computation.main(["-i", str(pathNotSegmented), str(pathImg)])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 3)
+        assert self.morphometricsPath.exists()
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("extension", [".parquet", ".feather"])
+    def test_main_cli_saves_columnar_morphometrics_with_metadata(self, extension):
+        pytest.importorskip("pyarrow")
+        pathImg = self.dataPath / 'image.png'
+        self.morphometricsPath = self.dataPath / ("axon_morphometrics" + extension)
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.morphometrics.launch_morphometrics_computation.main(
+                ["-s", "0.07", "-i", str(pathImg), "-f", self.morphometricsPath.name, "--model", "default_SEM_model"]
+                )
+
+        table, metadata = load_morphometrics_table(self.morphometricsPath)
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+        assert str(table['axon_diam'].dtype) == 'float64'
+        assert str(table['image'].dtype) == 'category'
+        assert metadata['ads_version'] == AxonDeepSeg.__version__
+        assert metadata['images'][str(pathImg)] == {'pixel_size': 0.07, 'model': 'default_SEM_model'}
+
+    @pytest.mark.exceptionhandling
+    def test_save_morphometrics_table_with_invalid_extension_raises_exception(self):
+        table = pd.DataFrame({'axon_diam': [1.0, 2.0]})
+
+        with pytest.raises(ValueError):
+            save_morphometrics_table(table, self.dataPath / 'axon_morphometrics.txt', get_morphometrics_metadata({}))
+
     @pytest.mark.exceptionhandling
     def test_main_cli_handles_exception_if_image_is_not_segmented(self):
         self.dataPath = self.testPath / '__test_files__' / '__test_segment_files__'
@@ -0,0 +1,101 @@
+# coding: utf-8
+
+from pathlib import Path
+import shutil
+
+import numpy as np
+from imageio import imread as imageio_imread
+import pytest
+
+from AxonDeepSeg.morphometrics.morphometric_maps import (
+                                                            get_label_colors,
+                                                            blend_band,
+                                                            write_morphometric_map,
+                                                            write_map_legend,
+                                                            save_morphometric_maps
+                                                        )
+from AxonDeepSeg.morphometrics.compute_morphometrics import get_axon_morphometrics_table
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.fullPath = Path(__file__).resolve().parent
+
+        self.tmpDir = self.fullPath / '__tmp__'
+        if not self.tmpDir.exists():
+            self.tmpDir.mkdir()
+
+        # Three square axons on a gradient image
+        self.img = np.tile(np.arange(0, 250, 5, dtype=np.uint8), (40, 1))
+        self.im_axon_label = np.zeros((40, 50), dtype=int)
+        self.im_axon_label[5:10, 5:10] = 1
+        self.im_axon_label[20:30, 20:30] = 2
+        self.im_axon_label[32:38, 40:46] = 3
+        self.values = np.array([1., 2., np.nan])
+
+    def teardown(self):
+        if self.tmpDir.exists():
+            shutil.rmtree(self.tmpDir)
+
+    # --------------blend_band tests-------------- #
+    @pytest.mark.unit
+    def test_blend_band_only_colors_the_axons_with_a_value(self):
+        label_colors, label_colored, vmin, vmax = get_label_colors(self.values)
+
+        band = blend_band(self.img, self.im_axon_label, label_colors, label_colored, alpha=1.)
+
+        assert (vmin, vmax) == (1., 2.)
+        assert np.array_equal(band[0, :, 0], self.img[0])
+        assert np.array_equal(band[7, 7], label_colors[1])
+        assert np.array_equal(band[25, 25], label_colors[2])
+        assert np.array_equal(band[35, 42], np.repeat(self.img[35, 42], 3))
+
+    # --------------write_morphometric_map tests-------------- #
+    @pytest.mark.unit
+    def test_write_morphometric_map_streamed_png_matches_single_band(self):
+        path_streamed = self.tmpDir / 'streamed.png'
+        path_single = self.tmpDir / 'single.png'
+
+        write_morphometric_map(path_streamed, self.img, self.im_axon_label, self.values, band_height=7)
+        write_morphometric_map(path_single, self.img, self.im_axon_label, self.values, band_height=40)
+
+        streamed = imageio_imread(path_streamed)
+        assert streamed.shape == (40, 50, 3)
+        assert np.array_equal(streamed, imageio_imread(path_single))
+
+    @pytest.mark.unit
+    def test_write_morphometric_map_tiles_cover_the_image(self):
+        paths_tiles = write_morphometric_map(self.tmpDir / 'map.tif', self.img, self.im_axon_label, self.values,
+                                             tile_size=32)
+
+        assert len(paths_tiles) == 4
+        assert sum(imageio_imread(path).shape[0] * imageio_imread(path).shape[1] for path in paths_tiles) == 40 * 50
+
+    @pytest.mark.exceptionhandling
+    def test_write_morphometric_map_with_invalid_format_raises_exception(self):
+        with pytest.raises(ValueError):
+            write_morphometric_map(self.tmpDir / 'map.jpg', self.img, self.im_axon_label, self.values)
+
+    # --------------write_map_legend tests-------------- #
+    @pytest.mark.unit
+    def test_write_map_legend_creates_file(self):
+        path_legend = self.tmpDir / 'legend.png'
+
+        write_map_legend(path_legend, 0.5, 0.8, title='g-ratio')
+
+        assert path_legend.is_file()
+
+    # --------------save_morphometric_maps tests-------------- #
+    @pytest.mark.unit
+    def test_save_morphometric_maps_writes_a_map_and_a_legend_per_metric(self):
+        im_axon = self.im_axon_label > 0
+        im_myelin = np.zeros_like(im_axon)
+        table = get_axon_morphometrics_table(im_axon, im_myelin=im_myelin, pixel_size=0.1)
+
+        paths_maps = save_morphometric_maps(self.tmpDir, self.img, self.im_axon_label, table)
+
+        assert set(paths_maps) == {'axon_diam', 'gratio', 'myelin_thickness', 'eccentricity'}
+        for metric in paths_maps:
+            assert (self.tmpDir / 'AxonDeepSeg_map-{0}.png'.format(metric)).is_file()
+            assert (self.tmpDir / 'AxonDeepSeg_map-{0}_legend.png'.format(metric)).is_file()
@@ -0,0 +1,124 @@
+# coding: utf-8
+
+from pathlib import Path
+
+import numpy as np
+from imageio import imread as imageio_imread
+import pytest
+
+from AxonDeepSeg.morphometrics.tiled_morphometrics import get_tiles, get_tiled_axon_morphometrics_table
+from AxonDeepSeg.morphometrics.compute_morphometrics import (
+                                                                MorphometricsSession,
+                                                                get_axon_morphometrics_table,
+                                                                myelin_assignment_methods
+                                                            )
+from config import axon_suffix, myelin_suffix
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.fullPath = Path(__file__).resolve().parent
+        # Move up to the test directory, "test/"
+        self.testPath = self.fullPath.parent
+
+        self.test_folder_path = self.testPath / '__test_files__' / '__test_demo_files__'
+        self.pixelsizeValue = 0.07   # For current demo data.
+
+        self.pred_axon = imageio_imread(self.test_folder_path / ('image' + str(axon_suffix)), as_gray=True) > 0
+        self.pred_myelin = imageio_imread(self.test_folder_path / ('image' + str(myelin_suffix)), as_gray=True) > 0
+
+        # Grid of myelinated axons of different sizes, some of them crossing the borders of 32x32 tiles
+        rows, cols = np.mgrid[0:100, 0:120]
+        self.im_axon = np.zeros((100, 120), dtype=bool)
+        self.im_myelin = np.zeros((100, 120), dtype=bool)
+        for i, (y0, x0) in enumerate([(15, 15), (16, 50), (31, 85), (60, 30), (64, 64), (80, 100)]):
+            distance = np.sqrt((rows - y0) ** 2 + (cols - x0) ** 2)
+            radius = 4 + i
+            self.im_axon |= distance <= radius
+            self.im_myelin |= (distance > radius) & (distance <= radius + 3)
+
+        # Dense packing of myelinated axons of different sizes, whose myelin touches the myelin of their neighbours
+        random_state = np.random.RandomState(0)
+        rows, cols = np.mgrid[0:160, 0:200]
+        self.im_dense_axon = np.zeros((160, 200), dtype=bool)
+        self.im_dense_myelin = np.zeros((160, 200), dtype=bool)
+        for y0 in range(8, 160, 16):
+            for x0 in range(8, 200, 16):
+                y0_jittered, x0_jittered = y0 + random_state.randint(-1, 2), x0 + random_state.randint(-1, 2)
+                distance = np.sqrt((rows - y0_jittered) ** 2 + (cols - x0_jittered) ** 2)
+                radius = random_state.uniform(3, 5)
+                self.im_dense_axon |= distance <= radius
+                self.im_dense_myelin |= (distance > radius) & (distance <= 9)
+        self.im_dense_myelin &= ~self.im_dense_axon
+
+    def assert_tables_equal(self, tiled_table, table):
+        assert tiled_table.dtype.names == table.dtype.names
+        assert tiled_table.size == table.size
+        for column in table.dtype.names:
+            assert np.allclose(tiled_table[column], table[column], equal_nan=True)
+
+    # --------------get_tiles tests-------------- #
+    @pytest.mark.unit
+    def test_get_tiles_cover_the_image_once(self):
+        coverage = np.zeros((100, 120), dtype=int)
+        for tile, window in get_tiles(coverage.shape, 32, 5):
+            coverage[tile] += 1
+            assert window[0].start == max(tile[0].start - 5, 0)
+            assert window[1].stop == min(tile[1].stop + 5, 120)
+
+        assert np.all(coverage == 1)
+
+    # --------------get_tiled_axon_morphometrics_table tests-------------- #
+    @pytest.mark.unit
+    def test_tiled_morphometrics_match_single_pass_simulated_axons(self):
+        for method in myelin_assignment_methods:
+            table = MorphometricsSession(self.im_axon, self.im_myelin, pixel_size=0.1,
+                                         myelin_assignment=method).get_table()
+            tiled_table = get_tiled_axon_morphometrics_table(self.im_axon, im_myelin=self.im_myelin, pixel_size=0.1,
+                                                             tile_size=32, max_fiber_diameter=3.0,
+                                                             myelin_assignment=method, n_workers=1)
+
+            self.assert_tables_equal(tiled_table, table)
+
+    @pytest.mark.unit
+    def test_tiled_morphometrics_match_single_pass_touching_myelin(self):
+        table = MorphometricsSession(self.im_dense_axon, self.im_dense_myelin, pixel_size=0.1,
+                                     myelin_assignment='nearest').get_table()
+        tiled_table = get_tiled_axon_morphometrics_table(self.im_dense_axon, im_myelin=self.im_dense_myelin,
+                                                         pixel_size=0.1, tile_size=32, max_fiber_diameter=3.0,
+                                                         n_workers=1)
+
+        assert np.all(~np.isnan(table['gratio']))
+        self.assert_tables_equal(tiled_table, table)
+
+    @pytest.mark.unit
+    def test_tiled_morphometrics_without_myelin_mask(self):
+        table = get_axon_morphometrics_table(self.im_axon, pixel_size=0.1)
+        tiled_table = get_tiled_axon_morphometrics_table(self.im_axon, pixel_size=0.1, tile_size=32,
+                                                         max_fiber_diameter=3.0, n_workers=1)
+
+        self.assert_tables_equal(tiled_table, table)
+
+    @pytest.mark.integration
+    def test_tiled_morphometrics_match_single_pass_in_process_pool(self):
+        table = MorphometricsSession(self.pred_axon, self.pred_myelin, pixel_size=self.pixelsizeValue,
+                                     myelin_assignment='nearest').get_table()
+        tiled_table = get_tiled_axon_morphometrics_table(self.pred_axon, im_myelin=self.pred_myelin,
+                                                         pixel_size=self.pixelsizeValue, tile_size=256,
+                                                         max_fiber_diameter=15.0, n_workers=2)
+
+        self.assert_tables_equal(tiled_table, table)
+
+    @pytest.mark.exceptionhandling
+    def test_tiled_morphometrics_with_too_small_halo_raises_exception(self):
+        with pytest.raises(ValueError):
+            get_tiled_axon_morphometrics_table(self.im_axon, im_myelin=self.im_myelin, pixel_size=0.1, tile_size=32,
+                                               max_fiber_diameter=0.2, n_workers=1)
+
+    @pytest.mark.exceptionhandling
+    def test_tiled_watershed_with_myelin_connected_outside_of_window_raises_exception(self):
+        with pytest.raises(ValueError):
+            get_tiled_axon_morphometrics_table(self.im_dense_axon, im_myelin=self.im_dense_myelin, pixel_size=0.1,
+                                               tile_size=32, max_fiber_diameter=3.0, myelin_assignment='watershed',
+                                               n_workers=1)
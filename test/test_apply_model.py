@@ -0,0 +1,92 @@
+# coding: utf-8
+
+from pathlib import Path
+import json
+
+import numpy as np
+import pytest
+
+import AxonDeepSeg.ads_utils as ads
+
+from AxonDeepSeg.apply_model import (
+                                        detect_tissue,
+                                        select_tissue_patches,
+                                        prepare_patches,
+                                        get_patch_prediction_window,
+                                        segment_roi
+                                    )
+
+
+class TestCore(object):
+    def setup(self):
+        # Bright background with a dark square of "tissue" in the top left corner
+        self.acquisition = 220 * np.ones((1024, 1024), dtype=int)
+        self.acquisition[100:400, 100:400] = 60
+
+        self.patch_size = 256
+        self.overlap_value = 25
+
+        self.testPath = Path(__file__).resolve().parent
+        self.modelPath = self.testPath.parent / 'AxonDeepSeg' / 'models' / 'default_SEM_model'
+        self.imagePath = self.testPath / '__test_files__' / '__test_demo_files__' / 'image.png'
+
+    # --------------detect_tissue tests-------------- #
+    @pytest.mark.unit
+    def test_detect_tissue_finds_dark_region(self):
+        tissue_mask = detect_tissue(self.acquisition, downsampling_factor=16)
+
+        assert tissue_mask.shape == (64, 64)
+        assert tissue_mask[15, 15]
+        assert not tissue_mask[50, 50]
+
+    @pytest.mark.unit
+    def test_detect_tissue_keeps_everything_for_uniform_image(self):
+        tissue_mask = detect_tissue(np.zeros((512, 512), dtype=int))
+
+        assert tissue_mask.all()
+
+    # --------------select_tissue_patches tests-------------- #
+    @pytest.mark.unit
+    def test_select_tissue_patches_only_keeps_patches_intersecting_tissue(self):
+        L_data, L_n_patches, L_positions = prepare_patches([self.acquisition], self.patch_size, self.overlap_value)
+        tissue_mask = detect_tissue(self.acquisition)
+
+        L_inferred = select_tissue_patches(L_positions, [tissue_mask], self.patch_size)
+
+        assert len(L_inferred) == len(L_data)
+        assert 0 < sum(L_inferred) < len(L_inferred)
+        for i, pos in enumerate(L_positions[0]):
+            if L_inferred[i] is False:
+                assert (self.acquisition[pos[0]:pos[0] + self.patch_size, pos[1]:pos[1] + self.patch_size] == 220).all()
+
+    # --------------get_patch_prediction_window tests-------------- #
+    @pytest.mark.unit
+    def test_get_patch_prediction_windows_cover_the_acquisition(self):
+        L_data, L_n_patches, L_positions = prepare_patches([self.acquisition], self.patch_size, self.overlap_value)
+        original_shape = (512, 512)
+        covered = np.zeros(original_shape, dtype=bool)
+
+        for position in L_positions[0]:
+            tile_bbox, window = get_patch_prediction_window(position, L_positions[0], self.acquisition.shape,
+                                                            original_shape, self.patch_size, self.overlap_value)
+            h0, w0, h1, w1 = tile_bbox
+            covered[h0:h1, w0:w1] = True
+
+            assert 0 <= window[0] < window[2] <= self.patch_size
+            assert 0 <= window[1] < window[3] <= self.patch_size
+
+        assert covered.all()
+
+    # --------------segment_roi tests-------------- #
+    @pytest.mark.integration
+    def test_segment_roi_returns_segmentation_of_the_region(self):
+        with open(str(self.modelPath / 'config_network.json'), 'r') as fd:
+            config = json.loads(fd.read())
+        acquisition = ads.imread(str(self.imagePath))
+        pixel_size = float(open(str(self.imagePath.parent / 'pixel_size_in_micrometer.txt'), 'r').read())
+        roi = (10, 20, 110, 220)
+
+        prediction = segment_roi(acquisition, roi, pixel_size, self.modelPath, config, resampled_resolution=0.1)
+
+        assert prediction.shape == (100, 200)
+        assert set(np.unique(prediction)) <= {0, 1, 2}
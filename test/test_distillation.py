@@ -0,0 +1,141 @@
+# coding: utf-8
+
+import json
+from pathlib import Path
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import keras.backend.tensorflow_backend as K
+
+import AxonDeepSeg.ads_utils as ads
+from AxonDeepSeg.config_tools import default_configuration
+from AxonDeepSeg.distillation import generate_student_config, benchmark_model, compare_to_teacher
+from AxonDeepSeg.network_construction import uconv_net
+
+
+class TestCore(object):
+    def setup(self):
+        K.clear_session()
+
+        # Get the directory where this current file is saved
+        self.fullPath = Path(__file__).resolve().parent
+
+        self.validationPath = (
+            self.fullPath /
+            '__test_files__' /
+            '__test_training_files__' /
+            'Validation'
+            )
+
+        self.teacher_config = default_configuration()
+        self.teacher_config.update({
+            "trainingset_patchsize": 256,
+            "trainingset": "SEM_3c_256",
+            "learning_rate": 0.005,
+            "batch_size": 2,
+            "epochs": 7,
+            "thresholds": [0, 0.3, 0.7],
+            "depth": 2,
+            "convolution_per_layer": [2, 2],
+            "size_of_convolutions_per_layer": [[3, 3], [3, 3]],
+            "features_per_convolution": [
+                [[1, 8], [8, 8]],
+                [[8, 16], [16, 16]]
+                ],
+            "downsampling": "maxpooling",
+            })
+
+        self.dict_struct = {'structure': [[3, 3], [3, 3]], 'first_num_features': 4, 'features_augmentation': 'x2'}
+
+        self.tmpPath = Path(tempfile.mkdtemp())
+
+    def teardown(self):
+        K.clear_session()
+        shutil.rmtree(str(self.tmpPath))
+
+    def save_model(self, path_model, config):
+        """
+        Saves an untrained network in the formats read by load_model.
+        """
+        path_model.mkdir(parents=True)
+        with open(str(path_model / 'config_network.json'), 'w') as fd:
+            json.dump(config, fd)
+
+        K.clear_session()
+        uconv_net(config, verbose=False)
+        tf.train.Saver().save(K.get_session(), str(path_model / 'model.ckpt'))
+        K.clear_session()
+
+    # --------------generate_student_config tests-------------- #
+    @pytest.mark.unit
+    def test_generate_student_config_builds_architecture_from_structure(self):
+        student_config = generate_student_config(self.teacher_config, self.dict_struct)
+
+        assert student_config["depth"] == 2
+        assert student_config["convolution_per_layer"] == [2, 2]
+        assert student_config["size_of_convolutions_per_layer"] == [[3, 3], [3, 3]]
+        assert student_config["features_per_convolution"] == [[[1, 4], [4, 4]], [[4, 8], [8, 8]]]
+
+    @pytest.mark.unit
+    def test_generate_student_config_keeps_other_parameters_of_teacher(self):
+        student_config = generate_student_config(self.teacher_config, self.dict_struct)
+
+        for key in ["trainingset_patchsize", "trainingset", "learning_rate", "batch_size", "epochs", "thresholds",
+                    "n_classes", "downsampling"]:
+            assert student_config[key] == self.teacher_config[key]
+
+        # The configuration of the teacher is not modified
+        assert self.teacher_config["features_per_convolution"][0][0] == [1, 8]
+
+    # --------------benchmark_model tests-------------- #
+    @pytest.mark.integration
+    def test_benchmark_model_segments_every_patch(self):
+        path_model = self.tmpPath / 'model'
+        self.save_model(path_model, self.teacher_config)
+        L_patches = [ads.imread(str(path_image)) for path_image in sorted(self.validationPath.glob('image_*.png'))]
+
+        predictions, throughput = benchmark_model(path_model, L_patches, batch_size=2)
+
+        assert len(predictions) == len(L_patches)
+        assert predictions[0].shape == (256, 256)
+        assert set(np.unique(np.stack(predictions))) <= {0, 1, 2}
+        assert throughput > 0
+
+    # --------------compare_to_teacher tests-------------- #
+    @pytest.mark.integration
+    def test_compare_to_teacher_of_same_network_gives_dice_of_one(self):
+        path_teacher = self.tmpPath / 'teacher'
+        self.save_model(path_teacher, self.teacher_config)
+        path_student = self.tmpPath / 'student'
+        shutil.copytree(str(path_teacher), str(path_student))
+
+        report = compare_to_teacher(path_teacher, path_student, self.validationPath, batch_size=2, verbose=False)
+
+        assert set(report) == {'teacher_throughput', 'student_throughput', 'speedup', 'axon_dice_to_teacher',
+                               'myelin_dice_to_teacher', 'teacher_axon_dice', 'teacher_myelin_dice',
+                               'student_axon_dice', 'student_myelin_dice'}
+        assert report['axon_dice_to_teacher'] == pytest.approx(1.0)
+        assert report['myelin_dice_to_teacher'] == pytest.approx(1.0)
+        assert report['student_axon_dice'] == pytest.approx(report['teacher_axon_dice'])
+
+    @pytest.mark.integration
+    def test_compare_to_teacher_of_student_network(self):
+        path_teacher = self.tmpPath / 'teacher'
+        self.save_model(path_teacher, self.teacher_config)
+        path_student = self.tmpPath / 'student'
+        self.save_model(path_student, generate_student_config(self.teacher_config, self.dict_struct))
+
+        report = compare_to_teacher(path_teacher, path_student, self.validationPath, batch_size=2, verbose=False)
+
+        assert 0 <= report['axon_dice_to_teacher'] <= 1
+        assert 0 <= report['myelin_dice_to_teacher'] <= 1
+        assert report['speedup'] == pytest.approx(report['student_throughput'] / report['teacher_throughput'])
+
+    @pytest.mark.exceptionhandling
+    def test_compare_to_teacher_without_patches_raises_exception(self):
+        with pytest.raises(ValueError):
+            compare_to_teacher(self.tmpPath / 'teacher', self.tmpPath / 'student', self.tmpPath, verbose=False)
@@ -0,0 +1,99 @@
+# coding: utf-8
+
+from pathlib import Path
+
+import pytest
+
+from AxonDeepSeg.distributed_processing import open_executor, run_tasks, process_cohort
+from AxonDeepSeg.segment import generate_default_parameters, generate_resolution
+from config import axonmyelin_suffix, axon_suffix, myelin_suffix
+
+
+class FlakyTask(object):
+    """Fails the first n_failures times it is called."""
+
+    def __init__(self, n_failures):
+        self.n_failures = n_failures
+        self.n_calls = 0
+
+    def __call__(self, value):
+        self.n_calls += 1
+        if self.n_calls <= self.n_failures:
+            raise RuntimeError("Failure {0}".format(self.n_calls))
+        return 2 * value
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.testPath = Path(__file__).resolve().parent
+        self.projectPath = self.testPath.parent
+
+        self.modelPath = self.projectPath / 'AxonDeepSeg' / 'models' / 'default_SEM_model'
+
+        self.imageFolderPathWithPixelSize = (
+            self.testPath /
+            '__test_files__' /
+            '__test_segment_files_with_pixel_size__'
+            )
+        self.imagePathWithPixelSize = self.imageFolderPathWithPixelSize / 'image.png'
+
+    @classmethod
+    def teardown_class(cls):
+        testPath = Path(__file__).resolve().parent
+        imageFolderPathWithPixelSize = testPath / '__test_files__' / '__test_segment_files_with_pixel_size__'
+
+        for suffix in [axonmyelin_suffix, axon_suffix, myelin_suffix]:
+            path_output = imageFolderPathWithPixelSize / ('image' + str(suffix))
+            if path_output.exists():
+                path_output.unlink()
+
+    # --------------run_tasks tests-------------- #
+    @pytest.mark.unit
+    def test_run_tasks_retries_failed_tasks(self):
+        task = FlakyTask(n_failures=2)
+
+        with open_executor('threads', n_workers=1) as executor:
+            results, errors = run_tasks(executor, task, [(1,)], max_retries=2)
+
+        assert results == [2]
+        assert errors == {}
+        assert task.n_calls == 3
+
+    @pytest.mark.unit
+    def test_run_tasks_gives_up_after_max_retries(self):
+        task = FlakyTask(n_failures=10)
+
+        with open_executor('threads', n_workers=1) as executor:
+            results, errors = run_tasks(executor, task, [(1,)], max_retries=1)
+
+        assert results == [None]
+        assert isinstance(errors[0], RuntimeError)
+        assert task.n_calls == 2
+
+    @pytest.mark.unit
+    def test_open_executor_runs_threads_tasks_one_at_a_time(self):
+        with open_executor('threads', n_workers=4) as executor:
+            assert executor._max_workers == 1
+
+    @pytest.mark.exceptionhandling
+    def test_open_executor_with_invalid_scheduler_raises_exception(self):
+        with pytest.raises(ValueError):
+            with open_executor('invalid'):
+                pass
+
+    # --------------process_cohort tests-------------- #
+    @pytest.mark.integration
+    def test_process_cohort_consolidates_tables_and_isolates_failures(self):
+        path_model, config = generate_default_parameters('SEM', str(self.modelPath))
+        resolution_model = generate_resolution('SEM', 512)
+        path_missing = self.imageFolderPathWithPixelSize / 'n0n_3xist1ng_1m4g3.png'
+
+        table, failures = process_cohort([self.imagePathWithPixelSize, path_missing], path_model, config,
+                                         resolution_model, scheduler='threads', n_workers=1, max_retries=0)
+
+        assert len(table) > 0
+        assert set(table['image']) == {str(self.imagePathWithPixelSize)}
+        assert 'axon_diam' in table.columns
+        assert list(failures) == [str(path_missing)]
+        assert (self.imageFolderPathWithPixelSize / ('image' + str(axon_suffix))).exists()
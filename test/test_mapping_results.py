@@ -0,0 +1,74 @@
+# coding: utf-8
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from AxonDeepSeg.mapping_results import group_models, compute_segmentation_metrics, compare_models, metrics_matrix
+from AxonDeepSeg.morphometrics.compute_morphometrics import get_pixelsize
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.testPath = Path(__file__).resolve().parent
+        self.projectPath = self.testPath.parent
+
+        self.modelPath = self.projectPath / 'AxonDeepSeg' / 'models' / 'default_SEM_model'
+
+        self.folderPath = self.testPath / '__test_files__' / '__test_demo_files__'
+        self.imagePath = self.folderPath / 'image.png'
+        self.groundtruthPath = self.folderPath / 'mask.png'
+
+    # --------------group_models tests-------------- #
+    @pytest.mark.unit
+    def test_group_models_shares_patches_between_models_of_same_resolution(self):
+        groups = group_models([self.modelPath, self.modelPath, self.modelPath], [0.1, 0.1, 0.2])
+
+        assert sorted(len(models) for models in groups.values()) == [1, 2]
+        assert {resolution for resolution, _ in groups} == {0.1, 0.2}
+
+    # --------------compute_segmentation_metrics tests-------------- #
+    @pytest.mark.unit
+    def test_compute_segmentation_metrics_of_perfect_segmentation(self):
+        groundtruth = np.zeros((10, 10), dtype=np.uint8)
+        groundtruth[2:8, 2:8] = 1
+        groundtruth[4:6, 4:6] = 2
+
+        metrics = compute_segmentation_metrics(groundtruth, groundtruth)
+
+        assert metrics['accuracy'] == 1
+        assert metrics['pw_dice_axon'] == pytest.approx(1)
+        assert metrics['pw_dice_myelin'] == pytest.approx(1)
+        assert metrics['axon_fraction'] == pytest.approx(0.04)
+
+    @pytest.mark.unit
+    def test_compute_segmentation_metrics_without_groundtruth(self):
+        metrics = compute_segmentation_metrics(np.zeros((10, 10), dtype=np.uint8))
+
+        assert set(metrics) == {'axon_fraction', 'myelin_fraction'}
+
+    # --------------compare_models tests-------------- #
+    @pytest.mark.integration
+    def test_compare_models_returns_metrics_of_each_model_and_image(self):
+        pixel_size = get_pixelsize(self.folderPath / 'pixel_size_in_micrometer.txt')
+
+        comparison = compare_models([self.modelPath], [self.imagePath], pixel_size, 0.1,
+                                    path_groundtruths=[self.groundtruthPath])
+
+        assert list(comparison.index) == [(self.modelPath.name, str(self.imagePath))]
+        assert 0 < comparison['pw_dice_axon'].iloc[0] <= 1
+
+        matrix = metrics_matrix(comparison, 'pw_dice_myelin')
+        assert matrix.shape == (1, 1)
+
+    @pytest.mark.integration
+    def test_compare_models_by_chunks_records_time_of_each_image(self):
+        pixel_size = get_pixelsize(self.folderPath / 'pixel_size_in_micrometer.txt')
+
+        comparison = compare_models([self.modelPath], [self.imagePath, self.imagePath], pixel_size, 0.1,
+                                    path_groundtruths=[self.groundtruthPath, None], chunk_size=1)
+
+        assert len(comparison) == 2
+        assert np.all(comparison['inference_time'] > 0)
@@ -0,0 +1,72 @@
+# coding: utf-8
+
+import numpy as np
+import pytest
+
+import keras.backend.tensorflow_backend as K
+from keras.layers import Conv2D, SeparableConv2D
+
+from AxonDeepSeg.config_tools import default_configuration, validate_config
+from AxonDeepSeg.network_construction import uconv_net
+
+
+class TestCore(object):
+    def setup(self):
+        K.clear_session()
+
+        self.config = default_configuration()
+        self.config.update({
+            "trainingset_patchsize": 64,
+            "depth": 2,
+            "convolution_per_layer": [2, 2],
+            "size_of_convolutions_per_layer": [[3, 3], [3, 3]],
+            "features_per_convolution": [
+                [[1, 8], [8, 8]],
+                [[8, 16], [16, 16]]
+                ],
+            "downsampling": "convolution",
+            })
+
+    def teardown(self):
+        K.clear_session()
+
+    # --------------uconv_net tests-------------- #
+    @pytest.mark.unit
+    def test_uconv_net_builds_separable_convolutions(self):
+        self.config["convolution_type"] = "separable"
+        assert validate_config(self.config)
+
+        model = uconv_net(self.config, verbose=False)
+
+        separable_layers = [layer for layer in model.layers if isinstance(layer, SeparableConv2D)]
+        dense_layers = [layer for layer in model.layers if isinstance(layer, Conv2D)]
+        # Contraction, downsampling, upconvolution and expansion layers are separable, the final layer is dense
+        assert len(separable_layers) == 2 * 2 + 2 + 2 + 2 * 2
+        assert [layer.name for layer in dense_layers] == ['finalconv']
+
+        patches = np.zeros((1, 64, 64, 1), dtype=np.float32)
+        assert model.predict(patches).shape == (1, 64, 64, 3)
+
+    @pytest.mark.unit
+    def test_separable_convolutions_have_fewer_parameters(self):
+        n_parameters = uconv_net(self.config, verbose=False).count_params()
+        K.clear_session()
+        self.config["convolution_type"] = "separable"
+        n_separable_parameters = uconv_net(self.config, verbose=False).count_params()
+
+        assert n_separable_parameters < n_parameters
+
+    @pytest.mark.unit
+    def test_uconv_net_without_convolution_type_builds_dense_convolutions(self):
+        del self.config["convolution_type"]
+
+        model = uconv_net(self.config, verbose=False)
+
+        assert not any(isinstance(layer, SeparableConv2D) for layer in model.layers)
+
+    @pytest.mark.exceptionhandling
+    def test_uconv_net_with_invalid_convolution_type_raises_exception(self):
+        self.config["convolution_type"] = "invalid"
+
+        with pytest.raises(ValueError):
+            uconv_net(self.config, verbose=False)
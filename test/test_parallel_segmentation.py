@@ -0,0 +1,64 @@
+# coding: utf-8
+
+import numpy as np
+import pytest
+
+from AxonDeepSeg.apply_model import prepare_patches
+from AxonDeepSeg.parallel_segmentation import (
+                                                start_readers,
+                                                receive_batches,
+                                                synthetic_acquisition,
+                                                benchmark_handoff
+                                            )
+
+
+class TestCore(object):
+    def setup(self):
+        self.patch_size = 256
+        self.overlap_value = 25
+        self.batch_size = 3
+        self.L_load_args = [(700, 0), (900, 1)]
+
+    def receive_patches(self, shared_memory):
+        readers, descriptors, ring = start_readers(synthetic_acquisition, self.L_load_args, self.patch_size,
+                                                   self.overlap_value, self.batch_size, n_readers=2,
+                                                   shared_memory=shared_memory)
+        received = {}
+        for descriptor in receive_batches(descriptors, len(readers), ring):
+            if descriptor[0] == 'batch':
+                _, i, start, batch = descriptor
+                for k, patch in enumerate(batch):
+                    received[(i, start + k)] = np.copy(patch)
+
+        for reader in readers:
+            reader.join()
+
+        return received
+
+    # --------------reader processes tests-------------- #
+    @pytest.mark.unit
+    def test_readers_hand_over_all_patches_through_shared_memory(self):
+        received = self.receive_patches(shared_memory=True)
+
+        for i, args in enumerate(self.L_load_args):
+            acquisition, _ = synthetic_acquisition(*args)
+            L_data, L_n_patches, L_positions = prepare_patches([acquisition], self.patch_size, self.overlap_value)
+            for j, patch in enumerate(L_data):
+                assert np.array_equal(received[(i, j)], patch)
+
+    @pytest.mark.unit
+    def test_shared_memory_and_pickling_handoffs_give_same_patches(self):
+        received_shared = self.receive_patches(shared_memory=True)
+        received_pickled = self.receive_patches(shared_memory=False)
+
+        assert received_shared.keys() == received_pickled.keys()
+        for key in received_shared:
+            assert np.array_equal(received_shared[key], received_pickled[key])
+
+    # --------------benchmark_handoff tests-------------- #
+    @pytest.mark.unit
+    def test_benchmark_handoff_runs_both_modes(self):
+        timings = benchmark_handoff(image_size=1000, patch_size=self.patch_size, batch_size=self.batch_size)
+
+        assert timings['shared_memory'] > 0
+        assert timings['pickling'] > 0
@@ -0,0 +1,33 @@
+# coding: utf-8
+
+import pytest
+
+from AxonDeepSeg.patch_management_tools import get_tiles, get_roi_context
+
+
+class TestCore(object):
+    def setup(self):
+        self.image_shape = (1000, 700)
+
+    # --------------get_tiles tests-------------- #
+    @pytest.mark.unit
+    def test_get_tiles_contexts_contain_their_tiles(self):
+        for tile, context in get_tiles(self.image_shape, 300, margin=20, min_size=100):
+            assert context[0] <= tile[0] and context[1] <= tile[1]
+            assert context[2] >= tile[2] and context[3] >= tile[3]
+
+    # --------------get_roi_context tests-------------- #
+    @pytest.mark.unit
+    def test_get_roi_context_adds_margin(self):
+        assert get_roi_context((100, 100, 200, 300), self.image_shape, margin=25) == (75, 75, 225, 325)
+
+    @pytest.mark.unit
+    def test_get_roi_context_is_clipped_to_the_image(self):
+        assert get_roi_context((0, 650, 50, 700), self.image_shape, margin=25) == (0, 625, 75, 700)
+
+    @pytest.mark.unit
+    def test_get_roi_context_reaches_minimum_size(self):
+        ch0, cw0, ch1, cw1 = get_roi_context((500, 300, 510, 310), self.image_shape, margin=5, min_size=300)
+
+        assert ch1 - ch0 >= 300 and cw1 - cw0 >= 300
+        assert ch0 <= 500 and ch1 >= 510
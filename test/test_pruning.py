@@ -0,0 +1,124 @@
+# coding: utf-8
+
+import json
+from pathlib import Path
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import keras.backend.tensorflow_backend as K
+
+from AxonDeepSeg.config_tools import default_configuration
+from AxonDeepSeg.network_construction import uconv_net
+from AxonDeepSeg.apply_model import load_model, predict_patches
+from AxonDeepSeg.pruning import prune_config, transfer_pruned_weights, prune_model
+
+
+class TestCore(object):
+    def setup(self):
+        K.clear_session()
+
+        self.config = default_configuration()
+        self.config.update({
+            "trainingset_patchsize": 64,
+            "depth": 2,
+            "convolution_per_layer": [2, 2],
+            "size_of_convolutions_per_layer": [[3, 3], [3, 3]],
+            "features_per_convolution": [
+                [[1, 8], [8, 8]],
+                [[8, 16], [16, 16]]
+                ],
+            "downsampling": "maxpooling",
+            })
+
+        self.tmpPath = Path(tempfile.mkdtemp())
+
+    def teardown(self):
+        K.clear_session()
+        shutil.rmtree(str(self.tmpPath))
+
+    # --------------prune_config tests-------------- #
+    @pytest.mark.unit
+    def test_prune_config_reduces_features_and_keeps_chain_consistent(self):
+        pruned_config = prune_config(self.config, 0.5)
+
+        assert pruned_config["features_per_convolution"] == [[[1, 4], [4, 4]], [[4, 8], [8, 8]]]
+        assert self.config["features_per_convolution"][0][0] == [1, 8]
+
+    @pytest.mark.unit
+    def test_prune_config_keeps_at_least_one_feature(self):
+        pruned_config = prune_config(self.config, 0.99)
+
+        for layer in pruned_config["features_per_convolution"]:
+            for _, out_features in layer:
+                assert out_features >= 1
+
+    # --------------transfer_pruned_weights tests-------------- #
+    @pytest.mark.unit
+    def test_transfer_without_pruning_gives_same_predictions(self):
+        model = uconv_net(self.config, verbose=False)
+        copied_model = uconv_net(prune_config(self.config, 0), verbose=False)
+
+        transfer_pruned_weights(model, copied_model)
+
+        patches = np.random.RandomState(0).randint(0, 255, (2, 64, 64, 1)).astype(np.float32)
+        assert np.allclose(model.predict(patches), copied_model.predict(patches), atol=1e-5)
+
+    @pytest.mark.unit
+    def test_transfer_keeps_skip_connections_consistent(self):
+        model = uconv_net(self.config, verbose=False)
+        pruned_model = uconv_net(prune_config(self.config, 0.5), verbose=False)
+
+        kept_channels = transfer_pruned_weights(model, pruned_model)
+
+        for layer, pruned_layer in zip(model.layers, pruned_model.layers):
+            assert len(kept_channels[layer.name]) == pruned_layer.output_shape[-1]
+
+        patches = np.zeros((1, 64, 64, 1), dtype=np.float32)
+        assert pruned_model.predict(patches).shape == (1, 64, 64, 3)
+
+    @pytest.mark.unit
+    def test_transfer_without_pruning_gives_same_predictions_with_separable_convolutions(self):
+        self.config["convolution_type"] = "separable"
+        model = uconv_net(self.config, verbose=False)
+        copied_model = uconv_net(prune_config(self.config, 0), verbose=False)
+
+        transfer_pruned_weights(model, copied_model)
+
+        patches = np.random.RandomState(0).randint(0, 255, (2, 64, 64, 1)).astype(np.float32)
+        assert np.allclose(model.predict(patches), copied_model.predict(patches), atol=1e-5)
+
+    # --------------prune_model tests-------------- #
+    @pytest.mark.integration
+    def test_fine_tuned_pruned_model_is_restored_by_load_model(self):
+        path_model = self.tmpPath / 'model'
+        path_pruned_model = self.tmpPath / 'pruned_model'
+        path_trainingset = Path(__file__).resolve().parent / '__test_files__' / '__test_training_files__'
+        path_model.mkdir()
+
+        self.config.update({"trainingset_patchsize": 256, "batch_size": 2, "epochs": 5, "checkpoint": None})
+        model = uconv_net(self.config, verbose=False)
+        model.save(str(path_model / 'model.hdf5'))
+        with open(str(path_model / 'config_network.json'), 'w') as fd:
+            json.dump(self.config, fd)
+
+        pruned_config = prune_model(path_model, path_pruned_model, 0.5, path_trainingset=path_trainingset,
+                                    fine_tuning_epochs=1)
+
+        # The epochs of the fine-tuning are not saved in the configuration of the pruned model
+        with open(str(path_pruned_model / 'config_network.json'), 'r') as fd:
+            saved_config = json.loads(fd.read())
+        assert saved_config == pruned_config
+        assert saved_config["epochs"] == 5
+
+        pruned_model, sess, pred, x = load_model(path_pruned_model, saved_config)
+        patches = np.zeros((2, 256, 256), dtype=np.uint8)
+        predictions = predict_patches(pruned_model, sess, pred, x, patches, 256, saved_config["n_classes"])
+        sess.close()
+        tf.reset_default_graph()
+
+        assert len(predictions) == 2
+        assert predictions[0].shape == (256, 256)
@@ -0,0 +1,104 @@
+# coding: utf-8
+
+from pathlib import Path
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+from AxonDeepSeg.apply_model import load_acquisitions, apply_convnet
+from AxonDeepSeg.resampling_cache import ResampledAcquisitionCache
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.testPath = Path(__file__).resolve().parent
+
+        self.imagePath = (
+            self.testPath /
+            '__test_files__' /
+            '__test_segment_files__' /
+            'image.png'
+            )
+
+        self.modelPath = self.testPath.parent / 'AxonDeepSeg' / 'models' / 'default_SEM_model'
+
+        self.cachePath = Path(tempfile.mkdtemp())
+
+    def teardown(self):
+        shutil.rmtree(str(self.cachePath))
+
+    # --------------ResampledAcquisitionCache tests-------------- #
+    @pytest.mark.unit
+    def test_get_returns_none_for_missing_entry(self):
+        cache = ResampledAcquisitionCache(self.cachePath)
+
+        assert cache.get(self.imagePath, 0.5) == (None, None)
+
+    @pytest.mark.unit
+    def test_put_then_get_returns_same_array(self):
+        cache = ResampledAcquisitionCache(self.cachePath)
+        resampled = np.arange(100 * 80, dtype=np.uint8).reshape(100, 80)
+
+        cache.put(self.imagePath, 0.5, resampled, (200, 160))
+        cached, original_shape = cache.get(self.imagePath, 0.5)
+
+        assert np.array_equal(cached, resampled)
+        assert original_shape == (200, 160)
+        assert cache.get(self.imagePath, 0.25) == (None, None)
+
+    @pytest.mark.unit
+    def test_modified_source_image_misses_the_cache(self):
+        cache = ResampledAcquisitionCache(self.cachePath)
+        imageCopyPath = self.cachePath / 'image.png'
+        shutil.copy(str(self.imagePath), str(imageCopyPath))
+        resampled = np.zeros((100, 80), dtype=np.uint8)
+
+        cache.put(imageCopyPath, 0.5, resampled, (200, 160))
+        assert cache.get(imageCopyPath, 0.5)[0] is not None
+
+        stat = os.stat(str(imageCopyPath))
+        os.utime(str(imageCopyPath), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        assert cache.get(imageCopyPath, 0.5) == (None, None)
+
+    @pytest.mark.unit
+    def test_evict_removes_least_recently_used_entries(self):
+        cache = ResampledAcquisitionCache(self.cachePath, max_size=15000)
+        resampled = np.zeros((100, 100), dtype=np.uint8)
+
+        cache.put(self.imagePath, 0.5, resampled, (200, 200))
+        cache.put(self.imagePath, 0.25, resampled, (400, 400))
+
+        assert cache.get(self.imagePath, 0.5) == (None, None)
+        assert cache.get(self.imagePath, 0.25)[0] is not None
+
+    @pytest.mark.unit
+    def test_load_acquisitions_uses_cache(self):
+        cache = ResampledAcquisitionCache(self.cachePath)
+
+        rs_acquisitions, rs_coeffs, original_shapes = load_acquisitions([self.imagePath], [0.37], [0.1])
+        cached_rs_acquisitions, _, cached_original_shapes = load_acquisitions([self.imagePath], [0.37], [0.1],
+                                                                              cache=cache)
+        assert len(list(self.cachePath.glob('*.npy'))) == 1
+
+        second_rs_acquisitions, _, second_original_shapes = load_acquisitions([self.imagePath], [0.37], [0.1],
+                                                                              cache=cache)
+
+        assert np.array_equal(rs_acquisitions[0], cached_rs_acquisitions[0])
+        assert np.array_equal(rs_acquisitions[0], second_rs_acquisitions[0])
+        assert tuple(original_shapes[0]) == tuple(second_original_shapes[0])
+
+    @pytest.mark.exceptionhandling
+    def test_apply_convnet_with_cache_and_tiles_raises_exception(self):
+        cache = ResampledAcquisitionCache(self.cachePath)
+        with open(str(self.modelPath / 'config_network.json'), 'r') as fd:
+            config = json.loads(fd.read())
+
+        with pytest.raises(ValueError):
+            apply_convnet([self.imagePath], [0.37], self.modelPath, config, resampled_resolutions=[0.1],
+                          tile_size=512, cache=cache)
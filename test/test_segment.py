@@ -9,7 +9,8 @@ from AxonDeepSeg.segment import (
                                     generate_resolution, 
                                     generate_default_parameters, 
                                     segment_folders, 
-                                    segment_image
+                                    segment_image,
+                                    segment_images
                                 )
 import AxonDeepSeg.segment
 import AxonDeepSeg
@@ -187,6 +188,30 @@ class TestCore(object):
         for fileName in outputFiles:
             assert (self.imageFolderPath / fileName).exists()
 
+    # --------------segment_images tests-------------- #
+    @pytest.mark.integration
+    def test_segment_images_with_mixed_resolutions_creates_expected_files(self):
+
+        path_model, config = generate_default_parameters('SEM', str(self.modelPath))
+
+        overlap_value = 25
+        resolution_model = generate_resolution('SEM', 512)
+
+        segment_images(
+            path_images=[str(self.imagePath), str(self.imagePathWithPixelSize)],
+            path_model=str(path_model),
+            overlap_value=overlap_value,
+            config=config,
+            resolution_model=resolution_model,
+            acquired_resolutions=[0.37, 0.4],
+            inference_batch_size=4,
+            verbosity_level=2
+            )
+
+        for imageFolderPath in [self.imageFolderPath, self.imageFolderPathWithPixelSize]:
+            for suffix in [axon_suffix, myelin_suffix, axonmyelin_suffix]:
+                assert (imageFolderPath / ('image' + str(suffix))).exists()
+
     # --------------main (cli) tests-------------- #
     @pytest.mark.integration
     def test_main_cli_runs_succesfully_with_valid_inputs(self):
@@ -204,6 +229,41 @@ class TestCore(object):
 
         assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
 
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_with_batch_size(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imageFolderPath), "-v", "2", "-s", "0.37", '--batch-size', '3'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+
+    @pytest.mark.integration
+    def test_main_cli_dry_run_does_not_segment(self, capsys):
+        outputFiles = [
+            self.imagePath.stem + str(axon_suffix),
+            self.imagePath.stem + str(myelin_suffix),
+            self.imagePath.stem + str(axonmyelin_suffix)
+            ]
+        for fileName in outputFiles:
+            if (self.imageFolderPath / fileName).exists():
+                (self.imageFolderPath / fileName).unlink()
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imagePath), "-s", "0.37", '--max-memory', '4', '--dry-run'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+        assert "Estimated peak memory" in capsys.readouterr().out
+        for fileName in outputFiles:
+            assert not (self.imageFolderPath / fileName).exists()
+
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_with_max_memory(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imageFolderPath), "-s", "0.37", '--max-memory', '4'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+
     @pytest.mark.integration
     def test_main_cli_runs_succesfully_with_valid_inputs_with_pixel_size_file(self):
 
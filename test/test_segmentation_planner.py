@@ -0,0 +1,98 @@
+# coding: utf-8
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from AxonDeepSeg.apply_model import prepare_patches
+from AxonDeepSeg.config_tools import default_configuration
+from AxonDeepSeg.segmentation_planner import (
+                                                probe_image_shape,
+                                                count_patches,
+                                                estimate_network,
+                                                plan_segmentation
+                                            )
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.testPath = Path(__file__).resolve().parent
+
+        self.imagePath = (
+            self.testPath /
+            '__test_files__' /
+            '__test_segment_files__' /
+            'image.png'
+            )
+
+        self.config = default_configuration()
+        self.patch_size = self.config["trainingset_patchsize"]
+
+    # --------------probe_image_shape tests-------------- #
+    @pytest.mark.unit
+    def test_probe_image_shape_returns_image_dimensions(self):
+        assert probe_image_shape(self.imagePath) == (436, 344)
+
+    # --------------count_patches tests-------------- #
+    @pytest.mark.unit
+    def test_count_patches_matches_prepare_patches(self):
+        for shape in [(512, 512), (1000, 700), (2048, 1500)]:
+            L_data, L_n_patches, L_positions = prepare_patches([np.zeros(shape, dtype=np.uint8)], 512, 25)
+
+            assert count_patches(shape, 512, 25) == L_n_patches[0]
+
+    # --------------estimate_network tests-------------- #
+    @pytest.mark.unit
+    def test_estimate_network_grows_with_the_features(self):
+        small_network = estimate_network(self.config)
+
+        config = dict(self.config)
+        config["features_per_convolution"] = [[[2 * e[0], 2 * e[1]] for e in layer]
+                                              for layer in self.config["features_per_convolution"]]
+        large_network = estimate_network(config)
+
+        assert 0 < small_network['activation_bytes'] < large_network['activation_bytes']
+        assert 0 < small_network['flops'] < large_network['flops']
+
+    @pytest.mark.unit
+    def test_estimate_network_with_separable_convolutions_needs_fewer_flops(self):
+        network = estimate_network(self.config)
+
+        config = dict(self.config)
+        config["convolution_type"] = "separable"
+        separable_network = estimate_network(config)
+
+        assert 0 < separable_network['flops'] < network['flops']
+        assert 0 < separable_network['weight_bytes'] < network['weight_bytes']
+
+    # --------------plan_segmentation tests-------------- #
+    @pytest.mark.unit
+    def test_plan_segmentation_without_budget_uses_default_parameters(self):
+        plan = plan_segmentation([(2000, 3000)], 0.1, 0.1, self.config)
+
+        assert plan['fits']
+        assert plan['batch_size'] == 1
+        assert plan['tile_size'] is None
+        assert plan['n_patches'] == count_patches((2000, 3000), self.patch_size)
+
+    @pytest.mark.unit
+    def test_plan_segmentation_fits_large_image_in_small_budget(self):
+        large_image = [(40000, 40000)]
+        max_memory = 4 * 1024 ** 3
+
+        plan = plan_segmentation(large_image, 0.1, 0.1, self.config, max_memory=max_memory)
+        untiled_plan = plan_segmentation(large_image, 0.1, 0.1, self.config, batch_size=plan['batch_size'])
+
+        assert plan['fits']
+        assert plan['peak_memory'] <= max_memory
+        assert plan['tile_size'] is not None
+        assert untiled_plan['peak_memory'] > max_memory
+
+    @pytest.mark.unit
+    def test_plan_segmentation_reports_impossible_budget(self):
+        plan = plan_segmentation([(2000, 3000)], 0.1, 0.1, self.config, max_memory=1024)
+
+        assert not plan['fits']
+        assert plan['batch_size'] == 1
@@ -148,3 +148,29 @@ class TestCore(object):
 
         for fileName in expectedFiles:
             assert fileName in existingFiles
+
+    @pytest.mark.integration
+    def test_train_model_runs_successfully_with_distillation_from_teacher(self):
+        # The teacher is the model trained by the previous test
+        if not (self.modelPath / "model.hdf5").exists():
+            train_model(str(self.trainingPath), str(self.modelPath), self.config_network)
+            K.clear_session()
+
+        studentPath = self.modelPath / "Student"
+        student_config = dict(self.config_network)
+        student_config["features_per_convolution"] = [
+            [[1, 2], [2, 2]],
+            [[2, 4], [4, 4]]
+            ]
+
+        train_model(
+            str(self.trainingPath),
+            str(studentPath),
+            student_config,
+            path_teacher=str(self.modelPath)
+            )
+
+        existingFiles = [f.name for f in studentPath.iterdir()]
+
+        for fileName in ["model.hdf5", "model.ckpt.index", "model.ckpt.meta"]:
+            assert fileName in existingFiles
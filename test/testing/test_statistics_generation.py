@@ -2,12 +2,18 @@
 
 import json
 from pathlib import Path
+import shutil
 import tensorflow as tf
 import pandas as pd
 
 import pytest
 
-from AxonDeepSeg.testing.statistics_generation import metrics_single_wrapper, metrics, metrics_classic_wrapper
+from AxonDeepSeg.testing.statistics_generation import (
+                                                            metrics_single_wrapper,
+                                                            metrics,
+                                                            metrics_classic_wrapper,
+                                                            generate_statistics
+                                                        )
 
 
 class TestCore(object):
@@ -96,6 +102,27 @@ class TestCore(object):
 
         assert (self.modelPath /self.statsFilename).exists()
 
+    # --------------generate_statistics tests-------------- #
+    @pytest.mark.integration
+    def test_generate_statistics_sweeps_all_checkpoints(self):
+        tf.reset_default_graph()
+
+        # Model folder with two checkpoints holding the same weights
+        path_sweep_model = self.testPath / '__test_files__' / '__test_sweep_model__'
+        shutil.copytree(str(self.modelPath), str(path_sweep_model))
+        for path_file in list(path_sweep_model.glob('model.ckpt*')):
+            shutil.copy(str(path_file), str(path_sweep_model / path_file.name.replace('model.ckpt', 'model2.ckpt')))
+
+        try:
+            path_images_folder = [p for p in self.imagesPath.iterdir() if p.is_dir()]
+            stats_dict = generate_statistics(path_sweep_model, path_images_folder, 0.1, 25, inference_batch_size=4)
+        finally:
+            shutil.rmtree(str(path_sweep_model))
+
+        results = list(stats_dict["data"].values())
+        assert len(results) == 2
+        assert results[0]["testing_stats"] == results[1]["testing_stats"]
+
     # --------------metrics class tests-------------- #
     # Though conceptually these could be classified as unit tests, they
     # depend on the outputs of the previous integrity tests, so we count these